@@ -28,6 +28,7 @@ import os
 import shlex, subprocess
 from subprocess import Popen, PIPE, STDOUT
 import re
+import json
 
 from . import alignment
 from . import computeStats
@@ -36,18 +37,110 @@ from . import plotResults
 from . import remappingStats
 from . import assemblyStats
 from .utils import *
+from . import stageCache
+from . import timings
+from . import processRunner
+from . import externalSort
+from . import headerNormalisers
+from multiprocessing import Pool
 
 
 
-# count the number of reads in a file
-def getFileReadNumber(fileName):
-	cmdGrep = """grep ">" -c """ + fileName
-	val = subprocess.check_output(['bash','-c', cmdGrep])
-	return int(val.decode('ascii'))
+# correctors whose read headers can be formatted (registered in headerNormalisers)
+CORRECTORS = list(headerNormalisers.normalisers)
+
+
+
+# names of the files of the assessment of a corrector
+def getCorrectorFiles(outputDirPath, soft):
+	if soft is not None:
+		return {"corrected": outputDirPath + "/corrected_sorted_by_" + soft + ".fa", "triplets": outputDirPath + "/triplets_" + soft + ".tsv", "msa": outputDirPath + "/msa_" + soft + ".fa", "poaFailedReads": outputDirPath + "/poa_failed_reads_" + soft + ".txt", "perReadMetrics": outputDirPath + "/" + soft + "_per_read_metrics.txt", "homopolymers": outputDirPath + "/" + soft + "_homopolymers.txt", "readSizeDistribution": soft + "_read_size_distribution.txt"}
+	else:
+		return {"corrected": outputDirPath + "/corrected_sorted.fa", "triplets": outputDirPath + "/triplets.tsv", "msa": outputDirPath + "/msa.fa", "poaFailedReads": outputDirPath + "/poa_failed_reads.txt", "perReadMetrics": outputDirPath + "/per_read_metrics.txt", "homopolymers": outputDirPath + "/homopolymers.txt", "readSizeDistribution": "read_size_distribution.txt"}
+
+
+
+# name of the partial results file of a corrector for a shard (i, N)
+def getPartialFile(outputDirPath, soft, shard):
+	return outputDirPath + "/partial_results" + ("_" + soft if soft is not None else "") + "_" + str(shard[0]) + "of" + str(shard[1]) + ".json"
+
+
+
+# merge the metrics computed by the jobs of a corrector, in read order, and report them (see computeStats.submitMetricsJobs)
+# returns a tuple of global metrics, or the partial metrics of a shard
+def collectMetrics(jobs, logFile, outputDirPath, f, soft, smallReads, wronglyCorReads, sizeThreshold, shard):
+	parts = []
+	for job in jobs:
+		metrics, usage = job.get()
+		timings.recordTool("computeMetrics", usage[0], usage[1], usage[2], metrics["nbReads"], True)
+		parts.append(metrics)
+	return computeStats.outputRecallPrecision(computeStats.mergeMetrics(parts), f["corrected"], outputDirPath, logFile, smallReads, wronglyCorReads, sizeThreshold, f["readSizeDistribution"], soft, shard)
+
+
+
+# PDF report of a corrector, in its own directory when several correctors are assessed
+def outputReport(outputDirPath, soft, multi, results, avId, cov, nbContigs, nbAlContig, nbBreakpoints, NG50, NG75, remap, assemble):
+	nbReads, throughput, precision, recall, correctBaseRate, errorRate, smallReads, wronglyCorReads, percentGCRef, percentGCCorr, numberSplit, meanMissing, numberExtended, meanExtension, minLength, indelsubsUncorr, indelsubsCorr , truncated, ratioHomopolymer = results
+	reportDir = outputDirPath
+	if multi:
+		reportDir = outputDirPath + "/" + soft
+		if not os.path.exists(reportDir):
+			os.mkdir(reportDir)
+	start = timings.startStage("report" + ("_" + soft if soft is not None else ""))
+	plotResults.generateResults(outputDirPath, installDirectory, soft, nbReads, throughput, recall, precision, correctBaseRate, errorRate, numberSplit, meanMissing, numberExtended, meanExtension, percentGCRef, percentGCCorr, smallReads, wronglyCorReads, minLength, indelsubsUncorr, indelsubsCorr, avId, cov, nbContigs, nbAlContig, nbBreakpoints, NG50, NG75 , remap, assemble, ratioHomopolymer, reportDir)
+	timings.endStage(start)
+
+
+
+# elector merge: combine the partial results files written by the runs of the shards of an assessment (-shard i/N)
+# into the summary, per-read metrics, size distribution and report of a single run
+def merge(argv):
+	parser = argparse.ArgumentParser(prog="elector merge", description="Combine the partial results of the shards of a run (-shard i/N).")
+	parser.add_argument('partials', nargs='+', type=str, help="Partial results files (partial_results*.json) of shards 1 to N, of one or several correctors")
+	parser.add_argument('-output', nargs='?', type=str, action="store", dest="outputDirPath", help="Name for output directory", default=".")
+	parser.add_argument('-noplot',  dest="noplot", action='store_true', default=False, help="Do not output plots and PDF report with R/LaTeX")
+	args = parser.parse_args(argv)
+	outputDirPath = args.outputDirPath
+	if not os.path.exists(outputDirPath):
+		os.mkdir(outputDirPath)
+	logFile = open(outputDirPath + "/log", 'w')
+	timings.setOutput(outputDirPath + "/timings.json")
+	logFile.write("ELECTOR\nCommand line was:\n" + " ".join(sys.argv) + "\n")
+	# partial results of each corrector, in the order of the files
+	partials = {}
+	for fileName in args.partials:
+		with open(fileName) as f:
+			partial = json.load(f)
+		partials.setdefault(partial["corrector"], []).append(partial)
+	multi = len(partials) > 1
+	for soft, parts in partials.items():
+		parts.sort(key=lambda part: part["shard"][0])
+		nbShards = parts[0]["shard"][1]
+		if [part["shard"] for part in parts] != [[i + 1, nbShards] for i in range(nbShards)]:
+			dieToFatalError("partial results of shards 1 to N of a same run are expected, each one once" + (" (corrector " + soft + ")" if soft is not None else "") + ".")
+		if multi:
+			print("********** " + soft + " **********")
+			logFile.write("********** " + soft + " **********\n")
+		start = timings.startStage("merge" + ("_" + soft if soft is not None else ""))
+		metrics = computeStats.mergeMetrics([part["metrics"] for part in parts])
+		metrics["sequenceLengths"] = [length for part in parts for length in part["metrics"]["sequenceLengths"]]
+		results = computeStats.reportMetrics(metrics, outputDirPath, logFile, sum(part["smallReads"] for part in parts), sum(part["wronglyCorrectedReads"] for part in parts), parts[0]["minsize"], getCorrectorFiles(outputDirPath, soft)["readSizeDistribution"], soft)
+		timings.endStage(start, metrics["nbReads"])
+		# remapping and assembly are done on all the reads by shard 1
+		avId, cov = parts[0]["remap"] if parts[0]["remap"] is not None else (0, 0)
+		nbContigs, nbAlContig, nbBreakpoints, NG50, NG75 = 0, 0, 0, 0, 0
+		if parts[0]["assembly"] is not None:
+			nbContigs, nbAlContig, nbBreakpoints, NG50, NG75, cov = parts[0]["assembly"]
+		if not args.noplot:
+			outputReport(outputDirPath, soft, multi, results, avId, cov, nbContigs, nbAlContig, nbBreakpoints, NG50, NG75, parts[0]["remap"] is not None, parts[0]["assembly"] is not None)
+	logFile.close()
+	return 0
 
 
 
 def main():
+	if len(sys.argv) > 1 and sys.argv[1] == "merge":
+		return merge(sys.argv[2:])
 	currentDirectory = os.path.dirname(os.path.abspath(sys.argv[0]))
 	# Manage command line arguments
 	parser = argparse.ArgumentParser(description="Benchmark for quality assessment of long reads correctors.")
@@ -59,30 +152,34 @@ def main():
 	simulator = ""
 	parser = argparse.ArgumentParser()
 	parser.add_argument('-threads', nargs='?', type=int, action="store", dest="threads", help="Number of threads", default=2)
-	parser.add_argument('-corrected', nargs='?', type=str, action="store", dest="corrected", help="Fasta file with corrected reads (each read sequence on one line)")
+	parser.add_argument('-corrected', nargs='+', type=str, action="store", dest="corrected", help="Fasta file with corrected reads (each read sequence on one line). Several files can be given to assess several correctors at once, with their names in the same order with -corrector")
 	parser.add_argument('-split',  dest="split", action='store_true', default=False, help="Corrected reads are split")
 	parser.add_argument('-uncorrected', nargs='?', type=str,  action="store", dest="uncorrected",  help="Prefix of the reads simulation files")
 	parser.add_argument('-perfect', nargs='?', type=str, action="store", dest="perfect", help="Fasta file with reference read sequences (each read sequence on one line)")
 	parser.add_argument('-reference', nargs='?', type=str,  action="store", dest="reference",  help="Fasta file with reference genome sequences (each sequence on one line)")
 	parser.add_argument('-simulator', nargs='?', type=str, action="store", dest="simulator", help="Tool used for the simulation of the long reads (either nanosim, simlord, or real). Value real should be used if assessing real data.")
-	parser.add_argument('-corrector', nargs='?', type=str,  action="store", dest="soft",  help="Corrector used (lowercase, in this list: canu, colormap, consent, daccord, ectools, flas, fmlrc, halc, hercules, hg-color, jabba, lsc, lordec, lorma, mecat, nas, nanocorr, pbdagcon, proovread). If no corrector name is provided, make sure the read's headers are correctly formatted (i.e. they correspond to those of uncorrected and reference files)")
+	parser.add_argument('-corrector', nargs='+', type=str,  action="store", dest="soft",  help="Corrector used (lowercase, in this list: " + ", ".join(sorted(CORRECTORS)) + "). If no corrector name is provided, make sure the read's headers are correctly formatted (i.e. they correspond to those of uncorrected and reference files). One name per file given with -corrected")
 	parser.add_argument('-dazzDb', nargs='?', type=str, action="store", dest="dazzDb", help="Reads database used for the correction, if the reads were corrected with Daccord or PBDagCon")
 	parser.add_argument('-output', nargs='?', type=str, action="store", dest="outputDirPath", help="Name for output directory", default=None)
 	parser.add_argument('-remap',  dest="remap", action='store_true', default=False, help="Perform remapping of the corrected reads to the reference")
 	parser.add_argument('-assemble',  dest="assemble", action='store_true', default=False, help="Perform assembly of the corrected reads")
 	parser.add_argument('-minsize', nargs='?', type=float, action="store", dest="minsize", help="Do not assess reads/fragments chose length is <= MINSIZE %% of the original read", default=10)
 	parser.add_argument('-noplot',  dest="noplot", action='store_true', default=False, help="Do not output plots and PDF report with R/LaTeX")
+	parser.add_argument('-timeout', nargs='?', type=float, action="store", dest="timeout", help="Kill an external tool running for more than TIMEOUT seconds (poa: per group of reads, reads that cannot be aligned in time are left out). No limit by default", default=0)
+	parser.add_argument('-maxmem', nargs='?', type=int, action="store", dest="maxmem", help="Kill an external tool using more than MAXMEM MB of memory (poa: reads that cannot be aligned are left out). No limit by default", default=0)
+	parser.add_argument('-sortmem', nargs='?', type=int, action="store", dest="sortmem", help="Memory (in MB) used to sort the reads files, larger files are sorted on disk", default=1024)
+	parser.add_argument('-shard', nargs='?', type=str, action="store", dest="shard", help="Only assess the i-th of N groups of reads (i/N, e.g. 1/4) and write partial results, to be combined with elector merge. Remapping and assembly are done by shard 1", default=None)
+	parser.add_argument('-nocache',  dest="nocache", action='store_true', default=False, help="Recompute every stage, even if results of a previous run with the same inputs are in the output directory")
 	# get options for this run
 	args = parser.parse_args()
 	if (len(sys.argv) <= 1):
 		parser.print_help()
 		return 0
-	corrected = args.corrected
+	correctedFiles = args.corrected
 	uncorrected = args.uncorrected
 	perfect = args.perfect
 	reference = args.reference
 	split = args.split
-	soft = None
 	dazzDb = args.dazzDb
 	simulator = args.simulator
 	outputDirPath = args.outputDirPath
@@ -91,76 +188,123 @@ def main():
 	noplot = args.noplot
 	size_corrected_read_threshold = args.minsize / 100
 	clipsNb = {}
+	shard = parseShard(args.shard) if args.shard is not None else None
 
 	if not outputDirPath is None:
 		if not os.path.exists(outputDirPath):
 			os.mkdir(outputDirPath)
 		else:
-			printWarningMsg(outputDirPath+ " directory already exists, we will use it.")
-			try:
-				cmdRm = "(cd " + outputDirPath + " && rm *)"
-				subprocess.check_output(['bash','-c', cmdRm])
-			except subprocess.CalledProcessError:
-				pass
+			printWarningMsg(outputDirPath+ " directory already exists, we will use it (stages already computed with the same inputs are not run again).")
 	else:
 		outputDirPath = currentDirectory
+	cache = stageCache.openCache(outputDirPath, not args.nocache)
 	logFile = open(outputDirPath + "/log", 'w')
+	timings.setOutput(outputDirPath + "/timings.json")
+	processRunner.setLimits(args.threads, args.timeout, args.maxmem * 1024)
+	externalSort.setMemory(args.sortmem)
 	logFile.write("ELECTOR\nCommand line was:\n" + " ".join(sys.argv) + "\n")
 
 	reportedHomopolThreshold = 5
 
 	if perfect is not None:
 		simulator = None
-	if args.soft is not None:
-		if args.soft == "proovread" or args.soft == "lordec" or args.soft == "nanocorr" or args.soft == "nas" or args.soft == "colormap" or args.soft == "hg-color" or args.soft == "halc" or args.soft == "pbdagcon" or args.soft == "canu" or args.soft == "lorma" or args.soft == "daccord" or args.soft == "mecat" or args.soft == "jabba" or args.soft == "fmlrc" or args.soft == "flas" or args.soft == "hercules" or args.soft == "consent" or args.soft == "ectools" or args.soft == "lsc":
-			soft = args.soft
-	size =  getFileReadNumber(corrected)
-	if simulator is not None:
-		# Récupération de la map id -> [nbLeftClips, nbRightClips] ici.
-		# Si un vrai simulateur est utilisé, la map récupérée est simplement vide
-		clipsNb = readAndSortFiles.processReadsForAlignment(soft, reference, uncorrected, corrected, size, split, simulator, dazzDb, outputDirPath)
+	if len(correctedFiles) == 1:
+		if args.soft is not None and len(args.soft) > 1:
+			dieToFatalError("one corrector name is expected for one corrected reads file.")
+		softs = [args.soft[0] if args.soft is not None and args.soft[0] in CORRECTORS else None]
 	else:
-		readAndSortFiles.processReadsForAlignment(soft, perfect, uncorrected, corrected, size, split, simulator, dazzDb, outputDirPath)
+		if args.soft is None or len(args.soft) != len(correctedFiles):
+			dieToFatalError("a corrector name (-corrector) is expected for each corrected reads file (-corrected).")
+		for soft in args.soft:
+			if soft not in CORRECTORS:
+				dieToFatalError(soft + " is not a supported corrector.")
+		if len(set(args.soft)) != len(args.soft):
+			dieToFatalError("each corrector can only be assessed once in a run.")
+		softs = args.soft
+	correctedFiles = dict(zip(softs, correctedFiles))
+	multi = len(softs) > 1
+	#reference reads generation and sorting of reference and uncorrected reads are shared by all correctors
+	if not multi and softs[0] is not None:
+		suffix = "_" + softs[0]
+	else:
+		suffix = ""
+	# Récupération de la map id -> [nbLeftClips, nbRightClips] ici.
+	# Si un vrai simulateur est utilisé, la map récupérée est simplement vide
+	clipsNb, uncorrectedReads, sortedUncoFileName, sortedRefFileName = readAndSortFiles.processSharedReads(reference if simulator is not None else perfect, uncorrected, simulator, suffix, outputDirPath, cache, args.threads)
+	sizes = {}
+	for soft in softs:
+		sizes[soft] =  getFileReadNumber(correctedFiles[soft])
+		readAndSortFiles.processReadsForAlignment(soft, uncorrectedReads, sortedUncoFileName, sortedRefFileName, correctedFiles[soft], sizes[soft], split, dazzDb, outputDirPath, cache)
 
 	# Check if the map is correct, ok
 	# for key,val in clipsNb.items():
 	# 	print (key, "=>", val[0], " ", val[1])
 
-	#TOVERIFY
-	if soft is not None:
-		sortedCorrectedFileName = outputDirPath + "/corrected_sorted_by_" + soft + ".fa"
-		sortedUncoFileName =  outputDirPath + "/uncorrected_sorted_duplicated_" + soft + ".fa"
-		sortedRefFileName =  outputDirPath + "/reference_sorted_duplicated_" + soft + ".fa"
-		readSizeDistribution = soft + "_read_size_distribution.txt"
-	else:
-		sortedCorrectedFileName = outputDirPath + "/corrected_sorted.fa"
-		sortedUncoFileName =  outputDirPath + "/uncorrected_sorted_duplicated.fa"
-		sortedRefFileName =  outputDirPath + "/reference_sorted_duplicated.fa"
-		readSizeDistribution = "read_size_distribution.txt"
-	smallReads, wronglyCorReads = alignment.getPOA(sortedCorrectedFileName, sortedRefFileName, sortedUncoFileName, args.threads, outputDirPath, size_corrected_read_threshold, soft)
-	nbReads, throughput, precision, recall, correctBaseRate, errorRate, smallReads, wronglyCorReads, percentGCRef, percentGCCorr, numberSplit, meanMissing, numberExtended, meanExtension, minLength, indelsubsUncorr, indelsubsCorr , truncated, ratioHomopolymer = computeStats.outputRecallPrecision(sortedCorrectedFileName, outputDirPath, logFile, smallReads, wronglyCorReads, reportedHomopolThreshold, size_corrected_read_threshold, readSizeDistribution, clipsNb, 0, 0, soft)
-
-	avId=0
-	cov=0
-	nbContigs=0
-	nbAlContig=0
-	nbBreakpoints=0
-	NG50=0
-	NG75=0
-
-	if remap:
-		print("********** REMAPPING **********")
-		logFile.write("********** REMAPPING **********\n")
-		avId, cov = remappingStats.generateResults(corrected, reference, args.threads, logFile)
-		print("*******************************\n")
-	if assemble:
-		print("********** ASSEMBLY **********")
-		logFile.write("********** ASSEMBLY **********\n")
-		nbContigs, nbAlContig, nbBreakpoints, NG50, NG75, cov = assemblyStats.generateResults(corrected, reference, args.threads, logFile)
-		print("******************************")
-	if not noplot:
-		plotResults.generateResults(outputDirPath, installDirectory, soft, nbReads, throughput, recall, precision, correctBaseRate, errorRate, numberSplit, meanMissing, numberExtended, meanExtension, percentGCRef, percentGCCorr, smallReads, wronglyCorReads, minLength, indelsubsUncorr, indelsubsCorr, avId, cov, nbContigs, nbAlContig, nbBreakpoints, NG50, NG75 , remap, assemble, ratioHomopolymer)
+	#POA and metrics of all correctors are run on the same pool
+	#metrics of a corrector are computed by ranges of reads while the next one is aligned
+	files = {}
+	metricsStages = {}
+	metricsJobs = {}
+	results = {}
+	poaCounts = {}
+	with Pool (processes=args.threads) as pool:
+		for soft in softs:
+			files[soft] = getCorrectorFiles(outputDirPath, soft)
+			f = files[soft]
+			stage = "_" + soft if soft is not None else ""
+			smallReads, wronglyCorReads = stageCache.runStage(cache, "poa" + stage, [f["corrected"], sortedRefFileName, sortedUncoFileName, f["triplets"]], [size_corrected_read_threshold, args.timeout, args.maxmem, shard], [f["msa"], f["poaFailedReads"]], lambda log: alignment.getPOA(f["corrected"], sortedRefFileName, sortedUncoFileName, args.threads, outputDirPath, size_corrected_read_threshold, soft, pool, shard, f["triplets"]), items=sizes[soft])
+			poaCounts[soft] = [smallReads, wronglyCorReads]
+			# a shard only computes partial metrics, the files are written by elector merge
+			metricsOutputs = [f["perReadMetrics"], f["homopolymers"], outputDirPath + "/" + f["readSizeDistribution"]] if shard is None else []
+			metricsStages[soft] = ("metrics" + stage, [f["corrected"], f["msa"]], [smallReads, wronglyCorReads, reportedHomopolThreshold, size_corrected_read_threshold, clipsNb, shard], metricsOutputs)
+			if not stageCache.isCached(cache, *metricsStages[soft][:3]):
+				metricsJobs[soft] = computeStats.submitMetricsJobs(pool, f["msa"], f["corrected"], reportedHomopolThreshold, clipsNb, args.threads)
+		for soft in softs:
+			if multi:
+				print("********** " + soft + " **********")
+				logFile.write("********** " + soft + " **********\n")
+			results[soft] = stageCache.runStage(cache, *metricsStages[soft], lambda log: collectMetrics(metricsJobs[soft], log, outputDirPath, files[soft], soft, poaCounts[soft][0], poaCounts[soft][1], size_corrected_read_threshold, shard), logFile, sizes[soft])
 
+	for soft in softs:
+		corrected = correctedFiles[soft]
+		readsBaseName = os.path.splitext(corrected)[0]
+		stage = "_" + soft if soft is not None else ""
+
+		avId=0
+		cov=0
+		nbContigs=0
+		nbAlContig=0
+		nbBreakpoints=0
+		NG50=0
+		NG75=0
+
+		# remapping and assembly use all the reads, they are done by the first shard only
+		if shard is not None and shard[0] != 1:
+			remapShard = False
+			assembleShard = False
+		else:
+			remapShard = remap
+			assembleShard = assemble
+		if remapShard:
+			print("********** REMAPPING **********")
+			logFile.write("********** REMAPPING **********\n")
+			avId, cov = stageCache.runStage(cache, "remap" + stage, [corrected, reference], [], [readsBaseName + ext for ext in [".sam", ".id", ".bam", "_sorted.bam", ".cov"]], lambda log: remappingStats.generateResults(corrected, reference, args.threads, log), logFile)
+			print("*******************************\n")
+		if assembleShard:
+			print("********** ASSEMBLY **********")
+			logFile.write("********** ASSEMBLY **********\n")
+			nbContigs, nbAlContig, nbBreakpoints, NG50, NG75, cov = stageCache.runStage(cache, "assembly" + stage, [corrected, reference], [], [readsBaseName + ext for ext in [".paf", ".gfa", ".contigs.fa", ".contigs.sam", ".contigs.fs", ".contigs.bam", ".contigs_sorted.bam", ".contigs.cov", ".contigs.id"]], lambda log: assemblyStats.generateResults(corrected, reference, args.threads, log), logFile)
+			print("******************************")
+		if shard is not None:
+			partialFile = getPartialFile(outputDirPath, soft, shard)
+			partial = {"shard": list(shard), "corrector": soft, "minsize": size_corrected_read_threshold, "smallReads": poaCounts[soft][0], "wronglyCorrectedReads": poaCounts[soft][1], "metrics": results[soft], "remap": [avId, cov] if remapShard else None, "assembly": [nbContigs, nbAlContig, nbBreakpoints, NG50, NG75, cov] if assembleShard else None}
+			with open(partialFile + ".tmp", 'w') as f:
+				json.dump(partial, f)
+			os.replace(partialFile + ".tmp", partialFile)
+			print("Partial results of shard " + str(shard[0]) + "/" + str(shard[1]) + " written to " + partialFile + ", combine the partial results of all shards with: elector merge -output <directory> <partial results files>")
+			logFile.write("Partial results written to " + partialFile + "\n")
+		elif not noplot:
+			outputReport(outputDirPath, soft, multi, results[soft], avId, cov, nbContigs, nbAlContig, nbBreakpoints, NG50, NG75, remap, assemble)
 
 
 if __name__ == '__main__':
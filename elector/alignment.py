@@ -31,11 +31,20 @@ import shlex, subprocess
 from subprocess import Popen, PIPE, STDOUT
 import re
 from multiprocessing import Pool, TimeoutError
+import threading
+import queue
 from .utils import *
+from . import processRunner
+from . import tripletStore
 
 
 
-outDirGlobal=""
+# the splitter is run once on all the reads (of the shard), batches are cut on the python side
+MAX_SPLITTER_READS = 2**31 - 1
+# bases (reference, corrected and uncorrected) in a batch, per thread
+BATCH_BASES_PER_THREAD = 1000000
+# poa jobs per thread in a batch
+TASKS_PER_THREAD = 4
 
 
 
@@ -47,24 +56,240 @@ except ImportError:
 
 
 
-# launch subprocess
-def subprocessLauncher(cmd, argstdout=None, argstderr=None,      argstdin=None):
-    args = shlex.split(cmd)
-    p=-1
-    p = (subprocess.Popen(args, stdin = argstdin, stdout = argstdout, stderr = argstderr))
-    return p.wait()
+# poa server of this worker process, started at its first job and kept for the whole run
+# it stops when the worker exits and closes its stdin
+poaServer = None
 
 
 
-def fpoa(i):
-    cmdPOA = installDirectory + "poa -pir " + outDirGlobal + "/smsa"+str(i)+"  -preserve_seqorder -corrected_reads_fasta " + outDirGlobal + "/out3"+str(i)+" -reference_reads_fasta " + outDirGlobal + "/out1"+str(i)+" -uncorrected_reads_fasta " + outDirGlobal +"/out2"+str(i)+" -preserve_seqorder -threads  1 -pathMatrix " + dataDirectory +"blosum80.mat"
-    if( os.stat(""+outDirGlobal + "/out3"+str(i)).st_size != 0):
-        subprocessLauncher(cmdPOA,DEVNULL,DEVNULL)
-    return i
+def getPoaServer():
+    global poaServer
+    if poaServer is None or poaServer.poll() is not None:
+        cmdPOA = installDirectory + "poa -server -preserve_seqorder -threads 1 -pathMatrix " + dataDirectory + "blosum80.mat"
+        poaServer = subprocess.Popen(shlex.split(cmdPOA), stdin=PIPE, stdout=PIPE, stderr=DEVNULL)
+    return poaServer
 
 
 
-def getPOA(corrected, reference, uncorrected, threads, outDir, SIZE_CORRECTED_READ_THRESHOLD, soft=None):
+# align the triplets of a bucket (interleaved reference/corrected/uncorrected FASTA records) with the poa server of the worker
+# buckets and MSAs are sent through its stdin/stdout, each prefixed by its size in bytes on its own line
+# returns the MSAs (6 lines per triplet), the wall time, CPU time and peak RSS of poa for this bucket, and the headers of the triplets that could not be aligned
+# when poa is killed by a time or memory limit (-timeout, -maxmem), the bucket is bisected until the triplets causing it are found:
+# they get empty MSAs, so that the other triplets keep their place, and their reads are left out of the merged msa
+def fpoa(triplets):
+    if triplets == "":
+        return "", [0.0, 0.0, 0], []
+    server = getPoaServer()
+    start = time.time()
+    cpu, peak = timings.processUsage(server.pid)
+    try:
+        msa = processRunner.serverRequest(server, triplets.encode(), "poa").decode()
+    except processRunner.LimitError:
+        lines = triplets.split("\n")[:-1]
+        if len(lines) <= 6:
+            return (lines[0] + "\n\n") * 3, [time.time() - start, 0.0, peak], [lines[0]]
+        half = len(lines) // 12 * 6
+        msa1, usage1, failed1 = fpoa("\n".join(lines[:half]) + "\n")
+        msa2, usage2, failed2 = fpoa("\n".join(lines[half:]) + "\n")
+        return msa1 + msa2, [time.time() - start, usage1[1] + usage2[1], max(usage1[2], usage2[2])], failed1 + failed2
+    cpuAfter, peak = timings.processUsage(server.pid)
+    return msa, [time.time() - start, cpuAfter - cpu, peak], []
+
+
+
+# estimated cost of the poa of a fragment triplet: the corrected fragment is aligned to the reference one, then the uncorrected one to their graph
+def tripletCost(lenRef, lenCor, lenUnco):
+    return lenRef * lenCor + max(lenRef, lenCor) * lenUnco
+
+
+
+# read the blocks written by masterSplitter on stdout, one per read, and yield for each read
+# the interleaved triplets of its fragments, their number, the estimated poa cost and the number of bases
+# small and wrongly corrected reads counts are added to counters when the end of the stream is reached
+def readSplitterOutput(splitterOut, counters):
+    line = splitterOut.readline()
+    while line != "":
+        if line.startswith("#END"):
+            fields = line.split()
+            counters[0] += int(fields[1])
+            counters[1] += int(fields[2])
+        elif line[0] == "#":
+            ref, unco, cor = [[splitterOut.readline() for j in range(2 * int(nb))] for nb in line[1:].split()]
+            triplets = []
+            cost = 0
+            bases = 0
+            for j in range(0, min(len(ref), len(unco), len(cor)), 2):
+                # poa skips empty records, which would shift the following triplets
+                if ref[j+1] != "\n" and cor[j+1] != "\n" and unco[j+1] != "\n":
+                    triplets.append(ref[j] + ref[j+1] + ref[j] + cor[j+1] + ref[j] + unco[j+1])
+                    cost += tripletCost(len(ref[j+1]) - 1, len(cor[j+1]) - 1, len(unco[j+1]) - 1)
+                    bases += len(ref[j+1]) + len(cor[j+1]) + len(unco[j+1]) - 3
+            yield "".join(triplets), len(triplets), cost, bases
+        line = splitterOut.readline()
+
+
+
+# remove the columns of a msa that correspond to padding in the corrected line
+def cleanMsa(ref, cor, unco):
+    if "n" not in cor:
+        return ref, cor, unco
+    newRef, newCor, newUnco = [], [], []
+    pred = 0
+    for i, nt in enumerate(cor):
+        if nt == "n":
+            newRef.append(ref[pred:i])
+            newCor.append(cor[pred:i])
+            newUnco.append(unco[pred:i])
+            pred = i + 1
+    newRef.append(ref[pred:])
+    newCor.append(cor[pred:])
+    newUnco.append(unco[pred:])
+    return "".join(newRef), "".join(newCor), "".join(newUnco)
+
+
+
+# concatenate the msa of consecutive fragments of a same read and append them to the merged msa file (same output as Donatello)
+def mergeMsa(msa, out):
+    lines = msa.split("\n")
+    if lines[-1] == "":
+        lines.pop()
+    if len(lines) == 0:
+        return
+    lines.extend([""] * (6 - len(lines) % 6 if len(lines) % 6 != 0 else 6))
+    accRef, accCor, accUnco = lines[1], lines[3], lines[5]
+    header = lines[4]
+    for i in range(6, len(lines), 6):
+        if header != lines[i + 4]:
+            if len(accRef) > 1:
+                accRef, accCor, accUnco = cleanMsa(accRef, accCor, accUnco)
+                name = header[:len(header) - 11] if len(header) >= 11 else header
+                out.write(name + " \n" + accRef + "\n" + name + " \n" + accCor + "\n" + name + " \n" + accUnco + "\n")
+                header = lines[i + 4]
+            accRef, accCor, accUnco = lines[i + 1], lines[i + 3], lines[i + 5]
+        else:
+            accRef += lines[i + 1]
+            accCor += lines[i + 3]
+            accUnco += lines[i + 5]
+
+
+
+# run the splitter once on the whole files and cut its output in batches of reads, put in batchQueue
+# a batch is closed when it holds batchBases bases, so that batches of long reads hold fewer reads
+def splitBatches(cmdSplitter, batchBases, batchQueue, counters, errors):
+    batch = []
+    bases = 0
+    try:
+        splitter = subprocess.Popen(shlex.split(cmdSplitter), stdout=PIPE, universal_newlines=True)
+        watch = timings.watchProcess(splitter)
+        nbReads = 0
+        for read in readSplitterOutput(splitter.stdout, counters):
+            nbReads += 1
+            batch.append(read)
+            bases += read[3]
+            if bases >= batchBases:
+                batchQueue.put(batch)
+                batch = []
+                bases = 0
+        # a failed splitter may have stopped in the middle of a read: its last batch is not aligned, and the error stops the run before the msa is cached
+        processRunner.checkReturnCode("masterSplitter", timings.waitProcess(splitter, watch, "masterSplitter", nbReads))
+        if len(batch) > 0:
+            batchQueue.put(batch)
+    except Exception as e:
+        errors.append(e)
+    finally:
+        batchQueue.put(None)
+
+
+
+# group the reads of a batch in poa jobs, longest first
+# reads are sorted by decreasing estimated cost and packed in jobs of about 1/(TASKS_PER_THREAD * threads) of the batch cost,
+# so that a read costlier than that is a job on its own, dispatched before the jobs packing small reads
+def scheduleBatch(batch, threads):
+    order = sorted(range(len(batch)), key=lambda i: batch[i][2], reverse=True)
+    targetCost = sum(read[2] for read in batch) / (TASKS_PER_THREAD * threads)
+    tasks = []
+    task = []
+    taskCost = 0
+    for i in order:
+        task.append(i)
+        taskCost += batch[i][2]
+        if taskCost >= targetCost:
+            tasks.append(task)
+            task = []
+            taskCost = 0
+    if len(task) > 0:
+        tasks.append(task)
+    return tasks
+
+
+
+# write the msa of each batch put in resultQueue in the merged msa, in the order of the reads
+# reads with a fragment triplet poa could not align are left out and added to failedReads
+# after an error the queue is still emptied so that the other stages are not blocked
+def mergeBatches(resultQueue, out, failedReads, errors):
+    results = resultQueue.get()
+    while results is not None:
+        if not errors:
+            try:
+                batch, tasks, asyncResults = results
+                msaOfReads = [""] * len(batch)
+                for task, result in zip(tasks, asyncResults):
+                    msa, usage, failed = result.get()
+                    timings.recordTool("poa", usage[0], usage[1], usage[2], sum(batch[i][1] for i in task), True)
+                    lines = msa.split("\n")
+                    if lines[-1] == "":
+                        lines.pop()
+                    # a short or failed reply would give the msa of a triplet to another read
+                    nbTriplets = sum(batch[i][1] for i in task)
+                    if len(lines) != 6 * nbTriplets:
+                        raise RuntimeError("poa: " + str(len(lines)) + " msa lines for " + str(nbTriplets) + " triplets, 6 per triplet expected")
+                    start = 0
+                    # 6 lines per fragment triplet, in the order of the job
+                    for i in task:
+                        end = start + 6 * batch[i][1]
+                        header = batch[i][0][:batch[i][0].find("\n")]
+                        if header in failed:
+                            failedReads.append(header[1:])
+                        else:
+                            msaOfReads[i] = "\n".join(lines[start:end])
+                        start = end
+                    sys.stdout.write('-')
+                    sys.stdout.flush()
+                start = time.time()
+                cpu = time.thread_time()
+                for msa in msaOfReads:
+                    mergeMsa(msa, out)
+                timings.recordTool("merge", time.time() - start, time.thread_time() - cpu, 0, len(batch))
+            except Exception as e:
+                errors.append(e)
+        results = resultQueue.get()
+
+
+
+# pipeline: batch N+1 is split while batch N is aligned by the pool and batch N-1 is merged
+# bounded queues keep at most a few batches in memory
+def alignBatches(pool, cmdSplitter, batchBases, threads, out, counters, failedReads, errors):
+    batchQueue = queue.Queue(maxsize=1)
+    resultQueue = queue.Queue(maxsize=2)
+    splitterThread = threading.Thread(target=splitBatches, args=(cmdSplitter, batchBases, batchQueue, counters, errors))
+    mergerThread = threading.Thread(target=mergeBatches, args=(resultQueue, out, failedReads, errors))
+    splitterThread.start()
+    mergerThread.start()
+    batch = batchQueue.get()
+    while batch is not None:
+        tasks = scheduleBatch(batch, threads)
+        resultQueue.put((batch, tasks, [pool.apply_async(fpoa, ("".join(batch[i][0] for i in task),)) for task in tasks]))
+        batch = batchQueue.get()
+    resultQueue.put(None)
+    splitterThread.join()
+    mergerThread.join()
+
+
+
+# pool: worker pool shared with other jobs (e.g. when several correctors are assessed), a pool of threads processes is created if None
+# shard: (i, N) to align only the i-th of N groups of consecutive reads, all reads if None
+# triplets: triplet store of the sorted reference and uncorrected reads (see tripletStore), the reads files are read sequentially if None
+def getPOA(corrected, reference, uncorrected, threads, outDir, SIZE_CORRECTED_READ_THRESHOLD, soft=None, pool=None, shard=None, triplets=None):
     oldMode=False
     #oldMode=True
     small_reads=0
@@ -79,54 +304,44 @@ def getPOA(corrected, reference, uncorrected, threads, outDir, SIZE_CORRECTED_RE
             subprocess.check_output(['bash','-c', cmdMv])
             return 0, 0
     else:
-        amount_read=1000*10;
-        print("- Means that a large amount of reads has been handled: "+str(amount_read))
-        global installDirectoryGlobal
-        installDirectoryGlobal=installDirectory
-        global outDirGlobal
-        outDirGlobal=outDir
-
-        position_in_read_file=1
+        # batches are sized in bases from the number of threads, the reads they contain depend on their lengths
+        batchBases = BATCH_BASES_PER_THREAD * threads
 
         if soft is not None:
             mergeOut = outDir + "/msa_" + soft + ".fa"
         else:
             mergeOut = outDir + "/msa.fa"
+        out = open(mergeOut, 'w')
+        failedOut = outDir + "/poa_failed_reads" + ("_" + soft if soft is not None else "") + ".txt"
+        if os.path.exists(failedOut):
+            os.remove(failedOut)
+        counters = [0, 0]
+        # a progress file left by an interrupted run would make the splitter skip reads
+        if os.path.exists(outDir + "/progress.txt"):
+            os.remove(outDir + "/progress.txt")
 
-        read_number=0
-
-        while(position_in_read_file!=0):
-            cmdSplitter = installDirectory + "masterSplitter "+ reference +" "+uncorrected+" "+corrected +" " + outDir + "/out1 " + outDir + "/out2 " + outDir + "/out3 7 200 "+str(amount_read)+" "+str(SIZE_CORRECTED_READ_THRESHOLD)+" "+outDir
-            print(cmdSplitter)
-            position_in_read_file=subprocessLauncher(cmdSplitter)
-            #print("done")
-            with open(outDir + "/small_reads.txt") as file:
-                for line in file:
-                    small_reads += int( line.rstrip())
-                    break
-                file.close()
-                cmdRM = "rm " + outDir + "small_reads.txt"
-                subprocess.call(['bash', '-c', cmdRM], stdout=DEVNULL,stderr=DEVNULL)
-            with open(outDir + "/wrongly_cor_reads.txt") as file:
-                for line in file:
-                    wrongly_cor_reads += int(line.rstrip())
-                    break
-                file.close()
-                cmdRM = "rm " + outDir + "wrongly_cor_reads.txt"
-                subprocess.call(['bash', '-c', cmdRM], stdout=DEVNULL, stderr=DEVNULL)
-                with Pool (processes=threads) as pool:
-                    for i in pool.imap_unordered(fpoa, range(200)):
-                        continue
-                    for i in range(0, 200):
-                        cmdMerger = installDirectory + "Donatello " + outDir + "/smsa"+str(i)+ " " + mergeOut
-                        subprocessLauncher(cmdMerger)
-                        sys.stdout.write('-')
-                        sys.stdout.flush()
-
-                    cmdRM = "rm " + outDir + "/out*"
-                    subprocess.call(['bash','-c', cmdRM])
-                    cmdRM = "rm " + outDir + "/smsa*"
-                    subprocess.call(['bash','-c', cmdRM])
+        cmdSplitter = installDirectory + "masterSplitter "+ reference +" "+uncorrected+" "+corrected +" - - - 7 1 "+str(MAX_SPLITTER_READS)+" "+str(SIZE_CORRECTED_READ_THRESHOLD)+" "+outDir
+        if shard is not None:
+            # the splitter only splits the reads of the shard, given as the range of its output blocks (one per reference read)
+            readRange = shardRange(tripletStore.getSize(triplets) if triplets is not None else getFileReadNumber(reference), shard)
+            cmdSplitter += " " + (triplets if triplets is not None else "-") + " " + str(readRange[0]) + " " + str(readRange[1])
+        elif triplets is not None:
+            cmdSplitter += " " + triplets
+        print(cmdSplitter)
+        errors = []
+        failedReads = []
+        if pool is None:
+            with Pool (processes=threads) as pool:
+                alignBatches(pool, cmdSplitter, batchBases, threads, out, counters, failedReads, errors)
+        else:
+            alignBatches(pool, cmdSplitter, batchBases, threads, out, counters, failedReads, errors)
+        out.close()
+        if errors:
+            raise errors[0]
+        if failedReads:
+            with open(failedOut, 'w') as f:
+                f.write("\n".join(failedReads) + "\n")
+            printWarningMsg(str(len(failedReads)) + " reads could not be aligned by poa within the time and memory limits, they are not assessed (see " + failedOut + ").")
+        small_reads, wrongly_cor_reads = counters
 
         return small_reads, wrongly_cor_reads
-
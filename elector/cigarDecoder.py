@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+"""*****************************************************************************
+ *   Authors: Camille Marchet  Pierre Morisse Antoine Limasset
+ *   Contact: camille.marchet@irisa.fr, IRISA/Univ Rennes/GenScale, Campus de Beaulieu, 35042 Rennes Cedex, France
+ *   Source: https://github.com/kamimrcht/benchmark-long-read-correction
+ *
+ *
+ *  This program is free software: you can redistribute it and/or modify
+ *  it under the terms of the GNU Affero General Public License as
+ *  published by the Free Software Foundation, either version 3 of the
+ *  License, or (at your option) any later version.
+ *
+ *  This program is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU Affero General Public License for more details.
+ *
+ *  You should have received a copy of the GNU Affero General Public License
+ *  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+*****************************************************************************"""
+
+
+import re
+import numpy
+
+
+
+# decoding of the CIGAR strings and MD tags of SAM alignments, shared by the reference reads generation and the remapping and assembly stats
+# a CIGAR string is tokenized in a single pass into the total length of each operation, and its soft clips at each end
+OPERATIONS = "MIDNSHP=X"
+M, I, D, N, S, H, P, EQ, X = range(len(OPERATIONS))
+# indexes of the soft clips before the first and after the last aligned operation, in the counts of decodeCigar
+LEFT_CLIPS = len(OPERATIONS)
+RIGHT_CLIPS = LEFT_CLIPS + 1
+NB_COUNTS = RIGHT_CLIPS + 1
+
+CIGAR_PATTERN = re.compile(r"(\d+)([MIDNSHP=X])")
+MD_NUMBERS = re.compile(r"\d+")
+OPERATION_INDEXES = {op: i for i, op in enumerate(OPERATIONS)}
+# alignments decoded at once by the batch functions
+BATCH_SIZE = 10000
+
+
+
+# counts of a CIGAR string: total length of each operation (indexed by M, I, D, ...), then left and right soft clips (LEFT_CLIPS, RIGHT_CLIPS)
+def decodeCigar(cigar):
+	counts = [0] * NB_COUNTS
+	aligned = False
+	clips = 0
+	for length, op in CIGAR_PATTERN.findall(cigar):
+		length = int(length)
+		i = OPERATION_INDEXES[op]
+		counts[i] += length
+		if i == S:
+			clips += length
+		elif i != H:
+			if not aligned:
+				counts[LEFT_CLIPS] = clips
+				aligned = True
+			clips = 0
+	# clips after the last aligned operation, or all of them if there is none
+	if aligned:
+		counts[RIGHT_CLIPS] = clips
+	else:
+		counts[LEFT_CLIPS] = clips
+	return counts
+
+
+
+# number of matching bases of an MD tag value (sum of its numbers)
+def mdMatches(md):
+	return sum(int(n) for n in MD_NUMBERS.findall(md))
+
+
+
+# value of the MD tag of the fields of a SAM line
+def getMd(fields):
+	for tag in fields[11:]:
+		if tag.startswith("MD:Z:"):
+			return tag[5:].rstrip("\n")
+	raise ValueError("alignment of " + fields[0] + " has no MD tag")
+
+
+
+# counts of a list of CIGAR strings, as an array with a line per CIGAR string (see decodeCigar)
+def decodeCigars(cigars):
+	return numpy.array([decodeCigar(cigar) for cigar in cigars], dtype=numpy.int64).reshape(-1, NB_COUNTS)
+
+
+
+# identities (in %) of a list of alignments given as the fields of their SAM lines (with an MD tag):
+# matching bases out of the bases of the read, plus deleted bases, minus soft clipped bases
+def identities(alignments):
+	counts = decodeCigars([fields[5] for fields in alignments])
+	matches = numpy.array([mdMatches(getMd(fields)) for fields in alignments], dtype=numpy.float64)
+	lengths = numpy.array([len(fields[9]) for fields in alignments], dtype=numpy.int64)
+	return matches / (lengths + counts[:, D] - counts[:, S]) * 100
@@ -32,134 +32,130 @@ from subprocess import Popen, PIPE, STDOUT
 import re
 import copy
 import statistics
+import io
+import numpy
 from . import utils
+from . import fastaIndex
+from . import msaReader
 from .utils import *
 
 
 
 THRESH=5
 THRESH2=20
+# per-read arrays of the metrics computed by computeMetrics
+PER_READ_METRICS = ["recall", "precision", "corBasesRate", "uncorCorBasesRate", "GCRateRef", "GCRateCorr", "allLenCorrected", "allLenUncorrected", "missingSize", "extendedBasesCount"]
 
 
 
-def getSplit(fileName):
-	cmdGrep = """grep ">" """ + fileName + """ | uniq -c """
-	lines = subprocess.check_output(['bash','-c', cmdGrep]).decode('ascii')
-	lines = lines.split('\n')
-	#~ lines = subprocess.check_output(['bash','-c', cmdGrep]).decode('ascii').split['\n']
-	readToSplit = dict()
-	for l in lines:
-		if len(l) > 0:
-			nb = int(l.split('>')[0].replace(' ','').replace('\t',''))
-			read = l.split('>')[1].replace(' ','').replace('\t','')
-			readToSplit[read] = int(nb/3)
-	return readToSplit
+# starts and ends (excluded) of the runs of equal values of an array
+def runBounds(values):
+	bounds = numpy.flatnonzero(values[1:] != values[:-1]) + 1
+	if len(values) == 0:
+		return bounds, bounds
+	return numpy.concatenate(([0], bounds)), numpy.concatenate((bounds, [len(values)]))
 
 
 
-#@Camille, modif ici pour les LR corrigés étendus, avec d'autres fonctions de détection de gaps
-def nbLeftGaps(sequence):
-	nbGaps = 0
-	nbNt = 0
-	totalGaps = 0
-	i = 0
-	while (i < len(sequence) and nbNt <= THRESH):
-		if sequence[i] == ".":
-			nbGaps += 1
-			nbNt = 0
-		else:
-			if (nbGaps >= THRESH):
-				totalGaps = i
-			nbGaps = 0
-			nbNt += 1
-		i += 1
+# runs of a msa line: its columns that are gaps ("."), and the starts, ends (excluded), lengths and type (gap or not) of its runs of gaps and of bases, in order
+def msaRuns(sequence):
+	return gapRuns(msaBytes(sequence) == ord("."))
+
+
 
-	return totalGaps
+def gapRuns(isGap):
+	starts, ends = runBounds(isGap)
+	return {"isGap": isGap, "starts": starts, "ends": ends, "lengths": ends - starts, "gaps": isGap[starts]}
+
+
+
+# index of the run of each column
+def columnRuns(runs):
+	return numpy.repeat(numpy.arange(len(runs["starts"])), runs["ends"] - runs["starts"])
 
 
 
 #@Camille, modif ici pour les LR corrigés étendus, avec d'autres fonctions de détection de gaps
-def nbRightGaps(sequence):
-	nbGaps = 0
-	nbNt = 0
-	totalGaps = 0
-	i = len(sequence) - 1
-	while (i >= 0 and nbNt <= THRESH):
-		if sequence[i] == ".":
-			nbGaps += 1
-			nbNt = 0
-		else:
-			if (nbGaps >= THRESH):
-				totalGaps = len(sequence) - i
-			nbGaps = 0
-			nbNt += 1
-		i -= 1
+# number of columns before the last base preceded by at least THRESH gaps, looking from the left until a run of more than THRESH bases
+def nbLeftGaps(runs):
+	starts, lengths, gaps = runs["starts"], runs["lengths"], runs["gaps"]
+	if len(starts) == 0 or (not gaps[0] and lengths[0] > THRESH):
+		return 0
+	longBases = numpy.flatnonzero(~gaps & (lengths > THRESH))
+	last = longBases[0] if len(longBases) > 0 else len(starts) - 1
+	# a run of bases (but the first) follows a run of gaps
+	afterGaps = numpy.flatnonzero(~gaps[1:last + 1] & (lengths[:last] >= THRESH)) + 1
+	return int(starts[afterGaps[-1]]) if len(afterGaps) > 0 else 0
 
-	return totalGaps
+
+
+#@Camille, modif ici pour les LR corrigés étendus, avec d'autres fonctions de détection de gaps
+# same from the right, counting the last base preceded by the gaps
+def nbRightGaps(runs):
+	ends, lengths, gaps = runs["ends"], runs["lengths"], runs["gaps"]
+	if len(ends) == 0 or (not gaps[-1] and lengths[-1] > THRESH):
+		return 0
+	longBases = numpy.flatnonzero(~gaps & (lengths > THRESH))
+	first = longBases[-1] if len(longBases) > 0 else 0
+	beforeGaps = numpy.flatnonzero(~gaps[first:-1] & (lengths[first + 1:] >= THRESH)) + first
+	return int(len(runs["isGap"]) - ends[beforeGaps[0]] + 1) if len(beforeGaps) > 0 else 0
 
 
 
 # find long stretches of "." = trimmed or split reads, and return the coordinates of these regions for the corrected line of a msa
 # if reference is not a "." too, else it means it is a gap opened by the uncorrected part
-def findGapStretches(correctedSequence, referenceSequence, gapsPositions):
-	prev = None
-	countGap = 0
-	countGapRef = 0
+# a column is in a stretch if it is at least the THRESH-th of a run of gaps in the corrected line, and if the gap opened in the reference there is shorter than THRESH2
+# (the gap of the reference is counted on the columns following a gap of the corrected line, see referenceGapCounts)
+# each run of gaps of the corrected line gives a stretch from its first to its last such column, the stretches at the ends of the line are kept
+def findGapStretches(correctedRuns, referenceRuns):
+	length = len(correctedRuns["isGap"])
+	columns = min(length, len(referenceRuns["isGap"]))
+	if columns != length:
+		correctedRuns = gapRuns(correctedRuns["isGap"][:columns])
+	if columns != len(referenceRuns["isGap"]):
+		referenceRuns = gapRuns(referenceRuns["isGap"][:columns])
+	correctedGaps = correctedRuns["isGap"]
+	starts, ends, gaps = correctedRuns["starts"], correctedRuns["ends"], correctedRuns["gaps"]
+	if not numpy.any(gaps & (correctedRuns["lengths"] >= THRESH)): # no run of gaps long enough for a stretch
+		return dict()
+	position = numpy.arange(columns)
+	runOfColumn = columnRuns(correctedRuns)
+	runStart = starts[runOfColumn]
+	# number of gaps of the corrected line counted at each column (the first gap of a run is not counted, but at the start of the line)
+	countGap = numpy.where((position > runStart) | (runStart == 0), position - runStart + 1, 0)
+	inStretch = correctedGaps & (countGap >= THRESH) & (referenceGapCounts(correctedGaps, referenceRuns) < THRESH2)
+	# a run of gaps of the corrected line followed by a base ends a stretch, or an empty one if its gaps are not counted
+	ended = numpy.flatnonzero(gaps & (ends < columns) & ((correctedRuns["lengths"] >= 2) | (starts == 0)))
 	positionsStretch = []
-	pos = 0
-
-	for ntRef,ntResult in zip(referenceSequence, correctedSequence):   # look for gaps in splitted/trimmed corrected read
-			if prev == ".":
-				if ntResult == "." and countGap > 0:  # gaps are dots in msa file
-					countGap += 1
-				if ntResult == "." and countGap == 0:
-					countGap = 2
-				if ntRef == "." and countGapRef > 0:  # gaps are dots in msa file
-					countGapRef += 1
-				if ntRef == "." and countGapRef == 0:
-					countGapRef = 2
-			if prev == None:
-				if ntResult == ".":
-					countGap += 1
-				if ntRef == ".":
-					countGapRef += 1
-			if ntResult != ".":
-				if countGap > 0:
-					positionsStretch.append([])
-				countGap = 0
-			if ntRef != ".":
-				countGapRef = 0
-			if countGap >= THRESH:
-				if countGapRef < THRESH2: #if countGapRef>=THRESH2 it means that a gap is openened both in ref and corrected because of the uncorrected seq in the msa, so this is not a trimmed zone
-					if len(positionsStretch) == 0:
-						positionsStretch.append([pos-THRESH + 1, pos]) # start new stretch of gap with leftmost position
-					else:
-						if len(positionsStretch[-1]) == 0:
-							positionsStretch[-1].extend((pos-THRESH + 1, pos))
-						if len(positionsStretch[-1]) == 2:
-							positionsStretch[-1][1] = pos # update position
-			prev = ntResult
-			pos += 1
+	stretchColumns = numpy.flatnonzero(inStretch)
+	nbStretches = len(ended)
+	if len(stretchColumns) > 0:
+		stretchRuns = runOfColumn[stretchColumns]
+		firsts = numpy.flatnonzero(numpy.concatenate(([True], stretchRuns[1:] != stretchRuns[:-1])))
+		lasts = numpy.concatenate((firsts[1:] - 1, [len(stretchColumns) - 1]))
+		for first, last in zip(stretchColumns[firsts].tolist(), stretchColumns[lasts].tolist()):
+			positionsStretch.append([first - THRESH + 1, last])
+		# the first stretch starts a new one if no run was ended before it, else it is the one of the run ended before
+		if len(ended) == 0 or ended[0] >= stretchRuns[0]:
+			nbStretches += 1
 
 	tmpStretch = []
 	# bords
-	for i,s in enumerate(positionsStretch):
-		if len(positionsStretch) > 1:
-			if len(s) > 0:
-					if s[0] <= THRESH2:
-						tmpStretch.append([0, s[1]])
-					if len(correctedSequence) - s[1] <= THRESH2:
-						tmpStretch.append([s[0], len(correctedSequence) - 1])
-					else:
-						tmpStretch.append([s[0], s[1]])
-		elif  len(positionsStretch) == 1:
-			if len(s) > 0:
-				if s[0] <= THRESH2:
-					tmpStretch.append([0, s[1]])
-				else:
-					tmpStretch.append([s[0], s[1]])
-				if len(correctedSequence) - s[1] <= THRESH2:
-					tmpStretch[-1][1] = len(correctedSequence) - 1
+	for s in positionsStretch:
+		if nbStretches > 1:
+			if s[0] <= THRESH2:
+				tmpStretch.append([0, s[1]])
+			if length - s[1] <= THRESH2:
+				tmpStretch.append([s[0], length - 1])
+			else:
+				tmpStretch.append([s[0], s[1]])
+		else:
+			if s[0] <= THRESH2:
+				tmpStretch.append([0, s[1]])
+			else:
+				tmpStretch.append([s[0], s[1]])
+			if length - s[1] <= THRESH2:
+				tmpStretch[-1][1] = length - 1
 
 	#merge
 	tmpStretch2 = []
@@ -183,36 +179,69 @@ def findGapStretches(correctedSequence, referenceSequence, gapsPositions):
 		if s[0] == 0:
 			if s[1] - s[0] > THRESH2:
 				stretch[s[0]] = s[1]
-		elif s[1] == len(correctedSequence) - 1:
+		elif s[1] == length - 1:
 			if s[1] - s[0] > THRESH2:
 				stretch[s[0]] = s[1]
 	return stretch
 
 
 
+# number of gaps of the reference counted at each column by findGapStretches
+# in a run of gaps of the reference, it counts the columns following a gap of the corrected line (+ 1 once there is one), the first column of the line counts as one
+def referenceGapCounts(correctedGaps, referenceRuns):
+	afterGap = numpy.ones(len(correctedGaps), dtype=int)
+	afterGap[1:] = correctedGaps[:-1]
+	afterGapBefore = numpy.concatenate(([0], numpy.cumsum(afterGap)))
+	runStart = referenceRuns["starts"][columnRuns(referenceRuns)]
+	counts = afterGapBefore[1:] - afterGapBefore[runStart]
+	counts += (runStart > 0) & (counts > 0)
+	return numpy.where(referenceRuns["isGap"], counts, 0)
+
+
+
 # compute recall and precision and writes output files
 #@Camille j'ai aussi fait un peu de ménage ici
 #main function
-def outputRecallPrecision(correctedFileName, outDir, logFile, smallReadNumber, wronglyCorrectedReadsNumber, reportedHomopolThreshold, SIZE_CORRECTED_READ_THRESHOLD,  fileSizeName, clipsNb, beg=0, end=0, soft=None):
+# metrics: metrics of the reads of the msa of the corrector, computed by ranges of reads and merged (see submitMetricsJobs)
+def outputRecallPrecision(metrics, correctedFileName, outDir, logFile, smallReadNumber, wronglyCorrectedReadsNumber, SIZE_CORRECTED_READ_THRESHOLD,  fileSizeName, soft=None, shard=None):
 	print(soft)
-	if soft is not None:
-		#recall, precision
-		outMetrics = open(outDir + "/" + soft + "_per_read_metrics.txt", 'w')
-		outMetrics.write("score metric\n")
-		readsToSplit = getSplit(outDir + "/msa_" + soft + ".fa")
-		nbReads, throughput, uncorThroughput, precision, recall, corBasesRate, errorRate, uncorCorBasesRate, uncorErrorRate, missingSize,  GCRateRef, GCRateCorr,  indelsubsUncorr, indelsubsCorr,  ratioHomopolymers, lenAllCorrectedReads,  countReadSplit, countReadTrimmed, countReadExtended, extendedBasesCount  = computeMetrics(outDir + "/msa_" + soft + ".fa", outMetrics, correctedFileName, reportedHomopolThreshold, clipsNb, readsToSplit )
+	if shard is not None:
+		# partial results, the corrected sequences of the shard are kept for the size distribution
+		lengths = fastaIndex.getIndex(correctedFileName)["lengths"]
+		first, last = shardRange(len(lengths), shard)
+		metrics["sequenceLengths"] = lengths[first:last]
+		return metrics
+	if metrics["countReadSplit"] + metrics["countReadTrimmed"] != 0:
+		metrics["sequenceLengths"] = fastaIndex.getIndex(correctedFileName)["lengths"]
+	return reportMetrics(metrics, outDir, logFile, smallReadNumber, wronglyCorrectedReadsNumber, SIZE_CORRECTED_READ_THRESHOLD, fileSizeName, soft)
+
+
+
+def writeReadMetrics(fileName, metrics):
+	outMetrics = open(fileName, 'w')
+	outMetrics.write("score metric\n")
+	for rec, prec, corBRate in zip(metrics["recall"], metrics["precision"], metrics["corBasesRate"]):
+		outMetrics.write(str(rec) + " recall\n")
+		outMetrics.write(str(prec) + " precision\n")
+		outMetrics.write(str(corBRate) + " correct_rate\n")
+	outMetrics.close()
+
 
-	else:
-		outMetrics = open(outDir + "/per_read_metrics.txt", 'w')
-		outMetrics.write("score metric\n")
-		readsToSplit = getSplit(outDir + "/msa.fa")
 
-		nbReads, throughput, uncorThroughput, precision, recall, corBasesRate, errorRate, uncorCorBasesRate, uncorErrorRate, missingSize,  GCRateRef, GCRateCorr,  indelsubsUncorr, indelsubsCorr,  ratioHomopolymers, lenAllCorrectedReads,  countReadSplit, countReadTrimmed, countReadExtended, extendedBasesCount  = computeMetrics(outDir + "/msa.fa", outMetrics, correctedFileName, reportedHomopolThreshold, clipsNb, readsToSplit)
+# write the per-read metrics, homopolymers and read size distribution files, print and log the summary of the metrics of computeMetrics (or mergeMetrics)
+# metrics["sequenceLengths"]: lengths of the corrected sequences, needed when reads are trimmed or split
+def reportMetrics(metrics, outDir, logFile, smallReadNumber, wronglyCorrectedReadsNumber, SIZE_CORRECTED_READ_THRESHOLD, fileSizeName, soft=None):
+	if soft is not None:
+		writeReadMetrics(outDir + "/" + soft + "_per_read_metrics.txt", metrics)
+		writeHomopolymers(outDir + "/" + soft + "_homopolymers.txt", metrics["homopolymers"])
+	else:
+		writeReadMetrics(outDir + "/per_read_metrics.txt", metrics)
+		writeHomopolymers(outDir + "/homopolymers.txt", metrics["homopolymers"])
+	nbReads, throughput, uncorThroughput, precision, recall, corBasesRate, errorRate, uncorCorBasesRate, uncorErrorRate, missingSize,  GCRateRef, GCRateCorr,  indelsubsUncorr, indelsubsCorr,  ratioHomopolymers, lenAllCorrectedReads,  countReadSplit, countReadTrimmed, countReadExtended, extendedBasesCount = summarizeMetrics(metrics)
 
 	# read lengths
-	outputReadSizeDistribution(correctedFileName, fileSizeName, outDir, countReadSplit+countReadTrimmed, lenAllCorrectedReads)
+	outputReadSizeDistribution(fileSizeName, outDir, countReadSplit+countReadTrimmed, lenAllCorrectedReads, metrics.get("sequenceLengths"))
 
-	outMetrics.close()
 	meanMissingSize = 0
 	if countReadSplit + countReadTrimmed > 0:
 		meanMissingSize = round(sum(missingSize)/(countReadSplit + countReadTrimmed),1)
@@ -264,184 +293,216 @@ def outputRecallPrecision(correctedFileName, outDir, logFile, smallReadNumber, w
 
 
 
+# ranges of reads of a msa scored by separate jobs, for each thread of the pool
+METRICS_RANGES_PER_THREAD = 4
+
+
+
+# submit to the pool the jobs computing the metrics of a msa, by ranges of reads (see msaReader.readRanges), each one with the clips of its reads
+# the metrics of the jobs, in order, give those of the whole msa with mergeMetrics
+def submitMetricsJobs(pool, msaFileName, correctedFileName, reportedThreshold, clipsNb, threads):
+	jobs = []
+	for (start, end), headers in msaReader.readRanges(msaFileName, threads * METRICS_RANGES_PER_THREAD):
+		clips = {header: clipsNb[header] for header in headers if header in clipsNb}
+		jobs.append(pool.apply_async(computeMetricsJob, ((msaFileName, correctedFileName, reportedThreshold, clips, start, end),)))
+	return jobs
+
+
+
+# run computeMetrics on a range of reads in a worker process, and return its metrics with its wall time, CPU time and peak RSS
+def computeMetricsJob(args):
+	start = time.time()
+	cpu = time.process_time()
+	timings.resetPeakMemory()
+	metrics = computeMetrics(*args)
+	return metrics, [time.time() - start, time.process_time() - cpu, timings.peakMemory()]
+
+
+
 def getLen(sequenceMsa):
 	return len(sequenceMsa) - sequenceMsa.count('.')
 
 
 
 # Compute the length distribution of uncorrected and corrected reads
-def outputReadSizeDistribution(correctedFileName, outFileName, outDir, trimmedOrSplit, lenAllReads):
+def outputReadSizeDistribution(outFileName, outDir, trimmedOrSplit, lenAllReads, sequenceLengths):
 	out = open(outDir + "/" + outFileName, 'w')
 	out.write("size type\n")
 	for readSize in lenAllReads:
 		out.write(str(readSize) + " reads\n")
 	if trimmedOrSplit != 0:
-		cor = open(correctedFileName)
-		l = cor.readline()
-		while l != "":
-			l = cor.readline()[:-1]
-			out.write(str(len(l)) + " sequences\n")
-			l = cor.readline()
-		cor.close()
+		for sequenceSize in sequenceLengths:
+			out.write(str(sequenceSize) + " sequences\n")
 	out.close()
 
 
 
-# compute ins, del, subs
-def indels(ntRef, ntUnco, ntResult,  existingCorrectedPositions, position, insU, deleU, subsU, insC, deleC, subsC, reported, detectedHomopolymer, endOfHomopolRef, okToReportRef, reportedThreshold, gapsPositions):
-	#compute indels in uncorrected reads
-	# and homopolymers
-	endOfHomopolResult = True
-	okToAppendR = False
-	okToAppendC = False
+# runs of identical bases of a msa line, gaps aside: their base, first and last columns, and length
+def baseRuns(line):
+	columns = numpy.flatnonzero(line != ord("."))
+	bases = line[columns]
+	starts, ends = runBounds(bases)
+	return {"bases": bases[starts], "first": columns[starts], "last": columns[ends - 1], "lengths": ends - starts}
 
-	if existingCorrectedPositions[position]:
-		##### homopolymers in ref ######
-		if ntRef != '.':
-			if ntRef == reported[0][-1]:
-				okToAppendR = True #elongation of the repeated chain
-				if len(reported[0]) + 1 >= reportedThreshold: #repeated chain of length > THRESHOLD = a homopolymer
-					okToReportRef = True #we can report the homopolymer from now, however it can still be elongate
-			else:
-				if okToReportRef: #we were in a homopolymer and it just terminated at this base => report it
-					endOfHomopolRef = True
 
-	#compute only indels in parts of the MSA that actually correspond to a portion that exist in the corrected read
-		if ntResult != ntRef:
-			if ntRef == ".":
-				insC += 1
-			else:
-				if ntResult != "." :
-					subsC += 1
-				else:
-					deleC += 1
-	##### uncorrected
-		if position not in gapsPositions:
-			if ntUnco != ntRef:
-				if ntRef == ".":
-					insU += 1
-				else:
-					if ntUnco != "." :
-						subsU += 1
 
-					else:
-						deleU += 1
+# homopolymers of a triplet: runs of at least reportedThreshold identical bases in the reference, gaps aside, all in existing corrected positions
+# returns their bases, their sizes in the reference, and their sizes in the corrected read: the longest run of their base in the corrected line, gaps aside, sharing columns with them (0 if none)
+def homopolymerSizes(ref, corr, existing, reportedThreshold):
+	refRuns = baseRuns(ref)
+	missingBefore = numpy.concatenate(([0], numpy.cumsum(~existing)))
+	homopolymers = numpy.flatnonzero((refRuns["lengths"] >= reportedThreshold) & (missingBefore[refRuns["last"] + 1] == missingBefore[refRuns["first"]]))
+	bases = refRuns["bases"][homopolymers]
+	first = refRuns["first"][homopolymers]
+	last = refRuns["last"][homopolymers]
+	corrRuns = baseRuns(corr)
+	# runs of the corrected line sharing columns with each homopolymer, as pairs (homopolymer, run)
+	firstRun = numpy.searchsorted(corrRuns["last"], first)
+	nbRuns = numpy.maximum(numpy.searchsorted(corrRuns["first"], last, side="right") - firstRun, 0)
+	homopolymerOfPair = numpy.repeat(numpy.arange(len(homopolymers)), nbRuns)
+	runOfPair = numpy.arange(nbRuns.sum()) - numpy.repeat(numpy.cumsum(nbRuns) - nbRuns, nbRuns) + numpy.repeat(firstRun, nbRuns)
+	corrSizes = numpy.zeros(len(homopolymers), dtype=int)
+	numpy.maximum.at(corrSizes, homopolymerOfPair, numpy.where(corrRuns["bases"][runOfPair] == bases[homopolymerOfPair], corrRuns["lengths"][runOfPair], 0))
+	return bases, refRuns["lengths"][homopolymers], corrSizes
 
-		##########" homopolymer in corrected ############
-		if ntResult != '.':
-			if ntResult == reported[1][-1]:
-				okToAppendC = True #elongation of the repeated chain
-				endOfHomopolResult = False #we still are elongating of the repeated chain for corrected read => do not stop
 
-	if okToAppendC or okToAppendR:
-		reported[0].append(ntRef)
-		reported[1].append(ntResult)
-	else:
-		if not (endOfHomopolRef and endOfHomopolResult):
-			if (not endOfHomopolRef and ntRef != "."):
-				reported= [[ntRef],[ntResult]]
-
-	if endOfHomopolRef and endOfHomopolResult:  #finally report an homopolymer
-		detectedHomopolymer = True
-		ntH = max(set(reported[0]), key=reported[0].count)
-		if ntH == '.':
-			filtered = list(filter(lambda x:  x!= '.', reported[0]))
-			ntH = max(set(filtered), key=filtered.count)
-		sizeHomopolR = [0]
-		sizeHomopolC = [0]
-		for nt, nt2 in zip(reported[0], reported[1]):
-			if nt == ntH:
-				sizeHomopolR[-1] += 1
-			elif nt != ".":
-				sizeHomopolR.append(0)
-			if nt2 == ntH:
-				sizeHomopolC[-1] += 1
-			elif nt2 != ".":
-				sizeHomopolC.append(0)
-		sizeHomopolReference = max(sizeHomopolR)
-		sizeHomopolCorrected = max(sizeHomopolC)
-		reported = [sizeHomopolReference, sizeHomopolCorrected]
-
-	return insU, deleU, subsU, insC, deleC, subsC, reported, detectedHomopolymer, endOfHomopolRef, okToReportRef
-
-
-
-# compute fp, tp, fn
-# def getCorrectionAtEachPosition(ntRef, ntUnco, ntResult, correctedPositions, existingCorrectedPositions, position, corBases, uncorBase, FP, FN, TP, globalFP, globalFN, globalTP):
-def getCorrectionAtEachPosition(ntRef, ntUnco, ntResult, existingCorrectedPositions, position, corBases, uncorBase, uncorCorBases, uncorUncorBases, FP, FN, TP):
-	#compute FN,FP,TP only on corrected parts
-	# if correctedPositions[position]:
-	if existingCorrectedPositions[position]:
-		if ntRef == ntUnco:  #no error
-			if ntUnco != ntResult: #FP
-				FP += 1
-				uncorBase += 1
-			else:
-				TP += 1
-				corBases += 1
-			uncorCorBases += 1
-		else: #error
-			if ntRef == ntResult: #error corrected
-				TP += 1
-				corBases += 1
-			else:
-				if ntUnco == ntResult: # error not corrected
-					FN += 1
-					FP += 1
-				uncorBase += 1
-			uncorUncorBases += 1
-	return corBases, uncorBase, uncorCorBases, uncorUncorBases, FP, FN, TP
+
+# histogram of the homopolymers: {base: {size in the reference: {size in the corrected read: number of homopolymers}}}
+# sizes are strings, so that it is the same once saved in the partial results of a shard (json)
+def addHomopolymers(histogram, bases, refSizes, corrSizes):
+	for base, refSize, corrSize in zip(bases.tolist(), refSizes.tolist(), corrSizes.tolist()):
+		sizes = histogram.setdefault(chr(base), dict()).setdefault(str(refSize), dict())
+		sizes[str(corrSize)] = sizes.get(str(corrSize), 0) + 1
+	return histogram
+
+
+
+def mergeHomopolymers(histogram, other):
+	for base in other:
+		for refSize in other[base]:
+			sizes = histogram.setdefault(base, dict()).setdefault(refSize, dict())
+			for corrSize, nb in other[base][refSize].items():
+				sizes[corrSize] = sizes.get(corrSize, 0) + nb
+	return histogram
+
+
+
+# rows (base, size in the reference, size in the corrected read, number of homopolymers) of a histogram, in order
+def homopolymerRows(histogram):
+	rows = []
+	for base in sorted(histogram):
+		for refSize in sorted(histogram[base], key=int):
+			for corrSize in sorted(histogram[base][refSize], key=int):
+				rows.append((base, int(refSize), int(corrSize), histogram[base][refSize][corrSize]))
+	return rows
+
+
+
+# mean ratio of the sizes of the homopolymers in the corrected reads and in the reference, each one rounded to 2 decimals (1 if there are less than 2 homopolymers)
+def homopolymerRatio(histogram):
+	nbHomopolymers = 0
+	ratios = 0
+	for base, refSize, corrSize, nb in homopolymerRows(histogram):
+		ratios += nb * round(corrSize * 1.0 / refSize, 2)
+		nbHomopolymers += nb
+	return ratios / nbHomopolymers if nbHomopolymers > 1 else 1
+
+
+
+def writeHomopolymers(fileName, histogram):
+	out = open(fileName, 'w')
+	out.write("base reference_size corrected_size count\n")
+	for row in homopolymerRows(histogram):
+		out.write(" ".join(str(value) for value in row) + "\n")
+	out.close()
+
+
+
+# bits of the code of a column (reference, corrected, uncorrected) of a triplet of the msa, see columnCodes
+REF_IS_UNCO = 1
+REF_IS_CORR = 2
+UNCO_IS_CORR = 4
+REF_GAP = 8
+CORR_GAP = 16
+UNCO_GAP = 32
+# column in the gaps opened at the ends by the reference and the uncorrected read (gapsPositions)
+IN_GAPS = 64
+NB_COLUMN_CODES = 128
+GC_BASES = numpy.zeros(256, dtype=bool)
+GC_BASES[list(b"GCgc")] = True
+
+
+
+# codes of the columns counted by each count of getTPFNFP
+# FP, FN and TP (corBases and uncorBases) compare the correction to the uncorrected base, insC, deleC and subsC the corrected base to the reference, insU, deleU and subsU the uncorrected base to the reference, out of gapsPositions
+def getColumnCounts():
+	codes = numpy.arange(NB_COLUMN_CODES)
+	refIsUnco = (codes & REF_IS_UNCO) != 0
+	refIsCorr = (codes & REF_IS_CORR) != 0
+	uncoIsCorr = (codes & UNCO_IS_CORR) != 0
+	refGap = (codes & REF_GAP) != 0
+	corrGap = (codes & CORR_GAP) != 0
+	uncoGap = (codes & UNCO_GAP) != 0
+	inGaps = (codes & IN_GAPS) != 0
+	errorNotCorrected = ~refIsUnco & ~refIsCorr & uncoIsCorr
+	return {"TP": (refIsUnco & uncoIsCorr) | (~refIsUnco & refIsCorr),
+		"FP": (refIsUnco & ~uncoIsCorr) | errorNotCorrected,
+		"FN": errorNotCorrected,
+		"corBases": (refIsUnco & uncoIsCorr) | (~refIsUnco & refIsCorr),
+		"uncorBases": (refIsUnco & ~uncoIsCorr) | (~refIsUnco & ~refIsCorr),
+		"uncorCorBases": refIsUnco,
+		"uncorUncorBases": ~refIsUnco,
+		"insC": ~refIsCorr & refGap,
+		"deleC": ~refIsCorr & ~refGap & corrGap,
+		"subsC": ~refIsCorr & ~refGap & ~corrGap,
+		"insU": ~inGaps & ~refIsUnco & refGap,
+		"deleU": ~inGaps & ~refIsUnco & ~refGap & uncoGap,
+		"subsU": ~inGaps & ~refIsUnco & ~refGap & ~uncoGap}
+COLUMN_COUNTS = getColumnCounts()
+
+
+
+# bytes of a msa line, as an array
+def msaBytes(sequence):
+	return numpy.frombuffer(sequence.encode(), dtype=numpy.uint8)
+
+
+
+# code of each column of a triplet, from the comparisons of its 3 bases (see the bits above)
+def columnCodes(ref, corr, unco, gapsPositions):
+	codes = (ref == unco).astype(numpy.uint8)
+	codes |= (ref == corr) * numpy.uint8(REF_IS_CORR)
+	codes |= (unco == corr) * numpy.uint8(UNCO_IS_CORR)
+	codes |= (ref == ord(".")) * numpy.uint8(REF_GAP)
+	codes |= (corr == ord(".")) * numpy.uint8(CORR_GAP)
+	codes |= (unco == ord(".")) * numpy.uint8(UNCO_GAP)
+	codes[gapsPositions[:len(codes)]] |= numpy.uint8(IN_GAPS)
+	return codes
 
 
 
 # get insertion deletion substitution FP, FN, TP and GC rates for a triplet
-#~ def getTPFNFP(reference, corrected, uncorrected,  correctedPositions, existingCorrectedPositions, reportedThreshold, ratioHomopolymers, gapsPositions):
-def getTPFNFP(reference, corrected, uncorrected,   existingCorrectedPositions, reportedThreshold, ratioHomopolymers, gapsPositions):
-	position = 0
-	corBases = 0
-	uncorBases = 0
-	uncorCorBases = 0
-	uncorUncorBases = 0
-	FN = 0
-	FP = 0
-	TP = 0
-	GCSumRef = 0
-	GCSumCorr = 0
-	insU = 0
-	deleU = 0
-	subsU = 0
-	insC = 0
-	deleC = 0
-	subsC = 0
-	detectedHomopolymer = False
-	okToReportRef = False
-	endOfHomopolRef = False
-	reported = [['x'],['x']]
-	for ntRef, ntResult, ntUnco in zip(reference, corrected, uncorrected): #zip(reference, uncorrected, corrected):
-		if ntRef.upper() == "G" or ntRef.upper() == "C":
-			GCSumRef += 1
-		if ntResult.upper() ==  "G" or ntResult.upper() == "C":
-			GCSumCorr += 1
-		#insertion deletion substitution
-		insU, deleU, subsU, insC, deleC, subsC, reported, detectedHomopolymer, endOfHomopolRef, okToReportRef= indels(ntRef, ntUnco, ntResult,  existingCorrectedPositions, position, insU, deleU, subsU, insC, deleC, subsC, reported, detectedHomopolymer, endOfHomopolRef, okToReportRef, reportedThreshold, gapsPositions)
-		if detectedHomopolymer:
-			detectedHomopolymer = False
-			okToReportRef = False
-			endOfHomopolRef = False
-			ratioHomopolymers.append(round(reported[1]*1.0/reported[0],2))
-			reported = [ [ntRef], [ntResult]]
-		# HERE replace homopol in U by those in R and if homopol is reported in R dividec hC/hR and append a vector (this vector can be the same for all reads)
-		#FP, FN, TP
-		corBases, uncorBases, uncorCorBases, uncorUncorBases, FP, FN, TP = getCorrectionAtEachPosition(ntRef, ntUnco, ntResult,   existingCorrectedPositions, position,  corBases, uncorBases, uncorCorBases, uncorUncorBases, FP, FN, TP)
-		position += 1
-
-	GCRateRef = round(GCSumRef * 1.0 / getLen(reference),3)
-	GCRateCorr = round(GCSumCorr * 1.0 / getLen(corrected),3)
-	return FP, TP, FN, corBases, uncorBases, uncorCorBases, uncorUncorBases, GCRateRef, GCRateCorr, insU, deleU, subsU, insC, deleC, subsC, ratioHomopolymers
-
-
-
-def outputMetrics(recall, precision,  corBasesRate, uncorCorBasesRate, missingInRead, missingSize, GCRateRef, GCRateCorr, outPerReadMetrics, FPlistForARead, TPlistForARead, FNlistForARead, corBasesForARead, uncorBasesForARead, uncorCorBasesForARead, uncorUncorBasesForARead, totalCorBases, totalUncorBases, uncorTotalCorBases, uncorTOtalUncorBases,  GCRateRefRead, GCRateCorrRead):
+# all the counts but GC are computed only on the existing corrected positions, from the number of columns with each code
+# existingCorrectedPositions and gapsPositions are boolean masks of the columns (see getCorrectedPositions and gapsAndExtensions)
+# homopolymers: histogram of the homopolymers, to which those of the triplet are added (see homopolymerSizes)
+def getTPFNFP(reference, corrected, uncorrected,   existingCorrectedPositions, reportedThreshold, homopolymers, gapsPositions):
+	length = min(len(reference), len(corrected), len(uncorrected))
+	ref = msaBytes(reference[:length])
+	corr = msaBytes(corrected[:length])
+	unco = msaBytes(uncorrected[:length])
+	existing = existingCorrectedPositions[:length]
+	codesNb = numpy.bincount(columnCodes(ref, corr, unco, gapsPositions)[existing], minlength=NB_COLUMN_CODES)
+	counts = dict()
+	for name in COLUMN_COUNTS:
+		counts[name] = int(codesNb[COLUMN_COUNTS[name]].sum())
+	GCRateRef = round(int(numpy.count_nonzero(GC_BASES[ref])) * 1.0 / getLen(reference),3)
+	GCRateCorr = round(int(numpy.count_nonzero(GC_BASES[corr])) * 1.0 / getLen(corrected),3)
+	homopolymers = addHomopolymers(homopolymers, *homopolymerSizes(ref, corr, existing, reportedThreshold))
+	return counts["FP"], counts["TP"], counts["FN"], counts["corBases"], counts["uncorBases"], counts["uncorCorBases"], counts["uncorUncorBases"], GCRateRef, GCRateCorr, counts["insU"], counts["deleU"], counts["subsU"], counts["insC"], counts["deleC"], counts["subsC"], homopolymers
+
+
+
+def outputMetrics(recall, precision,  corBasesRate, uncorCorBasesRate, missingInRead, missingSize, GCRateRef, GCRateCorr, FPlistForARead, TPlistForARead, FNlistForARead, corBasesForARead, uncorBasesForARead, uncorCorBasesForARead, uncorUncorBasesForARead, totalCorBases, totalUncorBases, uncorTotalCorBases, uncorTOtalUncorBases,  GCRateRefRead, GCRateCorrRead):
 	if FPlistForARead != [] or TPlistForARead != [] or FNlistForARead != [] or corBasesForARead != []:
 		FNsum = sum(FNlistForARead)
 		TPsum = sum(TPlistForARead)
@@ -452,9 +513,6 @@ def outputMetrics(recall, precision,  corBasesRate, uncorCorBasesRate, missingIn
 			missingSize.append(missingInRead)
 		corBRate = sum(corBasesForARead)/(sum(corBasesForARead) + sum(uncorBasesForARead)) if (sum(corBasesForARead) + sum(uncorBasesForARead)) != 0 else 0
 		uncorCorBRate = sum(uncorCorBasesForARead)/(sum(uncorCorBasesForARead) + sum(uncorUncorBasesForARead)) if (sum(uncorCorBasesForARead) + sum(uncorUncorBasesForARead)) != 0 else 0
-		outPerReadMetrics.write(str(rec) + " recall\n")
-		outPerReadMetrics.write(str(prec) + " precision\n")
-		outPerReadMetrics.write(str(corBRate) + " correct_rate\n")
 		recall.append(rec)
 		precision.append(prec)
 		corBasesRate.append(corBRate)
@@ -465,31 +523,37 @@ def outputMetrics(recall, precision,  corBasesRate, uncorCorBasesRate, missingIn
 		uncorTOtalUncorBases += sum(uncorUncorBasesForARead)
 	GCRateRef.append(GCRateRefRead)
 	GCRateCorr.append(GCRateCorrRead)
-	return recall, precision,  corBasesRate, uncorCorBasesRate, missingSize, GCRateRef, GCRateCorr, outPerReadMetrics, totalCorBases, totalUncorBases
+	return recall, precision,  corBasesRate, uncorCorBasesRate, missingSize, GCRateRef, GCRateCorr, totalCorBases, totalUncorBases
 
 
 
-def gapsAndExtensions(reference, corrected, uncorrected, gapsPositions, isExtended, isTrimmed, extendedBasesCount, missingSize):
-	refGapsLeft = nbLeftGaps(reference)
-	uncoGapsLeft = nbLeftGaps(uncorrected)
+# gapsPositions: mask of the columns of the gaps opened at the ends of the msa by both the reference and the uncorrected read
+# the runs of gaps of the 3 lines of the triplet are found once, see msaRuns
+def gapsAndExtensions(reference, corrected, uncorrected, isExtended, isTrimmed, extendedBasesCount, missingSize):
+	referenceRuns = msaRuns(reference)
+	correctedRuns = msaRuns(corrected)
+	uncorrectedRuns = msaRuns(uncorrected)
+	gapsPositions = numpy.zeros(len(reference), dtype=bool)
+	refGapsLeft = nbLeftGaps(referenceRuns)
+	uncoGapsLeft = nbLeftGaps(uncorrectedRuns)
 	gapsLeft = min(refGapsLeft, uncoGapsLeft)
 	if (gapsLeft >= THRESH):
-		gapsPositions.extend(i for i in range(gapsLeft))
+		gapsPositions[:gapsLeft] = True
 		if gapsLeft >= THRESH2:
 			isExtended = True
-			extendedBasesCount.append(gapsLeft - corrected[:gapsLeft].count('.'))
-	refGapsRight = nbRightGaps(reference)
-	uncoGapsRight = nbRightGaps(uncorrected)
+			extendedBasesCount.append(gapsLeft - int(numpy.count_nonzero(correctedRuns["isGap"][:gapsLeft])))
+	refGapsRight = nbRightGaps(referenceRuns)
+	uncoGapsRight = nbRightGaps(uncorrectedRuns)
 	gapsRight = min(refGapsRight, uncoGapsRight)
 	if (gapsRight >= THRESH):
-		gapsPositions.extend(i for i in range(len(reference) - 1, len(reference) - gapsRight, - 1))
+		gapsPositions[len(reference) - gapsRight + 1:] = True
 		if gapsRight >= THRESH2:
 			isExtended = True
-			extendedBasesCount.append(gapsRight - corrected[len(reference) - gapsRight + 1:].count('.'))
-	stretches = findGapStretches(corrected, reference, gapsPositions)
+			extendedBasesCount.append(gapsRight - int(numpy.count_nonzero(correctedRuns["isGap"][len(reference) - gapsRight + 1:])))
+	stretches = findGapStretches(correctedRuns, referenceRuns)
 	totalGaps =  gapsLeft + gapsRight
 	for s in stretches:
-		missingSize += stretches[s] - s - (reference[s: stretches[s]+1].count('.'))
+		missingSize += stretches[s] - s - int(numpy.count_nonzero(referenceRuns["isGap"][s: stretches[s]+1]))
 	missingSize -= totalGaps
 	if missingSize < 0:
 		missingSize = 0
@@ -499,8 +563,8 @@ def gapsAndExtensions(reference, corrected, uncorrected, gapsPositions, isExtend
 
 
 
-def nucleotideMetrics(reference, corrected, uncorrected,  existingCorrectedPositionsInThisRead, reportedThreshold, ratioHomopolymers, gapsPositions, indelsubsCorr,  corBasesForARead, uncorBasesForARead, uncorCorBasesForARead, uncorUncorBasesForARead, FPlistForARead, TPlistForARead, FNlistForARead,  allLenCorrected, allLenUncorrected):
-	FP, TP, FN, corBases, uncorBases, uncorCorBases, uncorUncorBases, GCRateRefRead, GCRateCorrRead, insU, deleU, subsU, insC, deleC, subsC, ratioHomopolymers = getTPFNFP(reference, corrected, uncorrected, existingCorrectedPositionsInThisRead, reportedThreshold, ratioHomopolymers, gapsPositions)
+def nucleotideMetrics(reference, corrected, uncorrected,  existingCorrectedPositionsInThisRead, reportedThreshold, homopolymers, gapsPositions, indelsubsCorr,  corBasesForARead, uncorBasesForARead, uncorCorBasesForARead, uncorUncorBasesForARead, FPlistForARead, TPlistForARead, FNlistForARead,  allLenCorrected, allLenUncorrected):
+	FP, TP, FN, corBases, uncorBases, uncorCorBases, uncorUncorBases, GCRateRefRead, GCRateCorrRead, insU, deleU, subsU, insC, deleC, subsC, homopolymers = getTPFNFP(reference, corrected, uncorrected, existingCorrectedPositionsInThisRead, reportedThreshold, homopolymers, gapsPositions)
 	indelsubsCorr[0] += insC
 	indelsubsCorr[1] += deleC
 	indelsubsCorr[2] += subsC
@@ -516,10 +580,9 @@ def nucleotideMetrics(reference, corrected, uncorrected,  existingCorrectedPosit
 
 
 
-def computeMetrics(fileName, outPerReadMetrics, correctedFileName, reportedThreshold, clipsNb, readsToSplit):
-	msa = open(fileName, 'r')
-	nbLines = 0
-	lines = msa.readlines()
+# metrics of the reads of a msa file, as raw counts and per-read arrays (see mergeMetrics and summarizeMetrics)
+# the msa is read one read at a time, with all the fragments of a split read (see msaReader), from the read starting at byte start to end
+def computeMetrics(fileName, correctedFileName, reportedThreshold, clipsNb, start=0, end=None):
 	nbReadsToDivide = 0
 	readNo = 0
 	countReadSplit = 0
@@ -539,140 +602,118 @@ def computeMetrics(fileName, outPerReadMetrics, correctedFileName, reportedThres
 	totalUncorBases = 0
 	uncorTotalCorBases = 0
 	uncorTOtalUncorBases = 0
-	totalUncorCorBases = 0
-	totalUncorUncorBases = 0
 	GCRateRef = []
 	GCRateCorr = []
-	while nbLines < len(lines):
-		if not ">" in lines[nbLines]:
-			nbFragments = readsToSplit[headerNo]
-			isExtended = False
-			isSplit = False
-			isTrimmed = False
-			gapsPositions = []
-			FPlistForARead = []
-			TPlistForARead = []
-			FNlistForARead = []
-			corBasesForARead = []
-			uncorBasesForARead = []
-			uncorCorBasesForARead = []
-			uncorUncorBasesForARead = []
-			ratioHomopolymers = []
-			missingInRead = 0
-			GCRateRefRead = 0
-			GCRateCorrRead = 0
-			if nbFragments > 1: #split read
-				countReadSplit += 1
-				splits = 1
-				realNotMissing = []
-				tmpindelsubsUncorr = [[],[],[]]
-				while splits <= nbFragments:
-					gapsPositions = []
-					reference = lines[nbLines].rstrip() # get msa for ref
-					nbLines += 2
-					corrected =  lines[nbLines].rstrip() # msa for uncorrected
-					nbLines += 2
-					uncorrected = lines[nbLines].rstrip() # msa for corrected
-					nbLines += 1
-					if len(reference) > 10:
-						if splits == 1:
-							allLenUncorrected.append(getLen(uncorrected))
-						# upperCasePositions = getUpperCasePositions(correctedFileName, headerNo, corrected)
-						# gaps and extensions
-						gapsPositions, isExtended , extendedBasesCount, missingInRead, stretches, isTrimmed, totalGaps = gapsAndExtensions(reference, corrected, uncorrected, gapsPositions, isExtended, isTrimmed, extendedBasesCount, missingInRead)
-						## zones where the corrected read does not exist / where the correction is not done
-						# correctedPositionsRead, existingCorrectedPositionsInThisRead, clips = getCorrectedPositions(stretches, corrected, readNo, upperCasePositions, reference,  clipsNb, header, gapsPositions)
-						existingCorrectedPositionsInThisRead, clips = getCorrectedPositions(stretches, corrected, readNo, reference,  clipsNb, header, gapsPositions)
-						## indels, subs, TP, FP, FN...
-						# indelsubsCorr,  corBasesForARead, uncorBasesForARead, FPlistForARead, TPlistForARead, FNlistForARead, globalFPlistForARead, globalTPlistForARead, globalFNlistForARead, allLenCorrected, GCRateRefRead, GCRateCorrRead,  insU, deleU, subsU  = nucleotideMetrics(reference, corrected, uncorrected, correctedPositionsRead, existingCorrectedPositionsInThisRead, reportedThreshold, ratioHomopolymers, gapsPositions, indelsubsCorr,  corBasesForARead, uncorBasesForARead, FPlistForARead, TPlistForARead, FNlistForARead, globalFPlistForARead, globalTPlistForARead, globalFNlistForARead, allLenCorrected)
-						indelsubsCorr,  corBasesForARead, uncorBasesForARead, uncorCorBasesForARead, uncorUncorBasesForARead, FPlistForARead, TPlistForARead, FNlistForARead,  allLenCorrected, allLenUncorrected, GCRateRefRead, GCRateCorrRead,  insU, deleU, subsU  = nucleotideMetrics(reference, corrected, uncorrected,  existingCorrectedPositionsInThisRead, reportedThreshold, ratioHomopolymers, gapsPositions, indelsubsCorr,  corBasesForARead, uncorBasesForARead, uncorCorBasesForARead, uncorUncorBasesForARead, FPlistForARead, TPlistForARead, FNlistForARead, allLenCorrected, allLenUncorrected)
-						for pos,cor in enumerate(existingCorrectedPositionsInThisRead):
-							if cor:
-								realNotMissing.append(pos)
-						indelsubsUncorr[0] += insU
-						indelsubsUncorr[1] += deleU
-						indelsubsUncorr[2] += subsU
-						if splits == readsToSplit[headerNo]:
-							missingInRead = 0
-							for pos in range(len(reference)):
-								if pos not in realNotMissing and reference[pos] != '.':
-									missingInRead += 1
-							maxim = 0
-							recall, precision,  corBasesRate, uncorCorBasesRate, missingSize, GCRateRef, GCRateCorr, outPerReadMetrics, totalCorBases, totalUncorBases = outputMetrics(recall, precision,corBasesRate, uncorCorBasesRate, missingInRead, missingSize, GCRateRef, GCRateCorr, outPerReadMetrics, FPlistForARead, TPlistForARead, FNlistForARead, corBasesForARead, uncorBasesForARead, uncorCorBasesForARead, uncorUncorBasesForARead, totalCorBases, totalUncorBases, uncorTotalCorBases, uncorTOtalUncorBases,  GCRateRefRead, GCRateCorrRead)
-							if isExtended:
-								countReadExtended += 1
-							nbReadsToDivide += 1
-						if nbLines < len(lines) :
-							headerNo = lines[nbLines].split(">")[1].split(" ")[0]
-							header = lines[nbLines].split(">")[1].rstrip()
-							nbLines += 1
-					else:
-						if nbLines < len(lines) :
-							headerNo = lines[nbLines].split(">")[1].split(" ")[0]
-							header = lines[nbLines].split(">")[1].rstrip()
-							nbLines += 1
-					readNo += 1
-					splits += 1
-
-			else: # not split
-				reference = lines[nbLines].rstrip() # get msa for ref
-				nbLines += 2
-				corrected =  lines[nbLines].rstrip() # msa for corrected
-				nbLines += 2
-				uncorrected = lines[nbLines].rstrip()
-				nbLines += 1
+	homopolymers = dict()
+	nbMsaReads = 0
+	for header, fragments in msaReader.readMsa(fileName, start, end):
+		nbFragments = len(fragments)
+		nbMsaReads += 1
+		isExtended = False
+		isSplit = False
+		isTrimmed = False
+		FPlistForARead = []
+		TPlistForARead = []
+		FNlistForARead = []
+		corBasesForARead = []
+		uncorBasesForARead = []
+		uncorCorBasesForARead = []
+		uncorUncorBasesForARead = []
+		missingInRead = 0
+		GCRateRefRead = 0
+		GCRateCorrRead = 0
+		if nbFragments > 1: #split read
+			countReadSplit += 1
+			realNotMissing = numpy.zeros(0, dtype=bool) # mask of the columns existing in at least one fragment
+			for splits, (reference, corrected, uncorrected) in enumerate(fragments, 1):
 				if len(reference) > 10:
-					allLenUncorrected.append(getLen(uncorrected))
+					if splits == 1:
+						allLenUncorrected.append(getLen(uncorrected))
 					# upperCasePositions = getUpperCasePositions(correctedFileName, headerNo, corrected)
 					# gaps and extensions
-					gapsPositions, isExtended , extendedBasesCount, missingInRead, stretches, isTrimmed, totalGaps = gapsAndExtensions(reference, corrected, uncorrected, gapsPositions, isExtended, isTrimmed, extendedBasesCount, missingInRead)
+					gapsPositions, isExtended , extendedBasesCount, missingInRead, stretches, isTrimmed, totalGaps = gapsAndExtensions(reference, corrected, uncorrected, isExtended, isTrimmed, extendedBasesCount, missingInRead)
 					## zones where the corrected read does not exist / where the correction is not done
-					# correctedPositionsRead, existingCorrectedPositionsInThisRead, clips = getCorrectedPositions(stretches, corrected, readNo, upperCasePositions, reference,  clipsNb, header, gapsPositions)
 					existingCorrectedPositionsInThisRead, clips = getCorrectedPositions(stretches, corrected, readNo, reference,  clipsNb, header, gapsPositions)
 					## indels, subs, TP, FP, FN...
-					# indelsubsCorr,  corBasesForARead, uncorBasesForARead, FPlistForARead, TPlistForARead, FNlistForARead, globalFPlistForARead, globalTPlistForARead, globalFNlistForARead, allLenCorrected, GCRateRefRead, GCRateCorrRead, insU, deleU, subsU = nucleotideMetrics(reference, corrected, uncorrected, correctedPositionsRead, existingCorrectedPositionsInThisRead, reportedThreshold, ratioHomopolymers, gapsPositions, indelsubsCorr, corBasesForARead, uncorBasesForARead, FPlistForARead, TPlistForARead, FNlistForARead, globalFPlistForARead, globalTPlistForARead, globalFNlistForARead, allLenCorrected)
-					indelsubsCorr,  corBasesForARead, uncorBasesForARead, uncorCorBasesForARead, uncorUncorBasesForARead, FPlistForARead, TPlistForARead, FNlistForARead,  allLenCorrected, allLenUncorrected, GCRateRefRead, GCRateCorrRead, insU, deleU, subsU = nucleotideMetrics(reference, corrected, uncorrected,  existingCorrectedPositionsInThisRead, reportedThreshold, ratioHomopolymers, gapsPositions, indelsubsCorr, corBasesForARead, uncorBasesForARead, uncorCorBasesForARead, uncorUncorBasesForARead, FPlistForARead, TPlistForARead, FNlistForARead,  allLenCorrected, allLenUncorrected)
+					indelsubsCorr,  corBasesForARead, uncorBasesForARead, uncorCorBasesForARead, uncorUncorBasesForARead, FPlistForARead, TPlistForARead, FNlistForARead,  allLenCorrected, allLenUncorrected, GCRateRefRead, GCRateCorrRead,  insU, deleU, subsU  = nucleotideMetrics(reference, corrected, uncorrected,  existingCorrectedPositionsInThisRead, reportedThreshold, homopolymers, gapsPositions, indelsubsCorr,  corBasesForARead, uncorBasesForARead, uncorCorBasesForARead, uncorUncorBasesForARead, FPlistForARead, TPlistForARead, FNlistForARead, allLenCorrected, allLenUncorrected)
+					if len(existingCorrectedPositionsInThisRead) > len(realNotMissing):
+						realNotMissing = numpy.concatenate((realNotMissing, numpy.zeros(len(existingCorrectedPositionsInThisRead) - len(realNotMissing), dtype=bool)))
+					realNotMissing[:len(existingCorrectedPositionsInThisRead)] |= existingCorrectedPositionsInThisRead
 					indelsubsUncorr[0] += insU
 					indelsubsUncorr[1] += deleU
 					indelsubsUncorr[2] += subsU
-					recall, precision, corBasesRate, uncorCorBasesRate, missingSize, GCRateRef, GCRateCorr, outPerReadMetrics, totalCorBases, totalUncorBases= outputMetrics(recall, precision,corBasesRate, uncorCorBasesRate, missingInRead, missingSize, GCRateRef, GCRateCorr, outPerReadMetrics, FPlistForARead, TPlistForARead, FNlistForARead, corBasesForARead, uncorBasesForARead, uncorCorBasesForARead, uncorUncorBasesForARead, totalCorBases, totalUncorBases, uncorTotalCorBases, uncorTOtalUncorBases, GCRateRefRead, GCRateCorrRead)
-					if isExtended:
-						countReadExtended += 1
-					if isTrimmed:
-						countReadTrimmed += 1
-					nbReadsToDivide += 1
-					readNo += 1
-					if nbLines < len(lines):
-						headerNo = lines[nbLines].split(">")[1].split(" ")[0]
-						header = lines[nbLines].split(">")[1].rstrip()
-						nbLines += 1
-				else:
-					readNo += 1
-					if nbLines < len(lines):
-						headerNo = lines[nbLines].split(">")[1].split(" ")[0]
-						header = lines[nbLines].split(">")[1].rstrip()
-						nbLines += 1
-		else:
-			headerNo = lines[nbLines].split(">")[1].split(" ")[0]
-			header = lines[nbLines].split(">")[1].rstrip()
-			nbLines += 1
-
-	# compute global metrics
-	GCRateRef = round(sum(GCRateRef) / len(GCRateRef),3)
-	GCRateCorr = round(sum(GCRateCorr) / len(GCRateCorr),3)
-	recall = sum(recall)*1.0 / nbReadsToDivide if nbReadsToDivide != 0 else 0
-	precision = sum(precision)*1.0 / nbReadsToDivide if nbReadsToDivide != 0 else 0
-	corBasesRate = sum(corBasesRate)*1.0 / nbReadsToDivide if nbReadsToDivide != 0 else 0
-	uncorCorBasesRate = sum(uncorCorBasesRate)*1.0 / nbReadsToDivide if nbReadsToDivide != 0 else 0
-	throughput = sum(allLenCorrected)
-	uncorThroughput = sum (allLenUncorrected)
+					if splits == nbFragments:
+						notMissing = numpy.zeros(len(reference), dtype=bool)
+						notMissing[:len(realNotMissing)] = realNotMissing[:len(reference)]
+						missingInRead = int(numpy.count_nonzero(~notMissing & (msaBytes(reference) != ord("."))))
+						recall, precision,  corBasesRate, uncorCorBasesRate, missingSize, GCRateRef, GCRateCorr, totalCorBases, totalUncorBases = outputMetrics(recall, precision,corBasesRate, uncorCorBasesRate, missingInRead, missingSize, GCRateRef, GCRateCorr, FPlistForARead, TPlistForARead, FNlistForARead, corBasesForARead, uncorBasesForARead, uncorCorBasesForARead, uncorUncorBasesForARead, totalCorBases, totalUncorBases, uncorTotalCorBases, uncorTOtalUncorBases,  GCRateRefRead, GCRateCorrRead)
+						if isExtended:
+							countReadExtended += 1
+						nbReadsToDivide += 1
+				readNo += 1
+
+		else: # not split
+			reference, corrected, uncorrected = fragments[0]
+			if len(reference) > 10:
+				allLenUncorrected.append(getLen(uncorrected))
+				# upperCasePositions = getUpperCasePositions(correctedFileName, headerNo, corrected)
+				# gaps and extensions
+				gapsPositions, isExtended , extendedBasesCount, missingInRead, stretches, isTrimmed, totalGaps = gapsAndExtensions(reference, corrected, uncorrected, isExtended, isTrimmed, extendedBasesCount, missingInRead)
+				## zones where the corrected read does not exist / where the correction is not done
+				existingCorrectedPositionsInThisRead, clips = getCorrectedPositions(stretches, corrected, readNo, reference,  clipsNb, header, gapsPositions)
+				## indels, subs, TP, FP, FN...
+				indelsubsCorr,  corBasesForARead, uncorBasesForARead, uncorCorBasesForARead, uncorUncorBasesForARead, FPlistForARead, TPlistForARead, FNlistForARead,  allLenCorrected, allLenUncorrected, GCRateRefRead, GCRateCorrRead, insU, deleU, subsU = nucleotideMetrics(reference, corrected, uncorrected,  existingCorrectedPositionsInThisRead, reportedThreshold, homopolymers, gapsPositions, indelsubsCorr, corBasesForARead, uncorBasesForARead, uncorCorBasesForARead, uncorUncorBasesForARead, FPlistForARead, TPlistForARead, FNlistForARead,  allLenCorrected, allLenUncorrected)
+				indelsubsUncorr[0] += insU
+				indelsubsUncorr[1] += deleU
+				indelsubsUncorr[2] += subsU
+				recall, precision, corBasesRate, uncorCorBasesRate, missingSize, GCRateRef, GCRateCorr, totalCorBases, totalUncorBases= outputMetrics(recall, precision,corBasesRate, uncorCorBasesRate, missingInRead, missingSize, GCRateRef, GCRateCorr, FPlistForARead, TPlistForARead, FNlistForARead, corBasesForARead, uncorBasesForARead, uncorCorBasesForARead, uncorUncorBasesForARead, totalCorBases, totalUncorBases, uncorTotalCorBases, uncorTOtalUncorBases, GCRateRefRead, GCRateCorrRead)
+				if isExtended:
+					countReadExtended += 1
+				if isTrimmed:
+					countReadTrimmed += 1
+				nbReadsToDivide += 1
+			readNo += 1
+
+	return {"nbReads": nbReadsToDivide, "nbMsaReads": nbMsaReads, "countReadSplit": countReadSplit, "countReadTrimmed": countReadTrimmed, "countReadExtended": countReadExtended, "totalCorBases": totalCorBases, "totalUncorBases": totalUncorBases, "indelsubsUncorr": indelsubsUncorr, "indelsubsCorr": indelsubsCorr, "recall": recall, "precision": precision, "corBasesRate": corBasesRate, "uncorCorBasesRate": uncorCorBasesRate, "GCRateRef": GCRateRef, "GCRateCorr": GCRateCorr, "allLenCorrected": allLenCorrected, "allLenUncorrected": allLenUncorrected, "missingSize": missingSize, "extendedBasesCount": extendedBasesCount, "homopolymers": homopolymers}
+
+
+
+# metrics of consecutive groups of reads (e.g. shards), given in read order, as if they were computed at once
+# counts and homopolymer histograms are summed and per-read arrays concatenated
+def mergeMetrics(metricsList):
+	merged = {"nbReads": 0, "nbMsaReads": 0, "countReadSplit": 0, "countReadTrimmed": 0, "countReadExtended": 0, "totalCorBases": 0, "totalUncorBases": 0, "indelsubsUncorr": [0,0,0], "indelsubsCorr": [0,0,0], "homopolymers": dict()}
+	for key in PER_READ_METRICS:
+		merged[key] = []
+	for metrics in metricsList:
+		for key in ["nbReads", "nbMsaReads", "countReadSplit", "countReadTrimmed", "countReadExtended", "totalCorBases", "totalUncorBases"]:
+			merged[key] += metrics[key]
+		for i in range(3):
+			merged["indelsubsUncorr"][i] += metrics["indelsubsUncorr"][i]
+			merged["indelsubsCorr"][i] += metrics["indelsubsCorr"][i]
+		for key in PER_READ_METRICS:
+			merged[key].extend(metrics[key])
+		mergeHomopolymers(merged["homopolymers"], metrics["homopolymers"])
+	return merged
+
+
+
+# global metrics from the raw counts and per-read arrays of computeMetrics
+def summarizeMetrics(metrics):
+	nbReadsToDivide = metrics["nbReads"]
+	totalCorBases = metrics["totalCorBases"]
+	totalUncorBases = metrics["totalUncorBases"]
+	GCRateRef = round(sum(metrics["GCRateRef"]) / len(metrics["GCRateRef"]),3)
+	GCRateCorr = round(sum(metrics["GCRateCorr"]) / len(metrics["GCRateCorr"]),3)
+	recall = sum(metrics["recall"])*1.0 / nbReadsToDivide if nbReadsToDivide != 0 else 0
+	precision = sum(metrics["precision"])*1.0 / nbReadsToDivide if nbReadsToDivide != 0 else 0
+	corBasesRate = sum(metrics["corBasesRate"])*1.0 / nbReadsToDivide if nbReadsToDivide != 0 else 0
+	uncorCorBasesRate = sum(metrics["uncorCorBasesRate"])*1.0 / nbReadsToDivide if nbReadsToDivide != 0 else 0
+	throughput = sum(metrics["allLenCorrected"])
+	uncorThroughput = sum (metrics["allLenUncorrected"])
 	errorRate = 1 - (totalCorBases / (totalCorBases + totalUncorBases))
 	uncorErrorRate = 1 - (totalUncorBases / (totalCorBases + totalUncorBases))
-	if len(ratioHomopolymers) > 1:
-		meanRatioHomopolymers = statistics.mean(ratioHomopolymers)
-	else:
-		meanRatioHomopolymers = 1
-	return nbReadsToDivide, throughput, uncorThroughput, precision, recall, corBasesRate, errorRate, uncorCorBasesRate, uncorErrorRate, missingSize,  GCRateRef, GCRateCorr, indelsubsUncorr, indelsubsCorr, meanRatioHomopolymers, allLenCorrected, countReadSplit, countReadTrimmed, countReadExtended, extendedBasesCount
+	meanRatioHomopolymers = homopolymerRatio(metrics["homopolymers"])
+	return nbReadsToDivide, throughput, uncorThroughput, precision, recall, corBasesRate, errorRate, uncorCorBasesRate, uncorErrorRate, metrics["missingSize"],  GCRateRef, GCRateCorr, metrics["indelsubsUncorr"], metrics["indelsubsCorr"], meanRatioHomopolymers, metrics["allLenCorrected"], metrics["countReadSplit"], metrics["countReadTrimmed"], metrics["countReadExtended"], metrics["extendedBasesCount"]
 
 
 
@@ -707,46 +748,31 @@ def getUpperCasePositions(correctedReadsFile, header, correctedMsa):
 
 
 
+# number of columns at the start of a msa line covering its first nbBases bases (all the columns if it has fewer)
+def clipColumns(sequence, nbBases):
+	if nbBases <= 0:
+		return 0
+	basesBefore = numpy.cumsum(msaBytes(sequence) != ord("."))
+	return min(int(numpy.searchsorted(basesBefore, nbBases)) + 1, len(sequence))
+
+
+
 # add to the uppercase positions the positions where there is no stretch of "." , i.e. all positions where recall and precision are actually computed
-# def getCorrectedPositions(stretches, corrected, readNo, upperCasePositions, reference, clipsNb, header,  gapsPositions):
+# returns the mask of these positions, without the clips of the read, the split/trimmed stretches and the gaps at the ends (gapsPositions mask)
 def getCorrectedPositions(stretches, corrected, readNo, reference, clipsNb, header,  gapsPositions):
 	msaLineLen = len(corrected)
-	#~ correctedPositions = copy.copy(upperCasePositions) #all positions in upper case in the corrected read
-	existingCorrectedPositions = [True] * msaLineLen
+	existingCorrectedPositions = numpy.ones(msaLineLen, dtype=bool)
 	leftClipping = 0
-	rightClipping = None
+	rightClipping = 0
 	if header in clipsNb.keys():
 		leftClipping = clipsNb[header][0]
-		rightClipping = msaLineLen - clipsNb[header][1]
-
-	i = 0
-	j = 0
-	lenClip = 0
-
-	while j < leftClipping and i < len(corrected):
-		if corrected[i] != ".":
-			j += 1
-		existingCorrectedPositions[i] = False
-		i += 1
-		lenClip += 1
-
-	i = msaLineLen - 1
-	j = msaLineLen - 1
-	if rightClipping is not None:
-		while j >= rightClipping and i >= 0:
-			if corrected[i] != ".":
-				j -= 1
-			existingCorrectedPositions[i] = False
-			lenClip += 1
-			i -= 1
-
-	positionsToRemove = list()
-	if len(stretches.keys()) > 0:  # split read (or trimmed)
-		for pos in stretches.keys():
-			positionsToRemove.append([pos, stretches[pos]]) #interval(s)) in which the corrected read sequence does not exist
-		for interv in positionsToRemove:
-			for i in range(interv[0], interv[1] +1):
-				existingCorrectedPositions[i] = False # remove regions where there is no corrected sequence  # remove regions where there is no corrected sequence (split/trimmed) from corrected regions
-	for i in gapsPositions:
-		existingCorrectedPositions[i] = False
+		rightClipping = clipsNb[header][1]
+	leftClip = clipColumns(corrected, leftClipping)
+	rightClip = clipColumns(corrected[::-1], rightClipping)
+	existingCorrectedPositions[:leftClip] = False
+	existingCorrectedPositions[msaLineLen - rightClip:] = False
+	lenClip = leftClip + rightClip
+	for pos in stretches.keys():  # split read (or trimmed): interval(s) in which the corrected read sequence does not exist
+		existingCorrectedPositions[pos:stretches[pos] + 1] = False
+	existingCorrectedPositions[:len(gapsPositions)] &= ~gapsPositions[:msaLineLen]
 	return existingCorrectedPositions, lenClip
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+
+"""*****************************************************************************
+ *   Authors: Camille Marchet  Pierre Morisse Antoine Limasset
+ *   Contact: camille.marchet@irisa.fr, IRISA/Univ Rennes/GenScale, Campus de Beaulieu, 35042 Rennes Cedex, France
+ *   Source: https://github.com/kamimrcht/benchmark-long-read-correction
+ *
+ *
+ *  This program is free software: you can redistribute it and/or modify
+ *  it under the terms of the GNU Affero General Public License as
+ *  published by the Free Software Foundation, either version 3 of the
+ *  License, or (at your option) any later version.
+ *
+ *  This program is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU Affero General Public License for more details.
+ *
+ *  You should have received a copy of the GNU Affero General Public License
+ *  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+*****************************************************************************"""
+
+import os
+import heapq
+import shutil
+import tempfile
+from . import readsReader
+
+
+
+# sort of FASTA files in bounded memory
+# records are read in chunks of at most the memory budget, each chunk is sorted and written to disk as a run, and the runs are merged
+# the sort is stable (records with equal keys keep their order) and gives the same file as sorting all the records in memory
+# an input that is already sorted is copied as is, without any run
+memory = {"budget": 1024 * 1024 * 1024}
+# approximate memory used by a record in a chunk besides its header and sequence (python objects)
+RECORD_OVERHEAD = 200
+# runs merged at once, more runs are merged in several passes
+MAX_OPEN_RUNS = 64
+
+# memory budget of the sorts, in MB
+def setMemory(megabytes):
+	memory["budget"] = max(1, megabytes) * 1024 * 1024
+
+
+
+# records of a reads file (FASTA or FASTQ, compressed or not, see readsReader)
+def readFasta(fileName):
+	return readsReader.readRecords(fileName)
+
+
+
+# records of a run, written by sortFasta with one line per header and sequence
+def readRun(fileName):
+	with open(fileName) as f:
+		header = f.readline()
+		while header != "":
+			yield header[1:-1], f.readline()[:-1]
+			header = f.readline()
+
+
+
+# write records, counting the consecutive records with the same header in counts (see countHeader)
+def writeRecords(records, out, counts=None):
+	for header, sequence in records:
+		out.write(">" + header + "\n" + sequence + "\n")
+		if counts is not None:
+			countHeader(counts, header)
+
+
+
+# number of consecutive records with the same header, for each header
+# counts: {"occurrences": {header: number}, "prevHeader": last header counted}
+def countHeader(counts, header):
+	if header == counts["prevHeader"]:
+		counts["occurrences"][header] += 1
+	else:
+		counts["occurrences"][header] = 1
+		counts["prevHeader"] = header
+
+
+
+def sortKey(key):
+	return lambda record: key(record[0])
+
+
+
+def writeRun(chunk, key, fileName):
+	chunk.sort(key=sortKey(key))
+	with open(fileName, 'w') as out:
+		writeRecords(chunk, out)
+	return fileName
+
+
+
+# sort the records of infileName by key(header) (the header by default) and write them in outfileName, with sequences on one line
+# returns the number of consecutive records with the same header in the sorted file, for each header (in sorted order)
+def sortFasta(infileName, outfileName, key=None):
+	return sortRecords(readFasta(infileName), outfileName, key)
+
+
+
+# sort records (header, sequence) as sortFasta
+def sortRecords(records, outfileName, key=None):
+	if key is None:
+		key = str
+	counts = {"occurrences": dict(), "prevHeader": ""}
+	tmpDir = None
+	runs = []
+	nbRuns = 0
+	chunk = []
+	chunkSize = 0
+	# records are written directly to the output while they are in order: this prefix is the first run if they are not
+	out = open(outfileName, 'w')
+	inOrder = True
+	prevKey = None
+	try:
+		for record in records:
+			if inOrder:
+				recordKey = key(record[0])
+				if prevKey is None or not recordKey < prevKey:
+					writeRecords([record], out, counts)
+					prevKey = recordKey
+					continue
+				inOrder = False
+				out.close()
+				tmpDir = tempfile.mkdtemp(prefix="elector_sort_", dir=os.path.dirname(os.path.abspath(outfileName)))
+				runs.append(tmpDir + "/run0")
+				nbRuns = 1
+				os.replace(outfileName, runs[0])
+			chunk.append(record)
+			chunkSize += len(record[0]) + len(record[1]) + RECORD_OVERHEAD
+			if chunkSize >= memory["budget"]:
+				runs.append(writeRun(chunk, key, tmpDir + "/run" + str(nbRuns)))
+				nbRuns += 1
+				chunk = []
+				chunkSize = 0
+		if inOrder:
+			return counts["occurrences"]
+		chunk.sort(key=sortKey(key))
+		# runs are merged by groups of consecutive runs, so that records with equal keys keep their order
+		while len(runs) + 1 > MAX_OPEN_RUNS:
+			merged = tmpDir + "/run" + str(nbRuns)
+			nbRuns += 1
+			with open(merged, 'w') as out:
+				writeRecords(heapq.merge(*[readRun(run) for run in runs[:MAX_OPEN_RUNS]], key=sortKey(key)), out)
+			for run in runs[:MAX_OPEN_RUNS]:
+				os.remove(run)
+			runs = [merged] + runs[MAX_OPEN_RUNS:]
+		counts = {"occurrences": dict(), "prevHeader": ""}
+		with open(outfileName, 'w') as out:
+			# the last chunk is merged from memory, after the runs of the records before it
+			writeRecords(heapq.merge(*[readRun(run) for run in runs], chunk, key=sortKey(key)), out, counts)
+		return counts["occurrences"]
+	finally:
+		out.close()
+		if tmpDir is not None:
+			shutil.rmtree(tmpDir, ignore_errors=True)
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+"""*****************************************************************************
+ *   Authors: Camille Marchet  Pierre Morisse Antoine Limasset
+ *   Contact: camille.marchet@irisa.fr, IRISA/Univ Rennes/GenScale, Campus de Beaulieu, 35042 Rennes Cedex, France
+ *   Source: https://github.com/kamimrcht/benchmark-long-read-correction
+ *
+ *
+ *  This program is free software: you can redistribute it and/or modify
+ *  it under the terms of the GNU Affero General Public License as
+ *  published by the Free Software Foundation, either version 3 of the
+ *  License, or (at your option) any later version.
+ *
+ *  This program is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU Affero General Public License for more details.
+ *
+ *  You should have received a copy of the GNU Affero General Public License
+ *  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+*****************************************************************************"""
+
+import os
+import mmap
+
+
+
+# index of a FASTA file (sequences on one or several lines), built in one pass and saved next to it
+# for each record, in file order: its header (without ">"), the byte offset of its header line and the length of its sequence
+# the sidecar file is reused as long as the size and modification time of the FASTA file do not change
+INDEX_EXTENSION = ".eidx"
+INDEX_MAGIC = "#ELECTOR-FASTA-INDEX"
+
+# indexes already loaded in this process, by absolute file name
+loadedIndexes = {}
+
+
+
+def fileSignature(fileName):
+	st = os.stat(fileName)
+	return str(st.st_size) + "\t" + str(st.st_mtime_ns)
+
+
+
+def scanFasta(fileName):
+	headers = []
+	offsets = []
+	lengths = []
+	size = os.path.getsize(fileName)
+	if size == 0:
+		return headers, offsets, lengths, size
+	with open(fileName, 'rb') as f:
+		mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		try:
+			if mm[0:1] == b">":
+				pos = 0
+			else:
+				pos = mm.find(b"\n>")
+				pos = pos + 1 if pos >= 0 else -1
+			while pos >= 0:
+				endHeader = mm.find(b"\n", pos)
+				if endHeader < 0:
+					endHeader = size
+				nextRecord = mm.find(b"\n>", endHeader)
+				endRecord = nextRecord + 1 if nextRecord >= 0 else size
+				headers.append(mm[pos + 1:endHeader].decode().rstrip("\r"))
+				offsets.append(pos)
+				# sequence bytes minus line breaks
+				sequence = mm[endHeader:endRecord]
+				lengths.append(len(sequence) - sequence.count(b"\n") - sequence.count(b"\r"))
+				pos = endRecord if nextRecord >= 0 else -1
+		finally:
+			mm.close()
+	return headers, offsets, lengths, size
+
+
+
+def saveIndex(index):
+	indexFile = index["file"] + INDEX_EXTENSION
+	try:
+		with open(indexFile + ".tmp", 'w') as out:
+			out.write(INDEX_MAGIC + "\t" + index["signature"] + "\n")
+			for header, offset, length in zip(index["headers"], index["offsets"], index["lengths"]):
+				out.write(str(offset) + "\t" + str(length) + "\t" + header + "\n")
+		os.replace(indexFile + ".tmp", indexFile)
+	except OSError:
+		# read-only directory, the index is only kept in memory
+		pass
+
+
+
+def readIndex(fileName, signature):
+	indexFile = fileName + INDEX_EXTENSION
+	if not os.path.isfile(indexFile):
+		return None
+	with open(indexFile) as f:
+		if f.readline() != INDEX_MAGIC + "\t" + signature + "\n":
+			return None
+		headers = []
+		offsets = []
+		lengths = []
+		for line in f:
+			offset, length, header = line[:-1].split("\t", 2)
+			headers.append(header)
+			offsets.append(int(offset))
+			lengths.append(int(length))
+	return headers, offsets, lengths
+
+
+
+# index of fileName, from memory, from its sidecar file, or built and saved
+def getIndex(fileName):
+	fileName = os.path.abspath(fileName)
+	signature = fileSignature(fileName)
+	index = loadedIndexes.get(fileName)
+	if index is not None and index["signature"] == signature:
+		return index
+	records = readIndex(fileName, signature)
+	index = {"file": fileName, "signature": signature}
+	if records is None:
+		index["headers"], index["offsets"], index["lengths"], index["size"] = scanFasta(fileName)
+		saveIndex(index)
+	else:
+		index["headers"], index["offsets"], index["lengths"] = records
+		index["size"] = os.path.getsize(fileName)
+	index["first"] = {}
+	for i, header in enumerate(index["headers"]):
+		if header not in index["first"]:
+			index["first"][header] = i
+	loadedIndexes[fileName] = index
+	return index
+
+
+
+def getRecordNumber(fileName):
+	return len(getIndex(fileName)["headers"])
+
+
+
+# number of records of each header
+def getHeaderCounts(fileName):
+	counts = {}
+	for header in getIndex(fileName)["headers"]:
+		counts[header] = counts.get(header, 0) + 1
+	return counts
+
+
+
+# headers with the number of consecutive records having them, in file order (as uniq -c)
+def getHeaderRuns(fileName):
+	runs = []
+	for header in getIndex(fileName)["headers"]:
+		if len(runs) > 0 and runs[-1][0] == header:
+			runs[-1][1] += 1
+		else:
+			runs.append([header, 1])
+	return runs
+
+
+
+# sequence of the i-th record
+def getSequenceAt(fileName, i):
+	index = getIndex(fileName)
+	start = index["offsets"][i]
+	end = index["offsets"][i + 1] if i + 1 < len(index["offsets"]) else index["size"]
+	with open(index["file"], 'rb') as f:
+		f.seek(start)
+		record = f.read(end - start).decode()
+	return "".join(record.split("\n")[1:]).replace("\r", "")
+
+
+
+# sequence of the first record with this header, None if there is none
+def getSequence(fileName, header):
+	i = getIndex(fileName)["first"].get(header)
+	if i is None:
+		return None
+	return getSequenceAt(fileName, i)
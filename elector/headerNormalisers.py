@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+
+"""*****************************************************************************
+ *   Authors: Camille Marchet  Pierre Morisse Antoine Limasset
+ *   Contact: camille.marchet@irisa.fr, IRISA/Univ Rennes/GenScale, Campus de Beaulieu, 35042 Rennes Cedex, France
+ *   Source: https://github.com/kamimrcht/benchmark-long-read-correction
+ *
+ *
+ *  This program is free software: you can redistribute it and/or modify
+ *  it under the terms of the GNU Affero General Public License as
+ *  published by the Free Software Foundation, either version 3 of the
+ *  License, or (at your option) any later version.
+ *
+ *  This program is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU Affero General Public License for more details.
+ *
+ *  You should have received a copy of the GNU Affero General Public License
+ *  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+*****************************************************************************"""
+
+
+import os
+import re
+import shlex
+import subprocess
+from subprocess import PIPE
+from .utils import *
+from . import externalSort
+from . import fastaIndex
+from . import readsReader
+from . import timings
+from . import processRunner
+
+
+
+# header normalisers of the correctors: they give the corrected reads the headers of their uncorrected reads, to identify and sort them
+# a normaliser takes the records (header, sequence) of the corrected reads file and a dict of the other inputs of the assessment
+# (uncorrected: uncorrected reads file, dazzDb: reads database of daccord or pbdagcon, split: the reads are split, outputDirPath)
+# and gives the records of the corrected reads with normalised headers, while they are read
+# a corrector is supported by registering its normaliser
+normalisers = {}
+
+# cached indexes of the dazzler databases (see getDazzIndex)
+DAZZ_INDEX_EXTENSION = ".elector_dump"
+DAZZ_INDEX_MAGIC = "#ELECTOR-DAZZ-INDEX"
+
+
+
+def registerNormaliser(corrector, normaliser):
+	normalisers[corrector] = normaliser
+
+
+
+# normaliser removing the matches of a regular expression from the headers, pattern if the reads are not split, splitPattern if they are
+# a pattern is applied to the whole header as sed would, None leaves the headers unchanged
+def substitution(pattern, splitPattern):
+	regexes = {False: re.compile(pattern) if pattern is not None else None, True: re.compile(splitPattern) if splitPattern is not None else None}
+	def normalise(records, inputs):
+		regex = regexes[bool(inputs["split"])]
+		if regex is None:
+			return records
+		return ((regex.sub("", header), sequence) for header, sequence in records)
+	return normalise
+
+
+
+def registerSubstitution(corrector, pattern, splitPattern):
+	registerNormaliser(corrector, substitution(pattern, splitPattern))
+
+
+
+# MECAT headers are the numbers of the uncorrected reads (from 0), followed by "_" and the fragment
+# the corrected reads are in the order of their numbers, the uncorrected reads are read along
+def mecatRecords(records, inputs):
+	uncorrected = readsReader.readRecords(inputs["uncorrected"])
+	i = -1
+	hUnco = None
+	for hCor, sCor in records:
+		id = int(hCor.split("_")[0])
+		if id < i:
+			dieToFatalError("corrected read " + hCor + " is after the reads of read " + str(i) + ", the MECAT corrected reads are expected in the order of their numbers.")
+		while i < id:
+			hUnco = next(uncorrected, (None, None))[0]
+			if hUnco is None:
+				dieToFatalError("corrected read " + hCor + " has the number of read " + str(id) + ", but " + inputs["uncorrected"] + " only has " + str(i + 1) + " reads.")
+			i = i + 1
+		yield hUnco, sCor
+
+
+
+# index of the reads of a dazzler database: read number of each read name, parsed from its DBdump -rh output
+# after its header lines (starting with + or @), the dump has 3 lines per read: the first one with its name, the third one with its number
+# the index is cached in the output directory, and reused as long as the database file does not change
+def getDazzIndex(dazzDb, outputDirPath):
+	dbFile = dazzDb if os.path.isfile(dazzDb) else dazzDb + ".db"
+	signature = fastaIndex.fileSignature(dbFile)
+	indexName = outputDirPath + "/" + os.path.basename(dbFile) + DAZZ_INDEX_EXTENSION
+	if os.path.isfile(indexName):
+		with open(indexName) as f:
+			if f.readline() == DAZZ_INDEX_MAGIC + "\t" + signature + "\n":
+				index = {}
+				for line in f:
+					name, readId = line[:-1].rsplit("\t", 1)
+					index[name] = int(readId)
+				return index
+	index = {}
+	cmdDumpDb = "DBdump -rh " + dazzDb
+	dump = subprocess.Popen(shlex.split(cmdDumpDb), stdout=PIPE, universal_newlines=True)
+	watch = timings.watchProcess(dump)
+	try:
+		lines = iter(dump.stdout)
+		lDump = next(lines, "")
+		while lDump != "" and (lDump[0] == '+' or lDump[0] == '@'):
+			lDump = next(lines, "")
+		while lDump != "":
+			next(lines, "")
+			lId = next(lines, "")
+			name = lDump.split(" ")
+			readId = lId.split(" ")
+			# a record cut by a failed dump must not give a wrong name or number
+			if len(name) < 2 or len(readId) < 2 or not lDump.endswith("\n") or not lId.endswith("\n") or not readId[1].rstrip("\n").isdigit():
+				raise RuntimeError("DBdump: truncated or malformed record in the dump of " + dazzDb + " (" + lDump.rstrip("\n") + ")")
+			# the first read with a name is the one of the name
+			index.setdefault(name[1][:-1], int(readId[1]))
+			lDump = next(lines, "")
+	finally:
+		dump.stdout.close()
+		returncode = timings.waitProcess(dump, watch, "DBdump", len(index))
+	# an empty or partial index would be reused by the next runs and silently leave reads out
+	processRunner.checkReturnCode("DBdump", returncode)
+	if len(index) == 0:
+		raise RuntimeError("DBdump: no reads in the dump of " + dazzDb)
+	with open(indexName + ".tmp", 'w') as out:
+		out.write(DAZZ_INDEX_MAGIC + "\t" + signature + "\n")
+		for name, readId in index.items():
+			out.write(name + "\t" + str(readId) + "\n")
+	os.replace(indexName + ".tmp", indexName)
+	return index
+
+
+
+# daccord and PBDagCon headers are the names of the reads in the dazzler database, whose index gives the numbers of the uncorrected reads
+# corrected reads can be in any order, the uncorrected reads are read from the index of their file
+def daccordRecords(records, inputs):
+	dazzIndex = getDazzIndex(inputs["dazzDb"], inputs["outputDirPath"])
+	uncoHeaders = readsReader.getHeaders(inputs["uncorrected"])
+	missing = 0
+	for hCor, sCor in records:
+		readId = dazzIndex.get(hCor.split("/")[0])
+		if readId is not None:
+			yield uncoHeaders[readId].rstrip(), sCor
+		else:
+			missing += 1
+	if missing > 0:
+		printWarningMsg(str(missing) + " corrected reads are not in the reads database " + inputs["dazzDb"] + ", they are not assessed.")
+
+
+
+# integer read number of a header (first word, before "/")
+def integerHeaderKey(header):
+	return int(header.split(None, 1)[0].split("/")[0])
+
+
+
+# normaliser sorting the corrected reads by integer headers before giving them to another normaliser
+# the sorted reads are written in a temporary file of the output directory
+def sortedByNumber(normaliser, name):
+	def normalise(records, inputs):
+		sortedName = inputs["outputDirPath"] + "/tmp_sorted_" + name + ".fa"
+		externalSort.sortRecords(records, sortedName, integerHeaderKey)
+		try:
+			yield from normaliser(externalSort.readRun(sortedName), inputs)
+		finally:
+			os.remove(sortedName)
+	return normalise
+
+
+
+registerSubstitution("proovread", r"(\.[0-9]*)* SUBSTR.*$", r"(\.[0-9]*)* SUBSTR.*$")
+registerSubstitution("lordec", None, r"_[0-9]*$")
+registerSubstitution("nanocorr", r"_consensus$", r"_consensus$")
+registerSubstitution("nas", None, None)
+registerSubstitution("colormap", r" [0-9].*$", r" [0-9].*_.*$")
+registerSubstitution("hg-color", r"(_-*[0-9]*){4}$", r"(_-*[0-9]*){5}$")
+registerSubstitution("halc", None, r"_[0-9]*$")
+registerNormaliser("pbdagcon", daccordRecords)
+registerSubstitution("canu", r" id.*", r" id.*")
+registerSubstitution("lorma", r"_[0-9]*$", r"_[0-9]*$")
+registerNormaliser("daccord", daccordRecords)
+registerNormaliser("mecat", mecatRecords)
+registerSubstitution("jabba", None, r"_[0-9]*$")
+registerSubstitution("fmlrc", None, None)
+registerNormaliser("flas", sortedByNumber(mecatRecords, "flas"))
+registerSubstitution("hercules", None, None)
+registerSubstitution("consent", None, None)
+registerSubstitution("ectools", r"_corrected.*", r"_corrected.*")
+registerSubstitution("lsc", r"\|.*", r"\|.*")
+
+# reads of other correctors are expected to have the headers of the uncorrected reads, with "_" and the fragment number if they are split
+DEFAULT_NORMALISER = substitution(None, r"_[0-9]*$")
+
+
+
+# records of the corrected reads with the headers normalised for corrector (None for another corrector)
+def normaliseRecords(corrector, records, inputs):
+	return normalisers.get(corrector, DEFAULT_NORMALISER)(records, inputs)
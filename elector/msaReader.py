@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+"""*****************************************************************************
+ *   Authors: Camille Marchet  Pierre Morisse Antoine Limasset
+ *   Contact: camille.marchet@irisa.fr, IRISA/Univ Rennes/GenScale, Campus de Beaulieu, 35042 Rennes Cedex, France
+ *   Source: https://github.com/kamimrcht/benchmark-long-read-correction
+ *
+ *
+ *  This program is free software: you can redistribute it and/or modify
+ *  it under the terms of the GNU Affero General Public License as
+ *  published by the Free Software Foundation, either version 3 of the
+ *  License, or (at your option) any later version.
+ *
+ *  This program is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU Affero General Public License for more details.
+ *
+ *  You should have received a copy of the GNU Affero General Public License
+ *  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+*****************************************************************************"""
+
+import os
+import mmap
+import bisect
+from . import fastaIndex
+
+
+
+# reading of the msa files written by the alignment (see alignment.mergeMsa): 3 records per fragment of a read, reference, corrected and uncorrected, each with its aligned sequence on one line
+# the file is memory-mapped and read one read at a time, so that only the read being processed is held in memory
+# a record still being written at the end of the file (without its end of line) is not read
+
+
+
+# records (header, aligned sequence) of a mapped msa, as bytes, from its current position up to end, or the last complete one
+def msaRecords(mm, end):
+	while mm.tell() < end:
+		header = mm.readline()
+		sequence = mm.readline()
+		if not sequence.endswith(b"\n"):
+			return
+		yield header, sequence
+
+
+
+# header of a read in the msa: the one of its records, as the read name used for the clips (see computeStats.getCorrectedPositions)
+def msaHeader(header):
+	return header[1:].decode().rstrip()
+
+
+
+# fragments of a read are consecutive records with the same header, spaces and tabs aside (as fastaIndex.getHeaderRuns counts them)
+def readKey(header):
+	return header.translate(None, b" \t\r\n")
+
+
+
+# triplets (header of the reference record, (reference, corrected, uncorrected)) of a mapped msa, up to the last complete one
+def msaTriplets(mm, end):
+	records = msaRecords(mm, end)
+	for header, reference in records:
+		lines = [reference]
+		for _, sequence in records:
+			lines.append(sequence)
+			if len(lines) == 3:
+				break
+		if len(lines) < 3:
+			return
+		yield header, tuple(line.decode().rstrip() for line in lines)
+
+
+
+# reads of a msa file, in file order: (header, fragments), with fragments the list of the (reference, corrected, uncorrected) aligned lines of each fragment of the read
+# start and end: byte range of the reads to read, starting at a read (see readRanges)
+def readMsa(fileName, start=0, end=None):
+	with open(fileName, 'rb') as f:
+		if os.fstat(f.fileno()).st_size == 0:
+			return
+		mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		try:
+			mm.seek(start)
+			key = None
+			header = None
+			fragments = []
+			for tripletHeader, triplet in msaTriplets(mm, len(mm) if end is None else min(end, len(mm))):
+				if readKey(tripletHeader) != key:
+					if fragments:
+						yield header, fragments
+					key = readKey(tripletHeader)
+					header = msaHeader(tripletHeader)
+					fragments = []
+				fragments.append(triplet)
+			if fragments:
+				yield header, fragments
+		finally:
+			mm.close()
+
+
+
+# split a msa file in at most nbRanges byte ranges of about the same size, at the start of reads
+# returns the ranges (start, end) and the headers of the reads of each range (as in readMsa)
+def readRanges(fileName, nbRanges):
+	index = fastaIndex.getIndex(fileName)
+	headers = index["headers"][::3]
+	offsets = index["offsets"][::3]
+	readStarts = []
+	readHeaders = []
+	key = None
+	for header, offset in zip(headers, offsets):
+		if header.replace(' ','').replace('\t','') != key:
+			key = header.replace(' ','').replace('\t','')
+			readStarts.append(offset)
+			readHeaders.append(header.rstrip())
+	ranges = []
+	first = 0
+	for i in range(1, nbRanges + 1):
+		last = bisect.bisect_left(readStarts, index["size"] * i // nbRanges) if i < nbRanges else len(readStarts)
+		if last > first:
+			ranges.append(((readStarts[first], readStarts[last] if last < len(readStarts) else index["size"]), readHeaders[first:last]))
+			first = last
+	return ranges
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+"""*****************************************************************************
+ *   Authors: Camille Marchet  Pierre Morisse Antoine Limasset
+ *   Contact: camille.marchet@irisa.fr, IRISA/Univ Rennes/GenScale, Campus de Beaulieu, 35042 Rennes Cedex, France
+ *   Source: https://github.com/kamimrcht/benchmark-long-read-correction
+ *
+ *
+ *  This program is free software: you can redistribute it and/or modify
+ *  it under the terms of the GNU Affero General Public License as
+ *  published by the Free Software Foundation, either version 3 of the
+ *  License, or (at your option) any later version.
+ *
+ *  This program is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU Affero General Public License for more details.
+ *
+ *  You should have received a copy of the GNU Affero General Public License
+ *  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+*****************************************************************************"""
+
+
+import os
+import mmap
+import bisect
+import hashlib
+import tempfile
+import numpy
+from Bio.Seq import Seq
+from . import externalSort
+from .fastaIndex import fileSignature
+
+
+
+# reference genome packed on 2 bits per base and memory-mapped, built once and saved next to the FASTA file
+# the packed file has the bases of each contig (A, C, G, T, other characters as A), starting on a byte boundary
+# the index file has, for each contig in file order: its description, its length, the offset of its bases in the packed file,
+# the runs of characters other than A, C, G, T (start, length, character code, after upper case) and the runs of lower case characters (start, length)
+# sequences are decoded from the map with exactly the characters of the FASTA file (as Biopython reads them)
+# both files are reused as long as the size and modification time of the FASTA file do not change
+PACKED_EXTENSION = ".e2bit"
+INDEX_EXTENSION = ".e2bit.idx"
+INDEX_MAGIC = "#ELECTOR-PACKED-REFERENCE"
+
+# references already mapped in this process, by absolute file name
+loadedReferences = {}
+
+# 2-bit code of each upper case character, and characters stored as exceptions
+BASE_CODES = numpy.zeros(256, dtype=numpy.uint8)
+IS_EXCEPTION = numpy.ones(256, dtype=bool)
+for code, base in enumerate(b"ACGT"):
+	BASE_CODES[base] = code
+	IS_EXCEPTION[base] = False
+CODE_BASES = numpy.frombuffer(b"ACGT", dtype=numpy.uint8)
+BIT_SHIFTS = numpy.array([6, 4, 2, 0], dtype=numpy.uint8)
+
+# complement of each character, as given by Biopython
+COMPLEMENT_ALPHABET = "".join(chr(c) for c in range(33, 127))
+COMPLEMENT = str.maketrans(COMPLEMENT_ALPHABET, str(Seq(COMPLEMENT_ALPHABET).complement()))
+
+
+
+# start, length (and value) of the runs of consecutive positions where mask is true (and values are equal)
+def findRuns(mask, values=None):
+	positions = numpy.flatnonzero(mask)
+	if len(positions) == 0:
+		return []
+	breaks = numpy.diff(positions) != 1
+	if values is not None:
+		breaks |= numpy.diff(values[positions]) != 0
+	starts = positions[numpy.concatenate(([True], breaks))]
+	ends = positions[numpy.concatenate((breaks, [True]))] + 1
+	if values is None:
+		return [int(x) for run in zip(starts, ends - starts) for x in run]
+	return [int(x) for run in zip(starts, ends - starts, values[starts]) for x in run]
+
+
+
+# pack a sequence, returns its packed bytes, its exception runs and its lower case runs (flat lists)
+def packSequence(sequence):
+	chars = numpy.frombuffer(sequence.encode("latin-1"), dtype=numpy.uint8)
+	lower = (chars >= ord("a")) & (chars <= ord("z"))
+	upper = numpy.where(lower, chars - 32, chars).astype(numpy.uint8)
+	codes = BASE_CODES[upper]
+	if len(codes) % 4 != 0:
+		codes = numpy.concatenate((codes, numpy.zeros(4 - len(codes) % 4, dtype=numpy.uint8)))
+	codes = codes.reshape(-1, 4)
+	packed = (codes[:, 0] << 6) | (codes[:, 1] << 4) | (codes[:, 2] << 2) | codes[:, 3]
+	return packed.astype(numpy.uint8).tobytes(), findRuns(IS_EXCEPTION[upper], upper), findRuns(lower)
+
+
+
+# pack fileName in packedName and write its index in indexName
+def buildReference(fileName, packedName, indexName):
+	offset = 0
+	with open(packedName + ".tmp", 'wb') as packed, open(indexName + ".tmp", 'w') as index:
+		index.write(INDEX_MAGIC + "\t" + fileSignature(fileName) + "\n")
+		for description, sequence in externalSort.readFasta(fileName):
+			bases, exceptions, masks = packSequence(sequence)
+			packed.write(bases)
+			index.write(description + "\t" + str(len(sequence)) + "\t" + str(offset) + "\t" + ",".join(map(str, exceptions)) + "\t" + ",".join(map(str, masks)) + "\n")
+			offset += len(bases)
+	os.replace(packedName + ".tmp", packedName)
+	os.replace(indexName + ".tmp", indexName)
+
+
+
+def readRuns(field, width):
+	values = [int(x) for x in field.split(",")] if field != "" else []
+	starts = values[0::width]
+	ends = [start + length for start, length in zip(starts, values[1::width])]
+	return [starts, ends] + [values[i::width] for i in range(2, width)]
+
+
+
+# contigs of an index file in file order, None if it is missing or does not match the FASTA file
+def readIndex(indexName, signature):
+	if not os.path.isfile(indexName):
+		return None
+	contigs = []
+	with open(indexName) as f:
+		if f.readline() != INDEX_MAGIC + "\t" + signature + "\n":
+			return None
+		for line in f:
+			description, length, offset, exceptions, masks = line[:-1].split("\t")
+			contigs.append({"description": description, "length": int(length), "offset": int(offset), "exceptions": readRuns(exceptions, 3), "masks": readRuns(masks, 2)})
+	return contigs
+
+
+
+# names of the packed and index files of a FASTA file: next to it, or in the temporary directory if its directory is read-only
+def getReferenceFiles(fileName):
+	if os.access(os.path.dirname(fileName), os.W_OK):
+		base = fileName
+	else:
+		base = tempfile.gettempdir() + "/elector_" + hashlib.md5(fileName.encode()).hexdigest() + "_" + os.path.basename(fileName)
+	return base + PACKED_EXTENSION, base + INDEX_EXTENSION
+
+
+
+# contigs of the reference fileName in file order, mapped from its packed file (built if needed)
+# each contig is a dict: description, length, offset, exceptions, masks and map (the memory-mapped packed file)
+def getReference(fileName):
+	fileName = os.path.abspath(fileName)
+	signature = fileSignature(fileName)
+	reference = loadedReferences.get(fileName)
+	if reference is not None and reference["signature"] == signature:
+		return reference["contigs"]
+	packedName, indexName = getReferenceFiles(fileName)
+	contigs = readIndex(indexName, signature)
+	if contigs is None or not os.path.isfile(packedName):
+		buildReference(fileName, packedName, indexName)
+		contigs = readIndex(indexName, signature)
+	with open(packedName, 'rb') as f:
+		# an empty file cannot be mapped, but has no bases to read either
+		mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(packedName) > 0 else b""
+	for contig in contigs:
+		contig["map"] = mm
+	loadedReferences[fileName] = {"signature": signature, "contigs": contigs}
+	return contigs
+
+
+
+# sequence of contig[start:end] (python slice semantics), reverse complemented if reverse
+def getSlice(contig, start, end, reverse=False):
+	start, end, _ = slice(start, end).indices(contig["length"])
+	if end <= start:
+		return ""
+	first = contig["offset"] + start // 4
+	packed = numpy.frombuffer(contig["map"][first:contig["offset"] + (end + 3) // 4], dtype=numpy.uint8)
+	codes = ((packed[:, None] >> BIT_SHIFTS) & 3).ravel()
+	chars = CODE_BASES[codes[start % 4:start % 4 + end - start]]
+	exceptionStarts, exceptionEnds, exceptionCodes = contig["exceptions"]
+	# runs overlapping [start, end): the ones before the first run starting at or after end, from the last one ending at or before start
+	for i in range(bisect.bisect_right(exceptionEnds, start), bisect.bisect_left(exceptionStarts, end)):
+		chars[max(exceptionStarts[i], start) - start:min(exceptionEnds[i], end) - start] = exceptionCodes[i]
+	maskStarts, maskEnds = contig["masks"]
+	for i in range(bisect.bisect_right(maskEnds, start), bisect.bisect_left(maskStarts, end)):
+		chars[max(maskStarts[i], start) - start:min(maskEnds[i], end) - start] += 32
+	sequence = chars.tobytes().decode("latin-1")
+	if reverse:
+		return sequence.translate(COMPLEMENT)[::-1]
+	return sequence
@@ -40,27 +40,33 @@ except ImportError:
 
 
 
-def launchRscripts(installDirectory, soft, outDir):
+# plots are written in reportDir (outDir if None)
+# the R scripts are independent and run concurrently
+def launchRscripts(installDirectory, soft, outDir, reportDir=None):
+	if reportDir is None:
+		reportDir = outDir
+	jobs = []
 	# recall and precision figure
 	installDirectory += "../";
 	if soft is not None:
 		if checkIfFile( outDir + "/" + soft + "_per_read_metrics.txt"):
-			cmdRecallPrecision = "Rscript " + installDirectory + "/Rscripts/plot_recall_precision_correctrate.R " + outDir + "/" + soft + "_per_read_metrics.txt " + outDir
-			subprocessLauncher(cmdRecallPrecision)
+			cmdRecallPrecision = "Rscript " + installDirectory + "/Rscripts/plot_recall_precision_correctrate.R " + outDir + "/" + soft + "_per_read_metrics.txt " + reportDir
+			jobs.append({"cmd": cmdRecallPrecision, "stdout": DEVNULL, "stderr": DEVNULL})
 	else:
 		if checkIfFile( outDir + "/per_read_metrics.txt"):
-			cmdRecallPrecision = "Rscript " + installDirectory + "/Rscripts/plot_recall_precision_correctrate.R " + outDir + "/per_read_metrics.txt " + outDir
-			subprocessLauncher(cmdRecallPrecision)
+			cmdRecallPrecision = "Rscript " + installDirectory + "/Rscripts/plot_recall_precision_correctrate.R " + outDir + "/per_read_metrics.txt " + reportDir
+			jobs.append({"cmd": cmdRecallPrecision, "stdout": DEVNULL, "stderr": DEVNULL})
 
 	# sizes distribution
 	if soft is not None:
 		if checkIfFile( outDir + "/" + soft + "_read_size_distribution.txt"):
-			cmdSizesDistr = "Rscript " + installDirectory + "/Rscripts/plot_distribution_sizes.R " + outDir + "/" + soft + "_read_size_distribution.txt " + outDir
-			subprocessLauncher(cmdSizesDistr)
+			cmdSizesDistr = "Rscript " + installDirectory + "/Rscripts/plot_distribution_sizes.R " + outDir + "/" + soft + "_read_size_distribution.txt " + reportDir
+			jobs.append({"cmd": cmdSizesDistr, "stdout": DEVNULL, "stderr": DEVNULL})
 	else:
 		if checkIfFile( outDir + "/read_size_distribution.txt"):
-			cmdSizesDistr = "Rscript " + installDirectory + "/Rscripts/plot_distribution_sizes.R " + outDir + "/read_size_distribution.txt " + outDir
-			subprocessLauncher(cmdSizesDistr)
+			cmdSizesDistr = "Rscript " + installDirectory + "/Rscripts/plot_distribution_sizes.R " + outDir + "/read_size_distribution.txt " + reportDir
+			jobs.append({"cmd": cmdSizesDistr, "stdout": DEVNULL, "stderr": DEVNULL})
+	runJobs(jobs)
 
 
 
@@ -162,15 +168,17 @@ def generateLatexFigures( outDir, outputPDFName, filesDict, remap, assemble ):
 	\end{document} '''
 	with open(outDir + "/" + outputPDFName +'.tex','w') as f:
 		f.write(content%filesDict)
-	proc = subprocess.Popen(['pdflatex', '-output-directory', outDir, outputPDFName + ".tex"], stdout = DEVNULL, stderr = DEVNULL).communicate()
+	subprocessLauncher("pdflatex -output-directory " + shlex.quote(outDir) + " " + shlex.quote(outputPDFName + ".tex"), DEVNULL, DEVNULL)
 	#~ proc.communicate()
 
 
 
-def generateResults(outDir, installDirectory, soft, nbReads, throughput, recall, precision, correctBaseRate, errorRate, numberSplit, meanMissing, numberExtended, meanExtension, percentGCRef, percentGCCorr, smallReads, wronglyCorReads, minLength, indelsubsUncorr, indelsubsCorr, avId, cov, nbContigs, nbAlContig, nbBreakpoints, NGA50, NGA75,  remap, assemble, homoRatio ):
-	filesDict = {"recall_precision": outDir + "/plot_recall_precision.png", "size_distribution": outDir + "/plot_size_distribution.png", "nbReads": nbReads, "throughput": throughput, "meanPrecision": precision, "meanRecall": recall, "meanCorrectBaseRate": correctBaseRate, "errorRate": errorRate, "numberReadSplit": numberSplit, "meanMissingSize": meanMissing, "numberReadExtended": numberExtended, "meanExtensionSize": meanExtension, "GCRef": str(percentGCRef), "GCCorr": str(percentGCCorr), "smallReads": smallReads, "wronglyCorReads": wronglyCorReads, "minLength": minLength, "insC": indelsubsCorr[0], "delC": indelsubsCorr[1], "subsC": indelsubsCorr[2], "insU": indelsubsUncorr[0],"delU": indelsubsUncorr[1], "subsU": indelsubsUncorr[2], "averageId" : avId, "genomeCov": cov, "nbContigs": nbContigs, "nbAlContig" : nbAlContig, "nbBreakpoints": nbBreakpoints, "NGA50": NGA50, "NGA75": NGA75, "homoRatio": homoRatio}
-	launchRscripts(installDirectory, soft, outDir)
-	generateLatexFigures(outDir, "summary", filesDict, remap, assemble)
+def generateResults(outDir, installDirectory, soft, nbReads, throughput, recall, precision, correctBaseRate, errorRate, numberSplit, meanMissing, numberExtended, meanExtension, percentGCRef, percentGCCorr, smallReads, wronglyCorReads, minLength, indelsubsUncorr, indelsubsCorr, avId, cov, nbContigs, nbAlContig, nbBreakpoints, NGA50, NGA75,  remap, assemble, homoRatio, reportDir=None ):
+	if reportDir is None:
+		reportDir = outDir
+	filesDict = {"recall_precision": reportDir + "/plot_recall_precision.png", "size_distribution": reportDir + "/plot_size_distribution.png", "nbReads": nbReads, "throughput": throughput, "meanPrecision": precision, "meanRecall": recall, "meanCorrectBaseRate": correctBaseRate, "errorRate": errorRate, "numberReadSplit": numberSplit, "meanMissingSize": meanMissing, "numberReadExtended": numberExtended, "meanExtensionSize": meanExtension, "GCRef": str(percentGCRef), "GCCorr": str(percentGCCorr), "smallReads": smallReads, "wronglyCorReads": wronglyCorReads, "minLength": minLength, "insC": indelsubsCorr[0], "delC": indelsubsCorr[1], "subsC": indelsubsCorr[2], "insU": indelsubsUncorr[0],"delU": indelsubsUncorr[1], "subsU": indelsubsUncorr[2], "averageId" : avId, "genomeCov": cov, "nbContigs": nbContigs, "nbAlContig" : nbAlContig, "nbBreakpoints": nbBreakpoints, "NGA50": NGA50, "NGA75": NGA75, "homoRatio": homoRatio}
+	launchRscripts(installDirectory, soft, outDir, reportDir)
+	generateLatexFigures(reportDir, "summary", filesDict, remap, assemble)
 
 
 
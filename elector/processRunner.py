@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+"""*****************************************************************************
+ *   Authors: Camille Marchet  Pierre Morisse Antoine Limasset
+ *   Contact: camille.marchet@irisa.fr, IRISA/Univ Rennes/GenScale, Campus de Beaulieu, 35042 Rennes Cedex, France
+ *   Source: https://github.com/kamimrcht/benchmark-long-read-correction
+ *
+ *
+ *  This program is free software: you can redistribute it and/or modify
+ *  it under the terms of the GNU Affero General Public License as
+ *  published by the Free Software Foundation, either version 3 of the
+ *  License, or (at your option) any later version.
+ *
+ *  This program is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU Affero General Public License for more details.
+ *
+ *  You should have received a copy of the GNU Affero General Public License
+ *  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+*****************************************************************************"""
+
+import os
+import time
+import shlex
+import signal
+import select
+import asyncio
+import subprocess
+import multiprocessing
+import concurrent.futures
+from . import timings
+
+
+
+# runner of the external tools launched by ELECTOR
+# jobs are run by an asyncio event loop, each one measured for timings.json
+# at most maxJobs jobs run at a time in the whole run: every job takes one of the slots shared by all the threads and worker processes
+# a job running longer than timeout seconds, or whose RSS goes over memory KB, is killed (no limit if None)
+# limits are set once from the command line, before the worker pools are created so that their processes inherit them
+limits = {"maxJobs": 1, "timeout": None, "memory": None}
+slots = {"jobs": multiprocessing.BoundedSemaphore(1)}
+
+
+
+def setLimits(maxJobs, timeout=None, memory=None):
+	limits["maxJobs"] = max(1, maxJobs)
+	slots["jobs"] = multiprocessing.BoundedSemaphore(limits["maxJobs"])
+	limits["timeout"] = timeout if timeout else None
+	limits["memory"] = memory if memory else None
+
+
+
+# error raised when a job is killed because of a limit
+class LimitError(RuntimeError):
+	def __init__(self, cmd, reason):
+		RuntimeError.__init__(self, cmd + ": killed (" + reason + ")")
+		self.cmd = cmd
+		self.reason = reason
+
+
+
+# raise an error if an external tool failed: returncode is its exit code, or minus the signal that killed it
+def checkReturnCode(name, returncode):
+	if returncode != 0:
+		raise RuntimeError(name + ": failed (" + ("killed by signal " + str(-returncode) if returncode < 0 else "exit code " + str(returncode)) + ")")
+
+
+
+def killProcess(pid):
+	try:
+		os.kill(pid, signal.SIGKILL)
+	except OSError:
+		pass
+
+
+
+# a job is a dict: cmd, and optionally stdin, stdout, stderr (files or DEVNULL), name (of the tool in timings.json) and items
+# its result is added to it: returncode, and killed (None, "timeout" or "memory")
+# the slot of a job is waited for in a thread of acquirer, so that waiting jobs do not hold the threads reaping the running ones
+async def runJob(job, acquirer):
+	await asyncio.get_running_loop().run_in_executor(acquirer, slots["jobs"].acquire)
+	try:
+		p = subprocess.Popen(shlex.split(job["cmd"]), stdin=job.get("stdin"), stdout=job.get("stdout"), stderr=job.get("stderr"))
+		watch = timings.watchProcess(p, limits["memory"])
+		# the process is reaped in a thread with wait4, to get the resources it used
+		waiter = asyncio.get_running_loop().run_in_executor(None, timings.waitProcess, p, watch, job.get("name"), job.get("items"))
+		done, _ = await asyncio.wait([waiter], timeout=limits["timeout"])
+		if not done:
+			watch["killed"] = "timeout"
+			killProcess(p.pid)
+		job["returncode"] = await waiter
+		job["killed"] = watch.get("killed")
+	finally:
+		slots["jobs"].release()
+	return job
+
+
+
+async def runAll(jobs):
+	with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(jobs))) as acquirer:
+		return await asyncio.gather(*[runJob(job, acquirer) for job in jobs])
+
+
+
+# run independent jobs concurrently, returns them with their results, in the same order
+# a job killed because of a limit raises a LimitError, once all the jobs are finished
+def runJobs(jobs):
+	asyncio.run(runAll(jobs))
+	for job in jobs:
+		if job["killed"] is not None:
+			raise LimitError(job["cmd"], job["killed"])
+	return jobs
+
+
+
+# launch subprocess
+def subprocessLauncher(cmd, argstdout=None, argstderr=None, argstdin=None):
+	return runJobs([{"cmd": cmd, "stdin": argstdin, "stdout": argstdout, "stderr": argstderr}])[0]["returncode"]
+
+
+
+# send a request to a server process speaking the length-prefixed protocol of poa -server and return its response
+# a request is a job: it takes a slot, and the time and memory limits apply to it (the server is killed and a LimitError raised if one is reached)
+def serverRequest(server, request, name):
+	with slots["jobs"]:
+		return serverResponse(server, request, name)
+
+
+
+def serverResponse(server, request, name):
+	server.stdin.write(str(len(request)).encode() + b"\n" + request)
+	server.stdin.flush()
+	start = time.time()
+	killed = None
+	while killed is None:
+		wait = 0.05 if limits["memory"] is not None else None
+		if limits["timeout"] is not None:
+			left = limits["timeout"] - (time.time() - start)
+			if left <= 0:
+				killed = "timeout"
+				break
+			wait = left if wait is None else min(wait, left)
+		if select.select([server.stdout], [], [], wait)[0]:
+			break
+		if limits["memory"] is not None and timings.processMemory(server.pid) > limits["memory"]:
+			killed = "memory"
+	if killed is not None:
+		killProcess(server.pid)
+		server.wait()
+		raise LimitError(name, killed)
+	size = server.stdout.readline()
+	if size == b"":
+		raise RuntimeError(name + ": stopped")
+	return server.stdout.read(int(size))
@@ -20,304 +20,60 @@
  *  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 *****************************************************************************"""
 
-from Bio import SeqIO
-from Bio.Seq import Seq
 import time
 import argparse
 import sys
 import os
+import io
+import mmap
+import collections
 import shlex, subprocess
 from subprocess import Popen, PIPE, STDOUT
 import re
 from os.path import basename
+from multiprocessing import Pool
 from .utils import *
-
-
-
-#Launches subprocess
-def subprocessLauncher(cmd, argstdout=None, argstderr=None, argstdin=None):
-        args = shlex.split(cmd)
-        p = subprocess.Popen(args, stdin = argstdin, stdout = argstdout, stderr = argstderr).communicate()
-        return p
-
-
-
-# format MECAT headers
-def formatMecat(correctedReads, uncorrectedReads, formattedReads):
-	fCor = open(correctedReads)
-	fUnco = open(uncorrectedReads)
-	fNewCor = open(formattedReads, 'w')
-
-	i = 0
-	hCor = fCor.readline().split("_")[0]
-	hUnco = fUnco.readline()
-	while hCor != "":
-		sCor = fCor.readline()
-		id = int(hCor.split(">")[1])
-		while i != id:
-			sUnco = fUnco.readline()
-			hUnco = fUnco.readline()
-			i = i + 1
-		hCor = fCor.readline().split("_")[0]
-		fNewCor.write(hUnco + sCor)
-
-	fCor.close()
-	fUnco.close()
-	fNewCor.close()
-
-
-
-# sort read file by increasing order of integer headers
-def sortPBDCHeaders(infileName, outfileName):
-	handle = open(infileName, "rU")
-	l = SeqIO.parse(handle, "fasta")
-	sortedList = [f for f in sorted(l, key=lambda x : int(x.id.split("/")[0]))]
-	outfile = open(outfileName, 'w')
-	for record in sortedList:
-		outfile.write(">" + record.description+"\n")
-		outfile.write(str(record.seq)+"\n")
-	outfile.close()
-
-
-
-def sortFLASHeaders(infileName, outfileName):
-	handle = open(infileName, "rU")
-	l = SeqIO.parse(handle, "fasta")
-	sortedList = [f for f in sorted(l, key=lambda x : int(x.id.split("/")[0]))]
-	outfile = open(outfileName, 'w')
-	for record in sortedList:
-		outfile.write(">" + record.description+"\n")
-		outfile.write(str(record.seq)+"\n")
-	outfile.close()
-
-
-
-# format daccord headers
-def formatDaccord(correctedReads, uncorrectedReads, dazzDb, formattedReads):
-	#dump database
-	cmdDumpDb = "DBdump -rh " + dazzDb
-	dumpedDb = open("daccord_dumpedDb", 'w')
-	subprocessLauncher(cmdDumpDb, dumpedDb)
-	fCor = open(correctedReads)
-	dumpedDb.close()
-
-	fDump = open("daccord_dumpedDb")
-	lDump = fDump.readline()
-	while lDump != "" and (lDump[0] == '+' or lDump[0] == '@'):
-		lDump = fDump.readline()
-	fUnco = open(uncorrectedReads)
-	newCorrectedReads = open(formattedReads, 'w')
-	curRead = 0
-	hUnco = fUnco.readline()
-	sUnco = fUnco.readline()
-
-	hCor = fCor.readline()
-	if hCor != '':
-		hCor = hCor.split("/")[0].split(">")[1]
-	while hCor != '':
-		sCor = fCor.readline()
-		while lDump != '' and lDump.split(" ")[1][:-1] != hCor:
-			lDump = fDump.readline()
-			lDump = fDump.readline()
-			lDump = fDump.readline()
-		lDump = fDump.readline()
-		lDump = fDump.readline()
-		readId = int(lDump.split(" ")[1])
-		while curRead != readId:
-			hUnco = fUnco.readline()
-			sUnco = fUnco.readline()
-			curRead = curRead + 1
-		newCorrectedReads.write(hUnco + sCor)
-		newHCor = fCor.readline()
-		if newHCor != '':
-			newHCor = newHCor.split("/")[0].split(">")[1]
-		while newHCor == hCor:
-			sCor = fCor.readline()
-			newCorrectedReads.write(hUnco + sCor)
-			newHCor = fCor.readline()
-			if newHCor != '':
-				newHCor = newHCor.split("/")[0].split(">")[1]
-		hCor = newHCor
-		lDump = fDump.readline()
-	fCor.close()
-	fUnco.close()
-	fDump.close()
-	newCorrectedReads.close()
+from .stageCache import runStage
+from . import externalSort
+from . import tripletStore
+from . import packedReference
+from . import timings
+from . import processRunner
+from . import cigarDecoder
+from . import headerNormalisers
+from . import readsReader
 
 
 
 # sort read file by increasing order of headers, return occurrence of each corrected read
 def readAndSortFasta(infileName, outfileName):
-	handle = open(infileName, "rU")
-	l = SeqIO.parse(handle, "fasta")
-	sortedList = [f for f in sorted(l, key=lambda x : (x.description))]
-	occurrenceEachRead = dict()
-	outfile = open(outfileName, 'w')
-	prevHeader = ""
-	for record in sortedList:
-		outfile.write(">" + record.description+"\n")
-		outfile.write(str(record.seq)+"\n")
-		if record.description == prevHeader:
-			occurrenceEachRead[record.description] += 1
-		else:
-			occurrenceEachRead[record.description] = 1
-			prevHeader = record.description
-	outfile.close()
-	return occurrenceEachRead
-
-
-
-# duplicate reference and uncorrected sequences when there are several corrected reads with the same header
-def duplicateRefReads(reference, uncorrected, occurrenceEachRead, size, newUncoName, newRefName):
-	if occurrenceEachRead != [1]*size:
-		refer = open(reference, 'r')
-		refLines = refer.readlines()
-		uncorr = open(uncorrected, 'r')
-		uncoLines = uncorr.readlines()
-		newUnco = open(newUncoName, 'w')
-		newRef = open(newRefName, 'w')
-		for unco,ref in zip(uncoLines, refLines):
-			if not ">" in ref:
-				if header in occurrenceEachRead.keys():
-					for times in range(occurrenceEachRead[header]):
-						newRef.write(">" + header + "_" + str(times) + "\n")
-						newRef.write(ref.rstrip() + "\n" )
-						newUnco.write(">" + header + "_" + str(times) + "\n")
-						newUnco.write(unco.rstrip() + "\n")
-			else:
-				header = ref.rstrip()[1:]
-		return newRefName, newUncoName
-	else:
-		return reference, uncorrected
+	return externalSort.sortFasta(infileName, outfileName)
 
 
 
-# format corrected reads headers
-def formatHeader(corrector, correctedReads, uncorrectedReads, dazzDb, split, outputDirPath):
-	if corrector is not None:
-		name = outputDirPath + "/corrected_format_" + str(corrector) + ".fa"
-	else:
-		name = outputDirPath + "/corrected_formatted.fa"
-	if corrector == "proovread":
-		cmdFormatHeader = "sed 's/\(\.[0-9]*\)* SUBSTR.*$//g' " + correctedReads
-		#~ formattedReads = open("corrected_format_proovread.fa", 'w')
-		formattedReads = open(name, 'w')
-		subprocessLauncher(cmdFormatHeader, formattedReads)
-		formattedReads.close()
-	elif corrector == "lordec" or corrector == None:
-		if not split:
-			#already formatted
-			pass
-		else:
-			cmdFormatHeader = "sed 's/_[0-9]*$//g' " + correctedReads
-			#~ formattedReads = open("corrected_format_lordec.fa", 'w')
-			formattedReads = open(name, 'w')
-			subprocessLauncher(cmdFormatHeader, formattedReads)
-			formattedReads.close()
-	elif corrector == "nanocorr":
-		cmdFormatHeader = "sed 's/_consensus$//g' " + correctedReads
-		#~ formattedReads = open("corrected_format_nanocorr.fa")
-		formattedReads = open(name, 'w')
-		subprocessLauncher(cmdFormatHeader, formattedReads)
-		formattedReads.close()
-	elif corrector == "lsc":
-		cmdFormatHeader = "sed 's/|.*//g' " + correctedReads
-		formattedReads = open(name, 'w')
-		subprocessLauncher(cmdFormatHeader, formattedReads)
-		formattedReads.close()
-	elif corrector == "ectools":
-		cmdFormatHeader = "sed 's/_corrected.*//g' " + correctedReads
-		formattedReads = open(name, 'w')
-		subprocessLauncher(cmdFormatHeader, formattedReads)
-		formattedReads.close()
-	elif corrector == "nas" or corrector == "hercules" or corrector == "fmlrc" or corrector =="consent":
-		#already formatted
-		pass
-	elif corrector == "jabba":
-		if not split:
-			#already formatted
-			pass
-		else:
-			cmdFormatHeader = "sed 's/_[0-9]*$//g' " + correctedReads
-			formattedReads = open(name, 'w')
-			subprocessLauncher(cmdFormatHeader, formattedReads)
-			formattedReads.close()
-	elif corrector == "colormap":
-		if not split:
-			cmdFormatHeader = "sed 's/ [0-9].*$//g' " + correctedReads
-		else:
-			cmdFormatHeader = "sed 's/ [0-9].*_.*$//g' " + correctedReads
-		#~ formattedReads = open("corrected_format_colormap", 'w')
-		formattedReads = open(name, 'w')
-		subprocessLauncher(cmdFormatHeader, formattedReads)
-		formattedReads.close()
-	elif corrector == "hg-color":
-		if not split:
-			cmdFormatHeader = "sed 's/\(_-*[0-9]*\)\{4\}$//g' " + correctedReads
-		else:
-			cmdFormatHeader = "sed 's/\(_-*[0-9]*\)\{5\}$//g' " + correctedReads
-		#~ formattedReads = open("corrected_format_hg-color.fa", 'w')
-		formattedReads = open(name, 'w')
-		subprocessLauncher(cmdFormatHeader, formattedReads)
-		formattedReads.close()
-	elif corrector == "halc":
-		if not split:
-			#already formatted
-			pass
-		else:
-			cmdFormatHeader = "sed 's/_[0-9]*$//g' " + correctedReads
-			#~ formattedReads = open("corrected_format_halc.fa", 'w')
-			formattedReads = open(name, 'w')
-			subprocessLauncher(cmdFormatHeader, formattedReads)
-			formattedReads.close()
-	elif corrector == "pbdagcon":
-		sortPBDCHeaders(correctedReads, "tmp_sorted_pbdagcon.fa")
-		#~ formatDaccord("tmp_sorted_pbdagcon.fa", uncorrectedReads, dazzDb, "corrected_format_pbdagcon.fa")
-		formatDaccord("tmp_sorted_pbdagcon.fa", uncorrectedReads, dazzDb, name)
-	elif corrector == "canu":
-		cmdFormatHeader = "sed 's/ id.*//g' " + correctedReads
-		#~ formattedReads = open("corrected_format_canu", 'w')
-		formattedReads = open(name, 'w')
-		subprocessLauncher(cmdFormatHeader, formattedReads)
-		formattedReads.close()
-	elif corrector == "lorma":
-		cmdFormatHeader = "sed 's/_[0-9]*$//g' " + correctedReads
-		formattedReads = open(name, 'w')
-		#~ formattedReads = open("corrected_format_lorma.fa", 'w')
-		subprocessLauncher(cmdFormatHeader, formattedReads)
-		formattedReads.close()
-	elif corrector == "daccord":
-		#~ formatDaccord(correctedReads, uncorrectedReads, dazzDb, "corrected_format_daccord.fa")
-		formatDaccord(correctedReads, uncorrectedReads, dazzDb, name)
-	elif corrector == "mecat":
-		#~ formatMecat(correctedReads, uncorrectedReads, "corrected_format_mecat.fa")
-		formatMecat(correctedReads, uncorrectedReads, name)
-	elif corrector == "flas":
-		sortFLASHeaders(correctedReads, "tmp_sorted_flas.fa")
-		formatMecat("tmp_sorted_flas.fa", uncorrectedReads, name)
-	#~ else: #None corrector
+# normalise the headers of the corrected reads of corrector (see headerNormalisers) while they are read, and sort them
+# return occurrence of each corrected read
+def normaliseAndSortFasta(corrector, correctedReads, uncorrectedReads, dazzDb, split, outputDirPath, outfileName):
+	inputs = {"uncorrected": uncorrectedReads, "dazzDb": dazzDb, "split": split, "outputDirPath": outputDirPath}
+	return externalSort.sortRecords(headerNormalisers.normaliseRecords(corrector, readsReader.readRecords(correctedReads), inputs), outfileName)
 
 
 
+# contigs of the packed reference genome (see packedReference), by their id in the simulation or alignment files
 def loadReference(fRef, simulator):
-	handle = open(fRef, "rU")
-	l = SeqIO.parse(handle, "fasta")
 	refSeqs = {}
-
-	for record in l:
+	for contig in packedReference.getReference(fRef):
 		if simulator == "nanosim" or simulator == "real":
-			id = record.description.split(" ")[0].replace("_", "-")
+			id = contig["description"].split(" ")[0].replace("_", "-")
 		else:
-			id = record.description.strip().replace(" ", "-").replace("_", "-")
-		refSeqs[id] = str(record.seq)
+			id = contig["description"].strip().replace(" ", "-").replace("_", "-")
+		refSeqs[id] = contig
 	return refSeqs
 
 
 
-def generateRefReadsNanosim(simulatedReads, referenceGenome, referenceReads):
-	fSeqs = loadReference(referenceGenome, "nanosim")
-	f = open(simulatedReads)
-	out = open(referenceReads, 'w')
+# reference reads of the simulated reads of a NanoSim reads file
+def refReadsNanosim(f, fSeqs, out):
 	header = f.readline()[1:-1]
 	while header != "":
 		seq = f.readline()[:-1]
@@ -331,86 +87,49 @@ def generateRefReadsNanosim(simulatedReads, referenceGenome, referenceReads):
 		# TODO: prolly start in pos+head and end in pos+mid
 		#seq = fSeqs[refId][pos:pos+mid]
 		#seq = fSeqs[refId][pos+head:pos+head+mid]
-		seq = fSeqs[refId][pos:pos+head+mid+tail]
-		if strand == "R":
-			seq = str(Seq(seq).reverse_complement())
+		seq = packedReference.getSlice(fSeqs[refId], pos, pos+head+mid+tail, strand == "R")
 		out.write(">" + header + "\n" + seq + "\n")
 		header = f.readline()[1:-1]
-	f.close()
-	out.close()
 
 
 
-def generateRefReadsSimLord(simulatedReads, referenceGenome, referenceReads):
-	fSeqs = loadReference(referenceGenome, "simlord")
-	f = open(simulatedReads)
-	out = open(referenceReads, 'w')
-	line = f.readline()
-	while line != '' and line[0] == "@":
-		line = f.readline()
-
-	line = line.split("\t")
+# reference reads of the alignments of a SimLord SAM file (without its header)
+def refReadsSimLord(f, fSeqs, out):
+	line = f.readline().split("\t")
 	while line != ['']:
 		header = line[0]
 		strand = int(line[1])
 		refId = line[2].replace("_", "-")
 		pos = int(line[3]) - 1
-		cigar = line[5]
+		cigar = cigarDecoder.decodeCigar(line[5])
 		len = int(line[8])
-		nbD = sum([int(i.split("D")[0]) for i in (re.findall('\d+D', cigar))])
-		nbI = sum([int(i.split("I")[0]) for i in (re.findall('\d+I', cigar))])
-		len = len + nbD - nbI
-		seq = fSeqs[refId][pos:pos+len]
-		if strand == 16:
-			seq = str(Seq(seq).reverse_complement())
+		len = len + cigar[cigarDecoder.D] - cigar[cigarDecoder.I]
+		seq = packedReference.getSlice(fSeqs[refId], pos, pos+len, strand == 16)
 		# if strand == 16:
 		out.write(">" + header + "\n" + seq + "\n")
 		# else:
 		# 	out.write(">" + header + "\n" + "\n\n")
 		line = f.readline().split("\t")
-	f.close()
-	out.close()
 
 
 
-def generateRefReadsRealData(realReads, referenceGenome, referenceReads):
-	reFile = (os.path.splitext(realReads)[0])
-	cmdAl = installDirectory+"minimap2 -a -O4,24 " + referenceGenome + " " + realReads
-	outErr = open("/dev/null", 'w')
-	alFile = reFile + ".sam"
-	outAl = open(alFile, 'w')
-	subprocessLauncher(cmdAl, outAl, outErr)
-	outAl.close()
-	outErr.close()
+# reference reads of the alignments of real reads in a SAM file (without its header), returns the clips of each read
+def refReadsRealData(f, fSeqs, out):
 	clipsNb = {}
-
-	fSeqs = loadReference(referenceGenome, "real")
-	f = open(alFile)
-	out = open(referenceReads, 'w')
-	line = f.readline()
-	while line != '' and line[0] == "@":
-		line = f.readline()
-
-	line = line.split("\t")
+	line = f.readline().split("\t")
 	while line != ['']:
 		if line[1] == "0" or line[1] == "16":
 			header = line[0].rstrip()
 			strand = int(line[1])
 			refId = line[2].replace("_", "-")
 			pos = int(line[3]) - 1
-			cigar = line[5]
+			cigar = cigarDecoder.decodeCigar(line[5])
 			length = len(line[9])
-			nbD = sum([int(i.split("D")[0]) for i in (re.findall('\d+D', cigar))])
-			nbI = sum([int(i.split("I")[0]) for i in (re.findall('\d+I', cigar))])
-			nbSLeft = sum([int(i.split("S")[0]) for i in (re.findall('\d+S', cigar[0:int(len(cigar)/2)+1]))])
-			nbSRight = sum([int(i.split("S")[0]) for i in (re.findall('\d+S', cigar[int(len(cigar)/2)+1:len(cigar)]))])
-			nbS = nbSLeft + nbSRight;
-			nbHLeft = sum([int(i.split("H")[0]) for i in (re.findall('\d+H', cigar[0:int(len(cigar)/2)+1]))])
-			nbHRight = sum([int(i.split("H")[0]) for i in (re.findall('\d+H', cigar[int(len(cigar)/2)+1:len(cigar)]))])
-			nbH = nbHLeft + nbHRight;
+			nbSLeft = cigar[cigarDecoder.LEFT_CLIPS]
+			nbSRight = cigar[cigarDecoder.RIGHT_CLIPS]
 			leftShift = 0
 			rightShift = 0
-			length = length + nbD - nbI
+			length = length + cigar[cigarDecoder.D] - cigar[cigarDecoder.I]
 			pos = pos - nbSLeft
 
 			# if 2 <= nbSLeft:# and nbSLeft <= 15:
@@ -424,9 +143,7 @@ def generateRefReadsRealData(realReads, referenceGenome, referenceReads):
 			# else:
 			# 	length = length - nbSRight
 
-			seq = fSeqs[refId][pos:pos+length+1]
-			if strand == 16:
-				seq = str(Seq(seq).reverse_complement())
+			seq = packedReference.getSlice(fSeqs[refId], pos, pos+length+1, strand == 16)
 			# if (nbS != 0 or nbH != 0):
 			# 	print(">" + header)
 			# 	print(line[9])
@@ -438,86 +155,248 @@ def generateRefReadsRealData(realReads, referenceGenome, referenceReads):
 		elif line[1] == "4":
 			out.write(">" + line[0] + "\n" + "\n")
 		line = f.readline().split("\t")
-	f.close()
-	out.close()
 
 	return clipsNb
 
 
 
+# generators of reference reads, by simulator
+REF_READS_GENERATORS = {"nanosim": refReadsNanosim, "simlord": refReadsSimLord, "real": refReadsRealData}
+# size of the ranges of simulated reads processed at once
+REF_READS_RANGE_BYTES = 16 * 1024 * 1024
+
+
+
+# ranges of [start, size of fileName) starting on records, records starting after a separator (b"\n>" for FASTA, b"\n" for lines)
+# ranges have about rangeBytes bytes, at least nbRanges ranges (if the records allow it)
+def splitRecordRanges(fileName, start, separator, nbRanges, rangeBytes):
+	size = os.path.getsize(fileName)
+	step = max(1, min(rangeBytes, (size - start) // max(1, nbRanges)))
+	ranges = []
+	if start >= size:
+		return ranges
+	with open(fileName, 'rb') as f:
+		mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		try:
+			while start < size:
+				end = mm.find(separator, start + step - 1) if start + step < size else -1
+				# the range ends after the line break of the separator, where the next record starts
+				end = end + 1 if end >= 0 else size
+				ranges.append((start, end))
+				start = end
+		finally:
+			mm.close()
+	return ranges
+
+
+
+# reference reads of the records of a text, and their clips (real data)
+def refReadsText(args):
+	simulator, referenceGenome, text = args
+	# records are read as from a text file, with universal newlines
+	records = io.StringIO(text, newline=None)
+	out = io.StringIO()
+	clipsNb = REF_READS_GENERATORS[simulator](records, loadReference(referenceGenome, simulator), out)
+	return out.getvalue(), clipsNb or {}
+
+
+
+# reference reads of the records of simulatedReads in the byte range [start, end), and their clips (real data)
+def refReadsRange(args):
+	simulator, simulatedReads, referenceGenome, start, end = args
+	with open(simulatedReads, 'rb') as f:
+		f.seek(start)
+		text = f.read(end - start).decode()
+	return refReadsText((simulator, referenceGenome, text))
+
+
+
+# write the reference reads of tasks (ranges or texts of records, in the order of the simulated reads) computed by worker on threads processes
+# at most 2 tasks per process are pending, so that tasks produced faster than they are processed are not all held in memory
+# the output does not depend on the number of threads, returns the clips of the reads (real data)
+def writeRefReads(worker, tasks, referenceReads, threads):
+	clipsNb = {}
+	with open(referenceReads, 'w') as out:
+		if threads > 1:
+			with Pool(processes=threads) as pool:
+				pending = collections.deque()
+				for task in tasks:
+					pending.append(pool.apply_async(worker, (task,)))
+					while len(pending) > 2 * threads or (len(pending) > 0 and pending[0].ready()):
+						reads, taskClips = pending.popleft().get()
+						out.write(reads)
+						clipsNb.update(taskClips)
+				while len(pending) > 0:
+					reads, taskClips = pending.popleft().get()
+					out.write(reads)
+					clipsNb.update(taskClips)
+		else:
+			for reads, taskClips in map(worker, tasks):
+				out.write(reads)
+				clipsNb.update(taskClips)
+	return clipsNb
+
+
+
+# write the reference reads of simulatedReads, processed by ranges of records on threads processes
+# start: offset of the first record (after the header of a SAM file), separator: separator of the records (see splitRecordRanges)
+def generateRefReads(simulator, simulatedReads, referenceGenome, referenceReads, start, separator, threads):
+	# the packed reference is built before the workers map it
+	loadReference(referenceGenome, simulator)
+	ranges = [(simulator, simulatedReads, referenceGenome, rangeStart, rangeEnd) for rangeStart, rangeEnd in splitRecordRanges(simulatedReads, start, separator, threads, REF_READS_RANGE_BYTES)]
+	return writeRefReads(refReadsRange, ranges, referenceReads, threads if len(ranges) > 1 else 1)
+
+
+
+# write the reference reads of texts of simulated reads or alignments (a stream that cannot be read by ranges), processed on threads processes
+def generateRefReadsFromChunks(simulator, chunks, referenceGenome, referenceReads, threads):
+	loadReference(referenceGenome, simulator)
+	return writeRefReads(refReadsText, ((simulator, referenceGenome, chunk) for chunk in chunks), referenceReads, threads)
+
+
+
+# texts of about chunkBytes of whole records of a reads file (see readsReader), with sequences on one line
+def recordChunks(fileName, chunkBytes):
+	records = []
+	size = 0
+	for header, sequence in readsReader.readRecords(fileName):
+		records.append(">" + header + "\n" + sequence + "\n")
+		size += len(records[-1])
+		if size >= chunkBytes:
+			yield "".join(records)
+			records = []
+			size = 0
+	if len(records) > 0:
+		yield "".join(records)
+
+
+
+# texts of about chunkBytes of whole alignments of a SAM stream, without its header
+def samChunks(stream, chunkBytes, counter):
+	lines = []
+	size = 0
+	header = True
+	for line in stream:
+		if header and line[0] == "@":
+			continue
+		header = False
+		lines.append(line)
+		size += len(line)
+		counter[0] += 1
+		if size >= chunkBytes:
+			yield "".join(lines)
+			lines = []
+			size = 0
+	if len(lines) > 0:
+		yield "".join(lines)
+
+
+
+# offset of the first alignment of a SAM file, after its header
+def samRecordsStart(samFile):
+	start = 0
+	with open(samFile, 'rb') as f:
+		line = f.readline()
+		while line != b"" and line[0:1] == b"@":
+			start += len(line)
+			line = f.readline()
+	return start
+
+
+
+# simulated reads that are not in an uncompressed FASTA file with sequences on one line are streamed
+def generateRefReadsNanosim(simulatedReads, referenceGenome, referenceReads, threads=1):
+	if readsReader.isOneLineFasta(simulatedReads):
+		generateRefReads("nanosim", simulatedReads, referenceGenome, referenceReads, 0, b"\n>", threads)
+	else:
+		generateRefReadsFromChunks("nanosim", recordChunks(simulatedReads, REF_READS_RANGE_BYTES), referenceGenome, referenceReads, threads)
+
+
+
+def generateRefReadsSimLord(simulatedReads, referenceGenome, referenceReads, threads=1):
+	if readsReader.isGzip(simulatedReads):
+		generateRefReadsFromChunks("simlord", samChunks(readsReader.readLines(simulatedReads), REF_READS_RANGE_BYTES, [0]), referenceGenome, referenceReads, threads)
+	else:
+		generateRefReads("simlord", simulatedReads, referenceGenome, referenceReads, samRecordsStart(simulatedReads), b"\n", threads)
+
+
+
+# the alignments of minimap2 are read from a pipe and processed while they are output, without writing them to disk
+# minimap2 and the workers writing the reference reads run at the same time, they share the threads
+def generateRefReadsRealData(realReads, referenceGenome, referenceReads, threads=1):
+	alignerThreads = max(1, threads // 2)
+	cmdAl = installDirectory+"minimap2 -a -O4,24 -t " + str(alignerThreads) + " " + referenceGenome + " " + realReads
+	aligner = subprocess.Popen(shlex.split(cmdAl), stdout=PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+	watch = timings.watchProcess(aligner)
+	nbAlignments = [0]
+	try:
+		clipsNb = generateRefReadsFromChunks("real", samChunks(aligner.stdout, REF_READS_RANGE_BYTES, nbAlignments), referenceGenome, referenceReads, max(1, threads - alignerThreads))
+	finally:
+		aligner.stdout.close()
+		returncode = timings.waitProcess(aligner, watch, "minimap2", nbAlignments[0])
+	# the reads of a failed or killed minimap2 are partial: the error stops the run before the stage caches them
+	processRunner.checkReturnCode("minimap2", returncode)
+	return clipsNb
+
+
+
+# simulation file with this name, or its gzipped version (name.gz) if there is one and not the uncompressed one
+def getSimulationFile(name):
+	if not os.path.exists(name) and os.path.exists(name + ".gz"):
+		return name + ".gz"
+	return name
+
+
+
 #Generates reference reads file (only supported for nanosim and simlord)
-def convertSimulationOutputToRefFile(simulatedPrefix, referenceGenome, simulator, outputDirPath):
+def convertSimulationOutputToRefFile(simulatedPrefix, referenceGenome, simulator, outputDirPath, threads=1):
 	if simulator == "nanosim":
-		generateRefReadsNanosim(simulatedPrefix + "_reads.fasta", referenceGenome, outputDirPath + "/" + basename(simulatedPrefix) + "_reference.fasta")
+		generateRefReadsNanosim(getSimulationFile(simulatedPrefix + "_reads.fasta"), referenceGenome, outputDirPath + "/" + basename(simulatedPrefix) + "_reference.fasta", threads)
 	elif simulator == "simlord":
-		cmdConv = installDirectory+"fq2fa " + simulatedPrefix + ".fastq"
-		outFa = open(outputDirPath + "/" + basename(simulatedPrefix) + ".fasta", 'w')
-		subprocessLauncher(cmdConv, outFa)
-		outFa.close()
-		generateRefReadsSimLord(simulatedPrefix + ".sam", referenceGenome, outputDirPath + "/" + basename(simulatedPrefix) + "_reference.fasta")
+		generateRefReadsSimLord(getSimulationFile(simulatedPrefix + ".sam"), referenceGenome, outputDirPath + "/" + basename(simulatedPrefix) + "_reference.fasta", threads)
 	else:
-		generateRefReadsRealData(simulatedPrefix, referenceGenome, outputDirPath + "/" + basename(simulatedPrefix) + "_reference.fasta")
+		generateRefReadsRealData(simulatedPrefix, referenceGenome, outputDirPath + "/" + basename(simulatedPrefix) + "_reference.fasta", threads)
 
 
 
 # main function
-def processReadsForAlignment(corrector, reference, uncorrected, corrected, size, split, simulator, dazzDb, outputDirPath):
-	clipsNb = {}
+# generate and sort the reference and uncorrected reads, once for all the correctors
+# suffix is appended to the sorted files names (used when a single corrector is assessed)
+def processSharedReads(reference, uncorrected, simulator, suffix, outputDirPath, cache=None, threads=1):
 	#0- generate reference reads, if needed
-	if simulator is not None:
-		if simulator != "real":
-			convertSimulationOutputToRefFile(uncorrected, reference, simulator, outputDirPath)
-		else:
-			#convertSimulationOutputToRefFile(corrected, reference, simulator)
-			clipsNb = generateRefReadsRealData(uncorrected, reference, outputDirPath + "/" + basename(uncorrected) + "_reference.fasta")
-	#1- correctly format the headers to be able to identify and sort the corrected reads
+	referenceReads = outputDirPath + "/" + basename(uncorrected) + "_reference.fasta"
 	if simulator == "nanosim":
-		formatHeader(corrector, corrected, uncorrected + "_reads.fasta", dazzDb, split, outputDirPath)
+		uncorrectedReads = getSimulationFile(uncorrected + "_reads.fasta")
+		clipsNb = runStage(cache, "reference_reads", [uncorrectedReads, reference], [simulator], [referenceReads], lambda log: convertSimulationOutputToRefFile(uncorrected, reference, simulator, outputDirPath, threads) or {})
 	elif simulator == "simlord":
-		formatHeader(corrector, corrected, outputDirPath + "/" + basename(uncorrected) + ".fasta", dazzDb, split, outputDirPath)
+		# the simulated reads are read directly from the FASTQ file
+		uncorrectedReads = getSimulationFile(uncorrected + ".fastq")
+		clipsNb = runStage(cache, "reference_reads", [uncorrectedReads, getSimulationFile(uncorrected + ".sam"), reference], [simulator], [referenceReads], lambda log: convertSimulationOutputToRefFile(uncorrected, reference, simulator, outputDirPath, threads) or {})
+	elif simulator == "real":
+		uncorrectedReads = uncorrected
+		#convertSimulationOutputToRefFile(corrected, reference, simulator)
+		clipsNb = runStage(cache, "reference_reads", [uncorrected, reference], [simulator], [referenceReads], lambda log: generateRefReadsRealData(uncorrected, reference, referenceReads, threads))
 	else:
-		formatHeader(corrector, corrected, uncorrected, dazzDb, split, outputDirPath)
-	#2- count occurences of each corrected reads(in case of trimmed/split) and sort them
-	if corrector != "nas" and ((corrector != "lordec" and corrector != "halc" and corrector != "jabba" and corrector != None) or split) and corrector != "hercules" and corrector != "fmlrc" and corrector != "consent":
-		if corrector is not None:
-			newCorrectedFileName = outputDirPath + "/corrected_format_" + corrector + ".fa"
-			sortedCorrectedFileName = outputDirPath + "/corrected_sorted_by_" + corrector + ".fa"
-			sortedUncoFileName = outputDirPath + "/uncorrected_sorted_" + corrector + ".fa"
-			newUncoFileName =  outputDirPath + "/uncorrected_sorted_duplicated_" + corrector + ".fa"
-			sortedRefFileName = outputDirPath + "/reference_sorted_" + corrector + ".fa"
-			newRefFileName =  outputDirPath + "/reference_sorted_duplicated_" + corrector + ".fa"
-		else:
-			newCorrectedFileName = outputDirPath + "/corrected_formatted.fa"
-			sortedCorrectedFileName = outputDirPath + "/corrected_sorted.fa"
-			sortedUncoFileName = outputDirPath + "/uncorrected_sorted.fa"
-			newUncoFileName =  outputDirPath + "/uncorrected_sorted_duplicated.fa"
-			sortedRefFileName = outputDirPath + "/reference_sorted.fa"
-			newRefFileName =  outputDirPath + "/reference_sorted_duplicated.fa"
-	elif corrector is not None:
-		newCorrectedFileName = corrected
+		uncorrectedReads = uncorrected
+		referenceReads = reference
+		clipsNb = {}
+	sortedUncoFileName = outputDirPath + "/uncorrected_sorted" + suffix + ".fa"
+	sortedRefFileName = outputDirPath + "/reference_sorted" + suffix + ".fa"
+	runStage(cache, "sort_uncorrected", [uncorrectedReads], [], [sortedUncoFileName], lambda log: readAndSortFasta(uncorrectedReads, sortedUncoFileName))
+	runStage(cache, "sort_reference", [referenceReads], [], [sortedRefFileName], lambda log: readAndSortFasta(referenceReads, sortedRefFileName))
+	return clipsNb, uncorrectedReads, sortedUncoFileName, sortedRefFileName
+
+
+
+# format and sort the reads of one corrector, and index the shared sorted reference and uncorrected reads of its triplets
+def processReadsForAlignment(corrector, uncorrectedReads, sortedUncoFileName, sortedRefFileName, corrected, size, split, dazzDb, outputDirPath, cache=None):
+	stage = "_" + corrector if corrector is not None else ""
+	#1- correctly format the headers to be able to identify the corrected reads, count occurences of each corrected reads(in case of trimmed/split) and sort them
+	if corrector is not None:
 		sortedCorrectedFileName = outputDirPath + "/corrected_sorted_by_" + corrector + ".fa"
-		sortedUncoFileName = outputDirPath + "/uncorrected_sorted_" + corrector + ".fa"
-		newUncoFileName =  outputDirPath + "/uncorrected_sorted_duplicated_" + corrector + ".fa"
-		sortedRefFileName = outputDirPath + "/reference_sorted_" + corrector + ".fa"
-		newRefFileName =  outputDirPath + "/reference_sorted_duplicated_" + corrector + ".fa"
 	else:
-		newCorrectedFileName = corrected
 		sortedCorrectedFileName = outputDirPath + "/corrected_sorted.fa"
-		sortedUncoFileName = outputDirPath + "/uncorrected_sorted.fa"
-		newUncoFileName =  outputDirPath + "/uncorrected_sorted_duplicated.fa"
-		sortedRefFileName = outputDirPath + "/reference_sorted.fa"
-		newRefFileName =  outputDirPath + "/reference_sorted_duplicated.fa"
-	if simulator == "nanosim":
-		readAndSortFasta(uncorrected + "_reads.fasta", sortedUncoFileName)
-	elif simulator == "simlord":
-		readAndSortFasta(outputDirPath + "/" + basename(uncorrected) + ".fasta", sortedUncoFileName)
-	else:
-		readAndSortFasta(uncorrected, sortedUncoFileName)
-	if simulator is not None:
-		readAndSortFasta(outputDirPath + "/" + basename(uncorrected) + "_reference.fasta", sortedRefFileName)
-	else:
-		readAndSortFasta(reference, sortedRefFileName)
-	occurrenceEachRead = readAndSortFasta(newCorrectedFileName, sortedCorrectedFileName)
-	#3- duplicate reference and uncorrected reads files to prepare for POA (we want as many triplets as there are corrected reads)
-	duplicateRefReads(sortedRefFileName, sortedUncoFileName, occurrenceEachRead, size, newUncoFileName, newRefFileName)
-	return clipsNb
+	occurrenceEachRead = runStage(cache, "sort_corrected" + stage, [corrected, uncorrectedReads, dazzDb], [corrector, split], [sortedCorrectedFileName], lambda log: normaliseAndSortFasta(corrector, corrected, uncorrectedReads, dazzDb, split, outputDirPath, sortedCorrectedFileName), items=size)
+	#2- index the reference and uncorrected reads of each corrected read to prepare for POA (we want as many triplets as there are corrected reads)
+	tripletsFileName = outputDirPath + "/triplets" + stage + ".tsv"
+	runStage(cache, "triplets" + stage, [sortedRefFileName, sortedUncoFileName, sortedCorrectedFileName], [], [tripletsFileName], lambda log: tripletStore.build(sortedRefFileName, sortedUncoFileName, occurrenceEachRead, tripletsFileName), items=size)
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+"""*****************************************************************************
+ *   Authors: Camille Marchet  Pierre Morisse Antoine Limasset
+ *   Contact: camille.marchet@irisa.fr, IRISA/Univ Rennes/GenScale, Campus de Beaulieu, 35042 Rennes Cedex, France
+ *   Source: https://github.com/kamimrcht/benchmark-long-read-correction
+ *
+ *
+ *  This program is free software: you can redistribute it and/or modify
+ *  it under the terms of the GNU Affero General Public License as
+ *  published by the Free Software Foundation, either version 3 of the
+ *  License, or (at your option) any later version.
+ *
+ *  This program is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU Affero General Public License for more details.
+ *
+ *  You should have received a copy of the GNU Affero General Public License
+ *  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+*****************************************************************************"""
+
+
+import gzip
+import queue
+import itertools
+import threading
+from . import fastaIndex
+
+
+
+# reading of the reads files: FASTA or FASTQ, with sequences on one or several lines, uncompressed or compressed with gzip or bgzip
+# compressed files are decompressed in a background thread, that feeds their lines to the reader while it processes the previous ones
+GZIP_MAGIC = b"\x1f\x8b"
+# decompressed bytes passed at once to the reader, and blocks decompressed ahead of it
+BLOCK_BYTES = 1024 * 1024
+QUEUE_BLOCKS = 8
+
+# characters removed from sequences, as Biopython does
+SEQUENCE_WHITESPACES = str.maketrans("", "", " \t\r\n")
+
+
+
+def isGzip(fileName):
+	with open(fileName, 'rb') as f:
+		return f.read(2) == GZIP_MAGIC
+
+
+
+# put the lines of a gzipped file in blocks, until they are all read or stop is set
+def decompressLines(fileName, blocks, stop):
+	try:
+		with gzip.open(fileName, 'rt') as f:
+			lines = f.readlines(BLOCK_BYTES)
+			while lines and not stop.is_set():
+				blocks.put(lines)
+				lines = f.readlines(BLOCK_BYTES)
+		blocks.put(None)
+	except Exception as e:
+		blocks.put(e)
+
+
+
+# lines of a file (with universal newlines), decompressed in a background thread if it is gzipped
+def readLines(fileName):
+	if not isGzip(fileName):
+		with open(fileName) as f:
+			yield from f
+		return
+	blocks = queue.Queue(QUEUE_BLOCKS)
+	stop = threading.Event()
+	thread = threading.Thread(target=decompressLines, args=(fileName, blocks, stop), daemon=True)
+	thread.start()
+	try:
+		lines = blocks.get()
+		while lines is not None:
+			if isinstance(lines, Exception):
+				raise lines
+			yield from lines
+			lines = blocks.get()
+	finally:
+		# a reader stopped early must not leave the thread blocked on a full queue
+		stop.set()
+		while thread.is_alive():
+			try:
+				blocks.get(timeout=0.1)
+			except queue.Empty:
+				pass
+
+
+
+# records of the lines of a FASTA file (sequences on one or several lines) as (header, sequence), with the header and sequence Biopython gives
+# lines before the first record are skipped
+def parseFasta(fileLines):
+	header = None
+	lines = []
+	for line in fileLines:
+		if line[:1] == ">":
+			if header is not None:
+				yield header, "".join(lines).translate(SEQUENCE_WHITESPACES)
+			header = line[1:].rstrip()
+			lines = []
+		elif header is not None:
+			lines.append(line)
+	if header is not None:
+		yield header, "".join(lines).translate(SEQUENCE_WHITESPACES)
+
+
+
+# records of the lines of a FASTQ file (sequences and qualities on one or several lines) as (header line without "@", sequence)
+# the quality of a record ends when it is as long as its sequence, so that it can have lines starting with "@"
+def parseFastqLines(fileLines):
+	lines = iter(fileLines)
+	line = next(lines, "")
+	while line != "":
+		if line[0] != "@":
+			line = next(lines, "")
+			continue
+		header = line[1:]
+		sequence = []
+		line = next(lines, "")
+		while line != "" and line[0] != "+":
+			sequence.append(line)
+			line = next(lines, "")
+		sequence = "".join(sequence).translate(SEQUENCE_WHITESPACES)
+		qualityLength = 0
+		line = next(lines, "")
+		while line != "" and qualityLength < len(sequence):
+			qualityLength += len(line.rstrip("\r\n"))
+			line = next(lines, "")
+		yield header, sequence
+
+
+
+# lines of a file, and whether it is a FASTQ file (its first line starts with "@")
+def readFirstLine(fileName):
+	lines = readLines(fileName)
+	first = next(lines, "")
+	return itertools.chain([first], lines), first[:1] == "@"
+
+
+
+# records of a reads file (FASTA or FASTQ, compressed or not) as (header, sequence)
+def readRecords(fileName):
+	lines, fastq = readFirstLine(fileName)
+	if fastq:
+		return ((header.rstrip(), sequence) for header, sequence in parseFastqLines(lines))
+	return parseFasta(lines)
+
+
+
+# whether a file is an uncompressed FASTA file with each sequence on a single line (that can be read by ranges of bytes)
+def isOneLineFasta(fileName):
+	if isGzip(fileName):
+		return False
+	with open(fileName, 'rb') as f:
+		if f.read(1) != b">":
+			return False
+	index = fastaIndex.getIndex(fileName)
+	ends = index["offsets"][1:] + [index["size"]]
+	return all(end - offset == len(header.encode()) + length + 3 for header, offset, length, end in zip(index["headers"], index["offsets"], index["lengths"], ends))
+
+
+
+# whether a file is an uncompressed FASTA file, that can be indexed (see fastaIndex)
+def isPlainFasta(fileName):
+	if isGzip(fileName):
+		return False
+	with open(fileName) as f:
+		return f.read(1) != "@"
+
+
+
+# headers of the records of a reads file, in file order
+def getHeaders(fileName):
+	if isPlainFasta(fileName):
+		return fastaIndex.getIndex(fileName)["headers"]
+	return [header for header, sequence in readRecords(fileName)]
+
+
+
+# number of records of a reads file
+def countRecords(fileName):
+	if isPlainFasta(fileName):
+		return fastaIndex.getRecordNumber(fileName)
+	return sum(1 for record in readRecords(fileName))
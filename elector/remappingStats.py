@@ -8,14 +8,7 @@ import csv
 import shlex, subprocess
 from subprocess import Popen, PIPE, STDOUT
 from .utils import *
-
-
-
-#Launches subprocess
-def subprocessLauncher(cmd, argstdout=None, argstderr=None, argstdin=None):
-	args = shlex.split(cmd)
-	p = subprocess.Popen(args, stdin = argstdin, stdout = argstdout, stderr = argstderr).communicate()
-	return p
+from . import cigarDecoder
 
 
 
@@ -78,20 +71,17 @@ def computeIdentity(alignments, ids):
 	#Skip headers
 	while line[0] == "@":
 		line = f.readline()
+	batch = []
 	while line != '':
 		t = line.split("\t")
 		#Compute identity only for full alignments
 		if t[1] == "0" or t[1] == "16":
-			pos = t[3]
-			l = len(t[9])
-#			q = t[12]
-			q = line.split("MD:Z:")[1].split("\t")[0]
-			cigar = t[5]
-			nbs = [int(i) for i in (re.findall('\d+', q))]
-			dels = sum([int(i.split("D")[0]) for i in (re.findall('\d+D', cigar))])
-			clips = sum([int(i.split("S")[0]) for i in (re.findall('\d+S', cigar))])
-			out.write(str(sum(nbs) / (l+dels-clips) * 100) + '\n')
+			batch.append(t)
 		line = f.readline()
+		if len(batch) == cigarDecoder.BATCH_SIZE or (line == '' and len(batch) > 0):
+			for identity in cigarDecoder.identities(batch).tolist():
+				out.write(str(identity) + '\n')
+			batch = []
 	f.close()
 	out.close()
 
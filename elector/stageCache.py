@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+"""*****************************************************************************
+ *   Authors: Camille Marchet  Pierre Morisse Antoine Limasset
+ *   Contact: camille.marchet@irisa.fr, IRISA/Univ Rennes/GenScale, Campus de Beaulieu, 35042 Rennes Cedex, France
+ *   Source: https://github.com/kamimrcht/benchmark-long-read-correction
+ *
+ *
+ *  This program is free software: you can redistribute it and/or modify
+ *  it under the terms of the GNU Affero General Public License as
+ *  published by the Free Software Foundation, either version 3 of the
+ *  License, or (at your option) any later version.
+ *
+ *  This program is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU Affero General Public License for more details.
+ *
+ *  You should have received a copy of the GNU Affero General Public License
+ *  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+*****************************************************************************"""
+
+import sys
+import os
+import glob
+import json
+import hashlib
+from . import timings
+
+
+
+# cache of the pipeline stages, kept in the output directory
+# each stage is keyed by a hash of its name, of the content of its input files, of its parameters and of ELECTOR code
+# when the key of a stage matches the one of a previous run and its output files are unchanged, its outputs are reused
+# and its return value, standard output and log are replayed instead of running it again
+CACHE_DIR = ".elector_cache"
+
+
+
+def loadJson(fileName, default):
+	if not os.path.isfile(fileName):
+		return default
+	try:
+		with open(fileName) as f:
+			return json.load(f)
+	except ValueError:
+		return default
+
+
+
+def saveJson(fileName, value):
+	with open(fileName + ".tmp", 'w') as f:
+		json.dump(value, f)
+	os.replace(fileName + ".tmp", fileName)
+
+
+
+# size and modification time of a file, None if it does not exist
+def fileSignature(fileName):
+	if not os.path.isfile(fileName):
+		return None
+	st = os.stat(fileName)
+	return [st.st_size, st.st_mtime_ns]
+
+
+
+def hashFile(fileName):
+	h = hashlib.sha256()
+	with open(fileName, 'rb') as f:
+		chunk = f.read(1 << 20)
+		while chunk:
+			h.update(chunk)
+			chunk = f.read(1 << 20)
+	return h.hexdigest()
+
+
+
+def hashValue(value):
+	return hashlib.sha256(json.dumps(value, sort_keys=True).encode()).hexdigest()
+
+
+
+# hash of the python sources of ELECTOR, so that results of another version are not reused
+def codeDigest():
+	h = hashlib.sha256()
+	for fileName in sorted(glob.glob(os.path.dirname(os.path.realpath(__file__)) + "/*.py")):
+		with open(fileName, 'rb') as f:
+			h.update(f.read())
+	return h.hexdigest()
+
+
+
+def openCache(outputDirPath, enabled=True):
+	cacheDir = outputDirPath + "/" + CACHE_DIR
+	if not os.path.exists(cacheDir):
+		os.mkdir(cacheDir)
+	return {"dir": cacheDir, "enabled": enabled, "code": codeDigest(), "stages": loadJson(cacheDir + "/stages.json", {}), "digests": loadJson(cacheDir + "/digests.json", {})}
+
+
+
+# digest of an input file of a stage
+# the outputs of a cached stage are identified by the key of this stage, other files by their content (hashed once per size/modification time)
+def inputDigest(cache, fileName):
+	if fileName is None:
+		return None
+	fileName = os.path.abspath(fileName)
+	signature = fileSignature(fileName)
+	if signature is None:
+		return None
+	for stage in cache["stages"].values():
+		if stage["outputs"].get(fileName) == signature:
+			return hashValue([stage["key"], fileName])
+	known = cache["digests"].get(fileName)
+	if known is not None and known[:2] == signature:
+		return known[2]
+	digest = hashFile(fileName)
+	cache["digests"][fileName] = signature + [digest]
+	saveJson(cache["dir"] + "/digests.json", cache["digests"])
+	return digest
+
+
+
+def stageKey(cache, name, inputs, params):
+	return hashValue([name, cache["code"], [inputDigest(cache, i) for i in inputs], params])
+
+
+
+# write to several streams at once, to record what a stage prints and logs while still showing it
+class Tee:
+	def __init__(self, *streams):
+		self.streams = streams
+
+	def write(self, text):
+		for s in self.streams:
+			s.write(text)
+
+	def flush(self):
+		for s in self.streams:
+			s.flush()
+
+
+
+class Recorder:
+	def __init__(self):
+		self.chunks = []
+
+	def write(self, text):
+		self.chunks.append(text)
+
+	def flush(self):
+		pass
+
+	def getvalue(self):
+		return "".join(self.chunks)
+
+
+
+# results of the stage name saved by a previous run with the same key, None if it has to be run
+def savedResults(cache, name, key):
+	resultFile = cache["dir"] + "/" + name + ".json"
+	entry = cache["stages"].get(name)
+	if cache["enabled"] and entry is not None and entry["key"] == key and os.path.isfile(resultFile) and all(fileSignature(f) == signature for f, signature in entry["outputs"].items()):
+		return loadJson(resultFile, None)
+	return None
+
+
+
+# check whether the stage name can be reused, to avoid preparing work for it
+def isCached(cache, name, inputs, params):
+	return cache is not None and savedResults(cache, name, stageKey(cache, name, inputs, params)) is not None
+
+
+
+# run function(logFile) as the stage name, unless its results can be reused
+# inputs: files read by the stage, params: JSON-serializable parameters changing its results, outputs: files written by the stage
+# the return value of function must be JSON-serializable (tuples are given back as lists when reused)
+# items: number of items (e.g. reads) processed by the stage, reported with its timings
+def runStage(cache, name, inputs, params, outputs, function, logFile=None, items=None):
+	start = timings.startStage(name)
+	if cache is None:
+		result = function(logFile)
+		timings.endStage(start, items)
+		return result
+	key = stageKey(cache, name, inputs, params)
+	saved = savedResults(cache, name, key)
+	if saved is not None:
+		print("- Reusing results of stage " + name + " from a previous run")
+		sys.stdout.write(saved["stdout"])
+		if logFile is not None:
+			logFile.write(saved["log"])
+		timings.endStage(start, items, True)
+		return saved["result"]
+	# outputs of an interrupted run must not be reused
+	if name in cache["stages"]:
+		del cache["stages"][name]
+		saveJson(cache["dir"] + "/stages.json", cache["stages"])
+	recordedOut = Recorder()
+	recordedLog = Recorder()
+	stdout = sys.stdout
+	sys.stdout = Tee(stdout, recordedOut)
+	try:
+		result = function(Tee(logFile, recordedLog) if logFile is not None else None)
+	finally:
+		sys.stdout = stdout
+	saveJson(cache["dir"] + "/" + name + ".json", {"result": result, "stdout": recordedOut.getvalue(), "log": recordedLog.getvalue()})
+	cache["stages"][name] = {"key": key, "outputs": {os.path.abspath(f): fileSignature(f) for f in outputs if fileSignature(f) is not None}}
+	saveJson(cache["dir"] + "/stages.json", cache["stages"])
+	timings.endStage(start, items)
+	return result
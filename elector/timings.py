@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+
+"""*****************************************************************************
+ *   Authors: Camille Marchet  Pierre Morisse Antoine Limasset
+ *   Contact: camille.marchet@irisa.fr, IRISA/Univ Rennes/GenScale, Campus de Beaulieu, 35042 Rennes Cedex, France
+ *   Source: https://github.com/kamimrcht/benchmark-long-read-correction
+ *
+ *
+ *  This program is free software: you can redistribute it and/or modify
+ *  it under the terms of the GNU Affero General Public License as
+ *  published by the Free Software Foundation, either version 3 of the
+ *  License, or (at your option) any later version.
+ *
+ *  This program is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU Affero General Public License for more details.
+ *
+ *  You should have received a copy of the GNU Affero General Public License
+ *  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+*****************************************************************************"""
+
+import os
+import time
+import json
+import signal
+import resource
+import threading
+
+
+
+# wall time, CPU time, peak memory (RSS, in KB) and items processed by each stage of the run and by the external tools it launches
+# tools are summed by name, for each stage and for the whole run, and everything is written to timings.json next to log
+run = {"start": time.time(), "stages": [], "tools": {}, "output": None}
+# stage being run, tools calls are added to it
+current = {"name": None, "tools": {}, "remoteCpu": 0.0, "peak": 0}
+lock = threading.Lock()
+
+
+
+def setOutput(fileName):
+	run["output"] = fileName
+
+
+
+def cpuTime(who):
+	usage = resource.getrusage(who)
+	return usage.ru_utime + usage.ru_stime
+
+
+
+# reset the peak RSS of this process (Linux only, ignored elsewhere)
+def resetPeakMemory():
+	try:
+		with open("/proc/self/clear_refs", 'w') as f:
+			f.write("5")
+	except OSError:
+		pass
+
+
+
+# peak RSS of this process, in KB, since the last reset (since its start if it cannot be reset)
+def peakMemory():
+	try:
+		with open("/proc/self/status") as f:
+			for line in f:
+				if line.startswith("VmHWM:"):
+					return int(line.split()[1])
+	except OSError:
+		pass
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+
+def addTool(tools, name, wall, cpu, peak, items):
+	if name not in tools:
+		tools[name] = {"calls": 0, "wall": 0.0, "cpu": 0.0, "peakRssKb": 0, "items": 0}
+	tool = tools[name]
+	tool["calls"] += 1
+	tool["wall"] += wall
+	tool["cpu"] += cpu
+	tool["peakRssKb"] = max(tool["peakRssKb"], peak)
+	if items is not None:
+		tool["items"] += items
+
+
+
+# record a call to a tool
+# remote: the tool was run by a worker process of a pool, its CPU time is not seen in the resources used by the children of this process
+def recordTool(name, wall, cpu, peak, items=None, remote=False):
+	with lock:
+		addTool(current["tools"], name, wall, cpu, peak, items)
+		addTool(run["tools"], name, wall, cpu, peak, items)
+		current["peak"] = max(current["peak"], peak)
+		if remote:
+			current["remoteCpu"] += cpu
+
+
+
+# poll the peak RSS of a running process from /proc, until it exits
+# (the maximum RSS given by the kernel for a child includes the memory of its parent when it was spawned)
+# the process is killed if its RSS goes over limit KB
+def pollMemory(pid, watch, limit=None):
+	delay = 0.001
+	while True:
+		try:
+			with open("/proc/" + str(pid) + "/status") as f:
+				for line in f:
+					if line.startswith("State:") and line.split()[1] == "Z":
+						return
+					if line.startswith("VmHWM:"):
+						watch["peak"] = max(watch["peak"], int(line.split()[1]))
+					if line.startswith("VmRSS:") and limit is not None and int(line.split()[1]) > limit:
+						watch["killed"] = "memory"
+						os.kill(pid, signal.SIGKILL)
+		except OSError:
+			return
+		time.sleep(delay)
+		delay = min(2 * delay, 0.05)
+
+
+
+# current RSS of a running process, in KB (0 if not available)
+def processMemory(pid):
+	try:
+		with open("/proc/" + str(pid) + "/status") as f:
+			for line in f:
+				if line.startswith("VmRSS:"):
+					return int(line.split()[1])
+	except OSError:
+		pass
+	return 0
+
+
+
+# CPU time (in seconds) and peak RSS (in KB) used so far by a running process, read from /proc (0, 0 if not available)
+def processUsage(pid):
+	try:
+		with open("/proc/" + str(pid) + "/stat") as f:
+			# fields after the command name, which is between parentheses
+			fields = f.read().rsplit(")", 1)[1].split()
+		cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+		peak = 0
+		with open("/proc/" + str(pid) + "/status") as f:
+			for line in f:
+				if line.startswith("VmHWM:"):
+					peak = int(line.split()[1])
+		return cpu, peak
+	except (OSError, ValueError, IndexError):
+		return 0.0, 0
+
+
+
+# start measuring a process, right after it is launched
+def watchProcess(p, memoryLimit=None):
+	watch = {"start": time.time(), "peak": 0, "killed": None}
+	watch["thread"] = threading.Thread(target=pollMemory, args=(p.pid, watch, memoryLimit), daemon=True)
+	watch["thread"].start()
+	return watch
+
+
+
+# wait for a process watched with watchProcess and record it as a call to the tool name (its executable by default)
+def waitProcess(p, watch, name=None, items=None):
+	watch["thread"].join()
+	_, status, usage = os.wait4(p.pid, 0)
+	p.returncode = os.waitstatus_to_exitcode(status)
+	if name is None:
+		name = os.path.basename(p.args[0] if isinstance(p.args, list) else p.args.split()[0])
+	recordTool(name, time.time() - watch["start"], usage.ru_utime + usage.ru_stime, watch["peak"], items)
+	return p.returncode
+
+
+
+def startStage(name):
+	resetPeakMemory()
+	with lock:
+		current["name"] = name
+		current["tools"] = {}
+		current["remoteCpu"] = 0.0
+		current["peak"] = 0
+	return {"wall": time.time(), "cpu": cpuTime(resource.RUSAGE_SELF), "children": cpuTime(resource.RUSAGE_CHILDREN)}
+
+
+
+def endStage(start, items=None, cached=False):
+	with lock:
+		cpu = cpuTime(resource.RUSAGE_SELF) - start["cpu"] + cpuTime(resource.RUSAGE_CHILDREN) - start["children"] + current["remoteCpu"]
+		run["stages"].append({"name": current["name"], "wall": time.time() - start["wall"], "cpu": cpu, "peakRssKb": max(peakMemory(), current["peak"]), "items": items, "cached": cached, "tools": current["tools"]})
+		current["name"] = None
+		current["tools"] = {}
+	save()
+
+
+
+# write timings.json, after each stage so that an interrupted run still reports where its time was spent
+def save():
+	if run["output"] is None:
+		return
+	total = {"wall": time.time() - run["start"], "cpu": sum(stage["cpu"] for stage in run["stages"]), "peakRssKb": max([0] + [stage["peakRssKb"] for stage in run["stages"]])}
+	with open(run["output"] + ".tmp", 'w') as f:
+		json.dump({"total": total, "stages": run["stages"], "tools": run["tools"]}, f, indent=1)
+	os.replace(run["output"] + ".tmp", run["output"])
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+"""*****************************************************************************
+ *   Authors: Camille Marchet  Pierre Morisse Antoine Limasset
+ *   Contact: camille.marchet@irisa.fr, IRISA/Univ Rennes/GenScale, Campus de Beaulieu, 35042 Rennes Cedex, France
+ *   Source: https://github.com/kamimrcht/benchmark-long-read-correction
+ *
+ *
+ *  This program is free software: you can redistribute it and/or modify
+ *  it under the terms of the GNU Affero General Public License as
+ *  published by the Free Software Foundation, either version 3 of the
+ *  License, or (at your option) any later version.
+ *
+ *  This program is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU Affero General Public License for more details.
+ *
+ *  You should have received a copy of the GNU Affero General Public License
+ *  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+*****************************************************************************"""
+
+
+import os
+from . import fastaIndex
+
+
+
+# store of the (reference, uncorrected, corrected) triplets aligned by poa, replacing copies of the reference and uncorrected reads
+# a corrected read split or trimmed in k fragments needs its reference and uncorrected reads k times: instead of duplicating them,
+# the store has one line per fragment, in the order of the sorted corrected reads:
+# byte offset of the reference read in the sorted reference file, byte offset of the uncorrected read in the sorted uncorrected file, header of the triplet (header_k)
+# masterSplitter reads the reads at these offsets
+
+
+
+# write the store of the sorted reference and uncorrected reads (same headers, in the same order)
+# occurrenceEachRead: number of corrected fragments of each header, as returned by the sort of the corrected reads
+def build(sortedRef, sortedUnco, occurrenceEachRead, storeName):
+	refIndex = fastaIndex.getIndex(sortedRef)
+	uncoIndex = fastaIndex.getIndex(sortedUnco)
+	with open(storeName + ".tmp", 'w') as out:
+		for header, refOffset, uncoOffset in zip(refIndex["headers"], refIndex["offsets"], uncoIndex["offsets"]):
+			for times in range(occurrenceEachRead.get(header, 0)):
+				out.write(str(refOffset) + "\t" + str(uncoOffset) + "\t" + header + "_" + str(times) + "\n")
+	os.replace(storeName + ".tmp", storeName)
+	return storeName
+
+
+
+# number of triplets of a store
+def getSize(storeName):
+	with open(storeName) as f:
+		return sum(1 for line in f)
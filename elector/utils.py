@@ -30,6 +30,10 @@ import re
 import copy
 import argparse
 import glob
+from . import timings
+from . import fastaIndex
+from . import readsReader
+from .processRunner import subprocessLauncher, runJobs, LimitError
 
 
 
@@ -85,12 +89,27 @@ def checkReadFiles(readfiles):
 
 
 ######### utils for subprocess #########
-# launch subprocess
-def subprocessLauncher(cmd, argstdout=None, argstderr=None,	 argstdin=None):
-	args = shlex.split(cmd)
-	#~ p = subprocess.call(args, stdin = argstdin, stdout = argstdout, stderr = argstderr)
-	p = subprocess.Popen(args, stdin = argstdin, stdout = DEVNULL, stderr = DEVNULL).communicate()
-	return p
+# external tools are all launched through the runner of processRunner (subprocessLauncher, runJobs)
+
+
+
+######### utils for shards #########
+# a run can be split in N shards, run separately (e.g. on several machines) and merged with "elector merge"
+# shard i/N processes the i-th of N consecutive groups of reads, in the order of the sorted reads files
+def parseShard(text):
+	try:
+		i, n = [int(x) for x in text.split("/")]
+	except ValueError:
+		dieToFatalError("-shard expects i/N, e.g. 1/4.")
+	if n < 1 or i < 1 or i > n:
+		dieToFatalError("-shard expects i/N with 1 <= i <= N.")
+	return i, n
+
+
+
+# first and last (excluded) indexes of the items of shard (i, N) among nbItems
+def shardRange(nbItems, shard):
+	return (shard[0] - 1) * nbItems // shard[1], shard[0] * nbItems // shard[1]
 
 
 
@@ -105,15 +124,12 @@ def getFiles(pathToFiles, name): #for instance name can be "*.txt"
 
 
 
-# return number of reads in a fasta
+# return number of reads in a reads file (FASTA or FASTQ, compressed or not)
 def getFileReadNumber(fileName):
-	cmdGrep = """grep ">" -c """ + fileName
-	val = subprocess.check_output(['bash','-c', cmdGrep])
-	return int(val.decode('ascii'))
+	return readsReader.countRecords(fileName)
 
 
 
 def getCorrectedSequence(fileName, header):
-	cmdGrep = """grep -A 1 """ + header + " " + fileName + "| tail -1"
-	val = subprocess.check_output(['bash','-c', cmdGrep])
-	return str(val.decode('ascii'))
+	sequence = fastaIndex.getSequence(fileName, header)
+	return sequence if sequence is not None else ""
@@ -16,7 +16,7 @@ setup(
     long_description = open('README.md').read(),
     url = "https://github.com/kamimrcht/ELECTOR",
     
-    install_requires = ['biopython'],
+    install_requires = ['biopython', 'numpy'],
     include_package_data = True,
     
     classifiers = [
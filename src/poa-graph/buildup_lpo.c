@@ -542,7 +542,7 @@ LPOSequence_T *buildup_progressive_lpo(int nseq,LPOSequence_T **all_seqs,
 	perm[seq_id_in_cluster[i] + j] = (nseq_tot++);
       }
     }
-    for (i=0; i<nseq_tot; i++) printf ("%d ", perm[i]); printf ("\n");
+    //~ for (i=0; i<nseq_tot; i++) printf ("%d ", perm[i]); printf ("\n");
 
     reindex_lpo_source_seqs (new_seq, perm);
     FREE (perm);
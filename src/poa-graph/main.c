@@ -22,7 +22,7 @@ int main(int argc,char *argv[])
   LPOSequence_T **input_seqs=NULL;
   FILE *errfile=stderr,*logfile=NULL,*lpo_file_out=NULL,*po_list_file=NULL,*seqCorrected_ifile=NULL,*seqUncorrected_ifile=NULL,*seqReference_ifile=NULL, *seq_ifile=NULL;
   char *print_matrix_letters=NULL,*fasta_out=NULL,*po_out=NULL,*matrix_filename="./blosum80.mat",
-    *seq_filename=NULL, *unco_seq_filename=NULL,*ref_seq_filename=NULL,*frame_dna_filename=NULL,*po_filename=NULL,*po2_filename=NULL,
+    *seq_filename=NULL, *unco_seq_filename=NULL,*ref_seq_filename=NULL,*triplets_filename=NULL,*frame_dna_filename=NULL,*po_filename=NULL,*po2_filename=NULL,
     *po_list_filename=NULL, *hbmin=NULL,*numeric_data=NULL,*numeric_data_name="Nmiscall",
     *dna_to_aa=NULL,*pair_score_file=NULL,*aafreq_file=NULL,*termval_file=NULL,
     *bold_seq_name=NULL,*subset_file=NULL,*subset2_file=NULL,*rm_subset_file=NULL,
@@ -33,6 +33,10 @@ int main(int argc,char *argv[])
   int show_allele_evidence=0,please_collapse_lines=0,keep_all_links=0;
   int remove_listed_seqs=0,remove_listed_seqs2=0,please_report_similarity;
   int do_global=1, do_progressive=0, do_preserve_sequence_order=1;
+  int server_mode=0;
+  size_t request_size=0,response_size=0;
+  char *request=NULL,*response=NULL;
+  FILE *response_file=NULL;
   char *reference_seq_name="CONSENS%d",*clustal_out=NULL;
 
   black_flag_init(argv[0],PROGRAM_VERSION);
@@ -50,6 +54,13 @@ int main(int argc,char *argv[])
 "  -remove FILE           Filter MSA to exclude list of seqs in file.\n"
 "  -remove2 FILE          Filter second MSA to exclude list of seqs in file.\n"
 "  -read_msa_list FILE    Read an MSA from each filename listed in file.\n"
+"  -triplets_fasta FILE   Read interleaved reference/corrected/uncorrected\n"
+"                           FASTA records (- for stdin).\n"
+"  -server                Persistent worker: read buckets of interleaved\n"
+"                           triplets from stdin, each prefixed by its size\n"
+"                           in bytes on its own line, and write each MSA\n"
+"                           in PIR format on stdout, prefixed the same way.\n"
+"                           A size of 0 (or end of input) stops the worker.\n"
 "  -tolower               Force FASTA/MSA sequences to lowercase\n"
 "                           (nucleotides in our matrix files)\n"
 "  -toupper               Force FASTA/MSA sequences to UPPERCASE\n"
@@ -68,7 +79,7 @@ int main(int argc,char *argv[])
 "  -hbmin VALUE           Include in heaviest bundle sequences with\n"
 "                           percent ID (as a fraction) >= value.\n"
 "\nOUTPUT:\n"
-"  -pir FILE              Write out MSA in PIR format.\n"
+"  -pir FILE              Write out MSA in PIR format (- for stdout).\n"
 "  -clustal FILE          Write out MSA in CLUSTAL format.\n"
 "  -po FILE               Write out MSA in PO format.\n"
 "  -preserve_seqorder     Write out MSA with sequences in their input order.\n"
@@ -109,6 +120,8 @@ int main(int argc,char *argv[])
     ARGGET("-uncorrected_reads_fasta",unco_seq_filename); /* READ FASTA FILE FOR ALIGNMENT */
     ARGGET("-reference_reads_fasta",ref_seq_filename); /* READ FASTA FILE FOR ALIGNMENT */
     ARGGET("-pathMatrix",matrix_filename); /* READ FASTA FILE FOR ALIGNMENT */
+    ARGGET("-triplets_fasta",triplets_filename); /* READ INTERLEAVED TRIPLETS, - FOR STDIN */
+    ARGMATCH("-server",server_mode); /* ALIGN TRIPLET BUCKETS FROM STDIN UNTIL TOLD TO STOP */
     //~ NEXTARG(matrix_filename); /* NON-FLAG ARG SHOULD BE MATRIX FILE */
   }
 
@@ -260,7 +273,7 @@ int main(int argc,char *argv[])
       exit_code=1; /* SIGNAL ERROR CONDITION */
       goto free_memory_and_exit;
     }
-    seq_ifile=fopen(fasta_out,"w");
+    seq_ifile=strcmp(fasta_out,"-") ? fopen(fasta_out,"w") : stdout;
     //~ fprintf(errfile,"...Read %d sequences from sequence file %s...\n",nseq,seq_filename);
     for (i=0; i<nseq; i++) {
 		n_input_seqs = 0;
@@ -282,9 +295,78 @@ int main(int argc,char *argv[])
       //~ }
       //~ freeMem(input_seqs, nseq, seq, n_input_seqs);
     }
-    fclose(seq_ifile);
+    if (seq_ifile != stdout)
+      fclose(seq_ifile);
+    else
+      fflush(seq_ifile);
 
   }
+  else if (server_mode) {
+    /* PERSISTENT WORKER: THE MATRIX IS READ ONCE, THEN EACH BUCKET OF TRIPLETS
+       COMES AS "SIZE\nDATA" ON STDIN AND ITS MSA GOES BACK THE SAME WAY ON STDOUT */
+    while (fscanf(stdin,"%zu",&request_size)==1 && getc(stdin)=='\n' && request_size>0) {
+      CALLOC (request, request_size, char);
+      if (fread(request,1,request_size,stdin)!=request_size) {
+        WARN_MSG(USERR,(ERRTXT,"Truncated bucket of %zu bytes on stdin.\nExiting",
+		      request_size),"$Revision: 1.2.2.9 $");
+        exit_code=1; /* SIGNAL ERROR CONDITION */
+        FREE (request);
+        break;
+      }
+      seq_ifile = fmemopen(request, request_size, "r");
+      seq = NULL;
+      nseq = read_fasta (seq_ifile, &seq, do_switch_case, &comment);
+      fclose (seq_ifile);
+      response_file = open_memstream(&response, &response_size);
+      for (i=0; i+2<nseq; i+=3) {
+        n_input_seqs = 0;
+        input_seqs[n_input_seqs++] = &(seq[i]);
+        input_seqs[n_input_seqs++] = &(seq[i+1]);
+        input_seqs[n_input_seqs++] = &(seq[i+2]);
+        initialize_seqs_as_lpo(3,&(seq[i]),&score_matrix);
+        buildAndAnalysePOMSA (n_input_seqs, lpo_out, input_seqs, score_matrix,  use_aggressive_fusion, do_progressive, pair_score_file, do_global,  do_preserve_sequence_order,  comment, response_file, fasta_out, errfile,ibundle);
+      }
+      fclose (response_file);
+      fprintf(stdout,"%zu\n",response_size);
+      fwrite(response,1,response_size,stdout);
+      fflush(stdout);
+      /* NOTHING IS KEPT FROM ONE BUCKET TO THE NEXT */
+      for (i=0; i<nseq; i++)
+        free_lpo_sequence(&(seq[i]),FALSE);
+      if (nseq>0) FREE (seq);
+      FREE (response);
+      FREE (request);
+      FREE (comment);
+    }
+    n_input_seqs = 0;
+    nseq = 0;
+  }
+  else if (triplets_filename) {
+    /* ONE STREAM, RECORDS COME BY THREE: REFERENCE, CORRECTED, UNCORRECTED */
+    seq_ifile = strcmp(triplets_filename,"-") ? fopen (triplets_filename, "r") : stdin;
+    if (seq_ifile == NULL) {
+      WARN_MSG(USERR,(ERRTXT,"Couldn't open sequence file %s.\nExiting",
+		      triplets_filename),"$Revision: 1.2.2.9 $");
+      exit_code=1; /* SIGNAL ERROR CONDITION */
+      goto free_memory_and_exit;
+    }
+    nseq = read_fasta (seq_ifile, &seq, do_switch_case, &comment);
+    if (seq_ifile != stdin)
+      fclose (seq_ifile);
+    seq_ifile=strcmp(fasta_out,"-") ? fopen(fasta_out,"w") : stdout;
+    for (i=0; i+2<nseq; i+=3) {
+      n_input_seqs = 0;
+      input_seqs[n_input_seqs++] = &(seq[i]);
+      input_seqs[n_input_seqs++] = &(seq[i+1]);
+      input_seqs[n_input_seqs++] = &(seq[i+2]);
+      initialize_seqs_as_lpo(3,&(seq[i]),&score_matrix);
+      buildAndAnalysePOMSA (n_input_seqs, lpo_out, input_seqs, score_matrix,  use_aggressive_fusion, do_progressive, pair_score_file, do_global,  do_preserve_sequence_order,  comment, seq_ifile, fasta_out, errfile,ibundle);
+    }
+    if (seq_ifile != stdout)
+      fclose(seq_ifile);
+    else
+      fflush(seq_ifile);
+  }
 
 
 
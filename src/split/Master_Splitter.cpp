@@ -349,6 +349,29 @@ uint64_t count_lines(const string& str){
 
 
 
+// read the next triplet of a triplet store: offsets of its reference and uncorrected reads in the sorted files, and its header
+// the reads are read at these offsets, with the header of the triplet (all empty at the end of the store)
+void read_from_store(ifstream& inStore, ifstream& inR, ifstream& in1, string& href, string& ref, string& hS1, string& S1){
+    string line;
+    if(not getline(inStore,line) or line.empty()){
+        href=ref=hS1=S1="";
+        return;
+    }
+    size_t tab1(line.find('\t')),tab2(line.find('\t',tab1+1));
+    inR.clear();
+    inR.seekg(stoull(line.substr(0,tab1)),inR.beg);
+    in1.clear();
+    in1.seekg(stoull(line.substr(tab1+1,tab2-tab1-1)),in1.beg);
+    getline(inR,href);
+    getline(inR,ref);
+    getline(in1,hS1);
+    getline(in1,S1);
+    href=">"+line.substr(tab2+1);
+    hS1=href;
+}
+
+
+
 int main(int argc, char ** argv){
 
     string inputRef(argv[1]);
@@ -362,9 +385,19 @@ int main(int argc, char ** argv){
     uint64_t max_nuc_amount=(stoi(argv[9])),nuc_amount(0);
     double SIZE_CORRECTED_READ_THRESHOLD=(stod(argv[10]));
     string outDir(argv[11]);
+    // optional triplet store ("-" for none): the reference and uncorrected reads of each corrected read are read through it instead of sequentially
+    string inputStore(argc>12 and string(argv[12])!="-" ? argv[12] : "");
+    // optional range of reads [first_read, last_read) to split (shards), in the order of the output blocks: the reads before it are skipped without being split
+    uint64_t first_read(argc>13 ? stoull(argv[13]) : 0),last_read(argc>14 ? stoull(argv[14]) : UINT64_MAX);
+    bool useStore(not inputStore.empty());
     //~ uint64_t nb_line((count_lines(inputRef)));
+    // "-" as output prefix: triplets are streamed on stdout instead of nb_file chunk files
+    bool streaming(outputRef=="-");
     int64_t factor(max_nuc_amount/(nb_file));
-    cout<<max_nuc_amount<<" "<<nb_file<<" "<<factor<<endl;
+    (streaming ? cerr : cout)<<max_nuc_amount<<" "<<nb_file<<" "<<factor<<endl;
+    if(streaming){
+        ios_base::sync_with_stdio(false);
+    }
 
     factor+=1;
     int small_reads(0);
@@ -373,7 +406,12 @@ int main(int argc, char ** argv){
     string ref,S1,S2;
     string href,hS1,hS2,s_ref,s_S1,s_S2,line;
     uint64_t position_ref(0),position_cor(0),position_err(0);
-    ifstream inR(inputRef),in1(inputS1),in2(inputS2),progress_in(progress_file);
+    ifstream inR(inputRef),in1(inputS1),in2(inputS2),progress_in(progress_file),inStore;
+    if(useStore){
+        inStore.open(inputStore);
+    }
+    // with a store, the position of the reference reads is the one in the store
+    ifstream& inRefs(useStore ? inStore : inR);
     if(progress_in.good() and not progress_in.eof()){
         getline(progress_in,line);
         position_ref=stoll(line);
@@ -381,37 +419,44 @@ int main(int argc, char ** argv){
         position_cor=stoll(line);
         getline(progress_in,line);
         position_err=stoll(line);
-        inR.seekg (position_ref, inR.beg);
+        inRefs.seekg (position_ref, inRefs.beg);
         in1.seekg (position_cor, in1.beg);
         in2.seekg (position_err, in2.beg);
     }
 
-    vector<ofstream> outR(nb_file),out1(nb_file),out2(nb_file);
-    for(uint i(0);i<nb_file;++i){
+    vector<ofstream> outR(streaming ? 0 : nb_file),out1(streaming ? 0 : nb_file),out2(streaming ? 0 : nb_file);
+    for(uint i(0);i<outR.size();++i){
         outR[i].open(outputRef+to_string(i),ofstream::trunc);
         out1[i].open(outputS1+to_string(i),ofstream::trunc);
         out2[i].open(outputS2+to_string(i),ofstream::trunc);
     }
     uint64_t i(0);
-    while(not inR.eof() and not in2.eof() and not in1.eof()){
+    while(i<last_read and not inRefs.eof() and not in2.eof() and (useStore or not in1.eof())){
         if(i>max_nuc_amount){
             break;
         }
         //~ #pragma omp parallel for ordered schedule(dynamic)
         for(uint ii=(0);ii<1000;++ii){
-            if(i>max_nuc_amount){
+            if(i>max_nuc_amount or i>=last_read){
                 continue;
             }
             #pragma omp ordered
             {
-                getline(inR,href);
-                getline(inR,ref);
-                getline(in1,hS1);
-                getline(in1,S1);
+                if(useStore){
+                    read_from_store(inStore,inR,in1,href,ref,hS1,S1);
+                }else{
+                    getline(inR,href);
+                    getline(inR,ref);
+                    getline(in1,hS1);
+                    getline(in1,S1);
+                }
                 getline(in2,hS2);
                 getline(in2,S2);
             }
-            if(ref.size()>2){
+            if(ref.size()>2 and i<first_read){
+				href=ref=S1=S2="";
+				++i;
+            }else if(ref.size()>2){
 				if ((double) S2.size() / ref.size() >= SIZE_CORRECTED_READ_THRESHOLD){
                     best_split(ref,S1,S2,s_ref,s_S1,s_S2,href);
                     if((fragment(s_ref))<=1){
@@ -432,9 +477,14 @@ int main(int argc, char ** argv){
 				#pragma omp ordered
 				{
 					//~ cout<<i<<" "<<factor<<" "<<i/factor<<endl;
-					outR[i/factor]<<s_ref;
-					out1[i/factor]<<s_S1;
-					out2[i/factor]<<s_S2;
+					if(streaming){
+						// one block per read: fragment counts, then the ref, uncorrected and corrected fragments
+						cout<<"#"<<fragment(s_ref)<<" "<<fragment(s_S1)<<" "<<fragment(s_S2)<<"\n"<<s_ref<<s_S1<<s_S2;
+					}else{
+						outR[i/factor]<<s_ref;
+						out1[i/factor]<<s_S1;
+						out2[i/factor]<<s_S2;
+					}
 					nuc_amount+=s_ref.size();
 				}
 				href=s_ref=s_S1=s_S2=ref=S1=S2="";
@@ -444,27 +494,31 @@ int main(int argc, char ** argv){
 
         }
     }
-    for(uint i(0);i<nb_file;++i){
+    for(uint i(0);i<outR.size();++i){
         outR[i].close();
         out1[i].close();
         out2[i].close();
     }
-    ofstream out_small(outDir + "/small_reads.txt");
-    ofstream out_wrong(outDir + "/wrongly_cor_reads.txt");
-    out_small<<small_reads<<endl;
-    out_wrong<<wrong_reads<<endl;
-    out_small.close();
-    out_wrong.close();
+    if(streaming){
+        cout<<"#END "<<small_reads<<" "<<wrong_reads<<endl;
+    }else{
+        ofstream out_small(outDir + "/small_reads.txt");
+        ofstream out_wrong(outDir + "/wrongly_cor_reads.txt");
+        out_small<<small_reads<<endl;
+        out_wrong<<wrong_reads<<endl;
+        out_small.close();
+        out_wrong.close();
+    }
 
 
-    if(inR.eof() or in2.eof() or in1.eof() ){
+    if(i>=last_read or inRefs.eof() or in2.eof() or (not useStore and in1.eof())){
 		const char* cProgress = (outDir + "/progress.txt").c_str();
 		remove(cProgress);
         return 0;
     }
     ofstream out(progress_file);
 
-    out<<(uint64_t)inR.tellg()<<"\n";
+    out<<(uint64_t)inRefs.tellg()<<"\n";
     out<<(uint64_t)in1.tellg()<<"\n";
     out<<(uint64_t)in2.tellg()<<"\n"<<flush;
     out.close();
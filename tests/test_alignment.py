@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+"""*****************************************************************************
+ *   Authors: Camille Marchet  Pierre Morisse Antoine Limasset
+ *   Contact: camille.marchet@irisa.fr, IRISA/Univ Rennes/GenScale, Campus de Beaulieu, 35042 Rennes Cedex, France
+ *   Source: https://github.com/kamimrcht/benchmark-long-read-correction
+ *
+ *
+ *  This program is free software: you can redistribute it and/or modify
+ *  it under the terms of the GNU Affero General Public License as
+ *  published by the Free Software Foundation, either version 3 of the
+ *  License, or (at your option) any later version.
+ *
+ *  This program is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU Affero General Public License for more details.
+ *
+ *  You should have received a copy of the GNU Affero General Public License
+ *  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+*****************************************************************************"""
+
+
+import io
+import os
+from elector import alignment
+
+
+
+# merged msa of the poa output of 20 reads (split reads of up to 11 fragments, padding columns in corrected lines)
+# the expected file was written by Donatello, which mergeMsa replaces
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+
+
+def readData(name):
+	with open(DATA + "/" + name) as f:
+		return f.read()
+
+
+
+def test_mergeMsa():
+	out = io.StringIO()
+	alignment.mergeMsa(readData("poa_msa.fa"), out)
+	assert out.getvalue() == readData("poa_msa_merged.fa")
+
+
+
+# mergeBatches gives mergeMsa the msa of one read at a time
+def test_mergeMsaByRead():
+	lines = readData("poa_msa.fa").split("\n")
+	reads = {}
+	for i in range(0, len(lines) - 1, 6):
+		reads.setdefault(lines[i], []).append("\n".join(lines[i:i + 6]))
+	out = io.StringIO()
+	for msa in reads.values():
+		alignment.mergeMsa("\n".join(msa), out)
+	assert out.getvalue() == readData("poa_msa_merged.fa")
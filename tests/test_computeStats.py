@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+"""*****************************************************************************
+ *   Authors: Camille Marchet  Pierre Morisse Antoine Limasset
+ *   Contact: camille.marchet@irisa.fr, IRISA/Univ Rennes/GenScale, Campus de Beaulieu, 35042 Rennes Cedex, France
+ *   Source: https://github.com/kamimrcht/benchmark-long-read-correction
+ *
+ *
+ *  This program is free software: you can redistribute it and/or modify
+ *  it under the terms of the GNU Affero General Public License as
+ *  published by the Free Software Foundation, either version 3 of the
+ *  License, or (at your option) any later version.
+ *
+ *  This program is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU Affero General Public License for more details.
+ *
+ *  You should have received a copy of the GNU Affero General Public License
+ *  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+*****************************************************************************"""
+
+
+import os
+import json
+import shutil
+from elector import computeStats
+from elector import msaReader
+
+
+
+# metrics of a fixed msa of 60 reads (split, trimmed and extended reads, clips), compared with those of the original per-column code
+# the homopolymer ratio and histogram are those of the run-length homopolymer analysis, which changed their definition
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+REPORTED_HOMOPOLYMER_THRESHOLD = 5
+# values of summarizeMetrics, in order
+SUMMARY_NAMES = ["nbReads", "throughput", "uncorThroughput", "precision", "recall", "corBasesRate", "errorRate", "uncorCorBasesRate", "uncorErrorRate", "missingSize", "GCRateRef", "GCRateCorr", "indelsubsUncorr", "indelsubsCorr", "ratioHomopolymers", "lenAllCorrectedReads", "countReadSplit", "countReadTrimmed", "countReadExtended", "extendedBasesCount"]
+
+
+
+def readData(name):
+	with open(DATA + "/" + name) as f:
+		return f.read()
+
+
+
+# the msa is copied in the temporary directory of a test, where its index is written
+def copyMsa(outDir):
+	return shutil.copy(DATA + "/metrics_msa.fa", str(outDir))
+
+
+
+def fixtureMetrics(msa, start=0, end=None):
+	return computeStats.computeMetrics(msa, None, REPORTED_HOMOPOLYMER_THRESHOLD, json.loads(readData("metrics_clips.json")), start, end)
+
+
+
+# the summary values are compared exactly, after the json conversion of their tuples
+def checkMetrics(metrics, outDir):
+	summary = dict(zip(SUMMARY_NAMES, computeStats.summarizeMetrics(metrics)))
+	assert json.loads(json.dumps(summary)) == json.loads(readData("metrics_summary.json"))
+	computeStats.writeReadMetrics(str(outDir) + "/per_read_metrics.txt", metrics)
+	computeStats.writeHomopolymers(str(outDir) + "/homopolymers.txt", metrics["homopolymers"])
+	with open(str(outDir) + "/per_read_metrics.txt") as f:
+		assert f.read() == readData("metrics_per_read.txt")
+	with open(str(outDir) + "/homopolymers.txt") as f:
+		assert f.read() == readData("metrics_homopolymers.txt")
+
+
+
+def test_metrics(tmp_path):
+	checkMetrics(fixtureMetrics(copyMsa(tmp_path)), tmp_path)
+
+
+
+# metrics computed by ranges of reads (as by the worker pool, or by shards) and merged
+def test_mergedRangeMetrics(tmp_path):
+	msa = copyMsa(tmp_path)
+	ranges = msaReader.readRanges(msa, 3)
+	assert len(ranges) == 3
+	checkMetrics(computeStats.mergeMetrics([json.loads(json.dumps(fixtureMetrics(msa, start, end))) for (start, end), headers in ranges]), tmp_path)